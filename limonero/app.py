@@ -22,12 +22,22 @@ from limonero.cache import cache
 from limonero.data_source_api import DataSourceDetailApi, DataSourceListApi, \
     DataSourcePermissionApi, DataSourceUploadApi, DataSourceInferSchemaApi, \
     DataSourcePrivacyApi, DataSourceDownload, DataSourceSampleApi, \
-    DataSourceInitializationApi
+    DataSourceInitializationApi, DataSourceExportApi, \
+    DataSourceMaterializeApi, DataSourceMaterializeExecutionApi, \
+    DataSourceSampleExecutionApi, DataSourceUploadStatusApi, \
+    DataSourceConvertApi, DataSourceConvertExecutionApi, \
+    DataSourceCompactApi, DataSourceCompactExecutionApi, \
+    DataSourcePartitionsApi
 from limonero.model_api import ModelDetailApi, ModelListApi, ModelDownloadApi
 from limonero.models import db, DataSource, Storage
 from limonero.py4j_init import init_jvm
+from limonero.util.serialization import output_json
+from limonero.util.compaction import COMPACTION_FORMATS, compact_small_files
+from limonero.util.snapshot import refresh_expired_snapshots
+from limonero.util.upload_session import purge_sessions
 from limonero.storage_api import StorageDetailApi, StorageListApi, \
-    StorageMetadataApi
+    StorageMetadataApi, StorageMetadataRefreshApi, StorageMetadataTableApi, \
+    StoragePoolsApi
 from cryptography.fernet import Fernet
 
 from marshmallow.exceptions import ValidationError
@@ -100,6 +110,7 @@ def create_app(main_module: bool = False):
     # CORS
     CORS(app, resources={r"/*": {"origins": "*"}})
     api = Api(app)
+    api.representation('application/json')(output_json)
     
     # Swagger
     swaggerui_blueprint = get_swaggerui_blueprint(
@@ -123,11 +134,28 @@ def create_app(main_module: bool = False):
     mappings = {
         '/datasources': DataSourceListApi,
         '/datasources/upload': DataSourceUploadApi,
+        '/datasources/upload/status': DataSourceUploadStatusApi,
         '/datasources/infer-schema/<int:data_source_id>': DataSourceInferSchemaApi,
         '/datasources/sample/<int:data_source_id>': DataSourceSampleApi,
+        '/datasources/sample/<int:data_source_id>/executions/<execution_id>':
+            DataSourceSampleExecutionApi,
         '/datasources/initialize/<status>/<int:data_source_id>': 
             DataSourceInitializationApi,
         '/datasources/<int:data_source_id>': DataSourceDetailApi,
+        '/datasources/<int:data_source_id>/export': DataSourceExportApi,
+        '/datasources/<int:data_source_id>/partitions':
+            DataSourcePartitionsApi,
+        '/datasources/<int:data_source_id>/convert/<target>':
+            DataSourceConvertApi,
+        '/datasources/<int:data_source_id>/convert/executions/<execution_id>':
+            DataSourceConvertExecutionApi,
+        '/datasources/<int:data_source_id>/compact': DataSourceCompactApi,
+        '/datasources/<int:data_source_id>/compact/executions/<execution_id>':
+            DataSourceCompactExecutionApi,
+        '/datasources/<int:data_source_id>/materialize':
+            DataSourceMaterializeApi,
+        '/datasources/<int:data_source_id>/materialize/executions/'
+        '<execution_id>': DataSourceMaterializeExecutionApi,
         '/datasources/<int:data_source_id>/permission/<int:user_id>':
             DataSourcePermissionApi,
         '/models': ModelListApi,
@@ -136,6 +164,11 @@ def create_app(main_module: bool = False):
         '/storages': StorageListApi,
         '/storages/<int:storage_id>': StorageDetailApi,
         '/storages/metadata/<int:storage_id>': StorageMetadataApi,
+        '/storages/metadata/<int:storage_id>/refresh':
+            StorageMetadataRefreshApi,
+        '/storages/metadata/<int:storage_id>/tables/<table_name>':
+            StorageMetadataTableApi,
+        '/storages/pools': StoragePoolsApi,
     }
     grouped_mappings = itertools.groupby(sorted(mappings.items()),
                                          key=lambda path: path[1])
@@ -150,6 +183,39 @@ def create_app(main_module: bool = False):
                      methods=['GET'], endpoint='ModelDownloadApi',
                      view_func=ModelDownloadApi.as_view('download_model'))
     migrate = Migrate(app, db)
+
+    @app.cli.command('refresh-snapshots')
+    def refresh_snapshots():
+        """ Materializes again data source snapshots older than their TTL """
+        data_sources = DataSource.query.filter(
+            DataSource.enabled, DataSource.snapshot_url.isnot(None),
+            DataSource.snapshot_ttl.isnot(None))
+        total = refresh_expired_snapshots(data_sources.all())
+        logging.getLogger(__name__).info(
+            gettext('%(total)s snapshots refreshed.', total=total))
+
+    @app.cli.command('compact-data-sources')
+    def compact_data_sources():
+        """
+        Compacts directory data sources with many small files (config
+        compaction.min_files)
+        """
+        data_sources = DataSource.query.filter(
+            DataSource.enabled,
+            DataSource.format.in_(COMPACTION_FORMATS))
+        total = compact_small_files(data_sources.all())
+        logging.getLogger(__name__).info(
+            gettext('%(total)s data sources compacted.', total=total))
+
+    @app.cli.command('purge-uploads')
+    def purge_uploads():
+        """ Removes abandoned upload sessions and their chunks """
+        max_age = (app.config.get('LIMONERO_CONFIG') or {}).get(
+            'upload_max_age', 86400)
+        total = purge_sessions(max_age)
+        logging.getLogger(__name__).info(
+            gettext('%(total)s upload sessions removed.', total=total))
+
     app.handle_exception
 
     @babel.localeselector
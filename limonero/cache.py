@@ -1,4 +1,48 @@
 # -*- coding: utf-8 -*-
+from flask import current_app
 from flask_caching import Cache
 
 cache = Cache(config={'CACHE_TYPE': 'simple'})
+
+CONFIG_KEY = 'LIMONERO_CONFIG'
+DEFAULT_METADATA_TIMEOUT = 300
+
+# Representations of a data source, depending on who is requesting it
+FULL = 'full'
+RESTRICTED = 'restricted'
+NAMES_ONLY = 'names'
+DATA_SOURCE_VARIANTS = (FULL, RESTRICTED, NAMES_ONLY)
+
+
+def _data_source_key(data_source_id, variant):
+    return f'data_source:{data_source_id}:{variant}'
+
+
+def _metadata_timeout():
+    config = current_app.config.get(CONFIG_KEY) or {}
+    return int(config.get('metadata_cache_timeout', DEFAULT_METADATA_TIMEOUT))
+
+
+def get_data_source_payload(data_source_id, variant, updated):
+    """
+    Returns the serialized data source, if cached.
+    Entries are stored with the data source's last update, so a stale entry
+    (e.g. changed by other worker/process) is never returned.
+    """
+    entry = cache.get(_data_source_key(data_source_id, variant))
+    if entry is not None and entry[0] == updated:
+        return entry[1]
+    return None
+
+
+def set_data_source_payload(data_source_id, variant, updated, payload):
+    cache.set(_data_source_key(data_source_id, variant), (updated, payload),
+              timeout=_metadata_timeout())
+
+
+def invalidate_data_source(*data_source_ids):
+    """ Removes all cached representations for the data sources """
+    # delete_many stops at the first key not cached
+    for data_source_id in data_source_ids:
+        for variant in DATA_SOURCE_VARIANTS:
+            cache.delete(_data_source_key(data_source_id, variant))
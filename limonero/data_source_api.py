@@ -4,25 +4,21 @@ import codecs
 import collections
 import csv
 import datetime
-import decimal
-import gzip
-import io
+import itertools
 import json
 import logging
 import math
 import operator
 import os
-import pyarrow.parquet as pq
 import re
+import time
 import uuid
 import zipfile
+from contextlib import closing
 from io import BytesIO, StringIO
 from urllib.parse import urlparse
-from pathlib import Path
 
-
-import pymysql
-from flask import Response, current_app
+from flask import Response, current_app, has_app_context
 from flask import g as flask_g
 from flask import request, stream_with_context
 from flask.views import MethodView
@@ -30,22 +26,48 @@ from flask_babel import gettext
 from flask_restful import Resource
 from marshmallow.exceptions import ValidationError
 from py4j.protocol import Py4JJavaError
-from pyarrow import fs
-from sqlalchemy import inspect
-from sqlalchemy.orm import joinedload, subqueryload
+from pyarrow import ArrowInvalid, fs
+from sqlalchemy import func, inspect, select
+from sqlalchemy.orm import (Session, joinedload, object_session,
+                            selectinload, subqueryload)
 from sqlalchemy.sql.elements import or_
 from werkzeug.exceptions import NotFound
 
 import limonero.hdfs_util as hu
-from limonero.util import get_hdfs_conf, parse_hdfs_extra_params, strip_accents
-from limonero.util.jdbc import get_hive_data_type, get_mysql_data_type
+import limonero.util.hive as hive_util
+from limonero.cache import (FULL, NAMES_ONLY, RESTRICTED,
+                            get_data_source_payload, invalidate_data_source,
+                            set_data_source_payload)
+from limonero.util import (SPECIAL_DELIMITERS, get_hdfs_conf,
+                           parse_hdfs_extra_params, strip_accents)
+from limonero.util.serialization import stream_ndjson, wants_ndjson
+from limonero.util.http_cache import (cache_headers, current_locale,
+                                      is_not_modified, make_etag, not_modified)
+from limonero.util.dialects import get_dialect
+from limonero.util.pool import PoolTimeout
+import limonero.util.compaction as compaction
+import limonero.util.compression as compression
+import limonero.util.conversion as conversion
+import limonero.util.partitions as partitions
+import limonero.util.snapshot as snapshot
+import limonero.util.upload_session as upload_session
+from limonero.util.execution import (ExecutionCancelled, ExecutionTimeout,
+                                     TooManyExecutions, get_execution_manager)
+from limonero.util.export import (EXPORT_FORMATS, database_batches,
+                                   is_database_backed, write_batches)
+from limonero.util.hive import QueryTimeout, get_hive_pool
+from limonero.util.schema_resolver import resolve_schema
+from limonero.util.snapshot import (has_fresh_snapshot, remove_snapshot,
+                                    sample_snapshot, snapshot_batches)
 
 from .app_auth import User, requires_auth
 from .schema import (DataSourceListResponseSchema, DataSourceItemResponseSchema,
-                     DataSourceCreateRequestSchema, DataSourcePrivacyResponseSchema, partial_schema_factory)
-from .models import (Attribute, AttributePrivacy, DataType, db, DataSource, DataSourcePermission, DataSourceFormat,
-                     DataSourceInitialization,
-                     PermissionType, Storage)
+                     DataSourceCreateRequestSchema, DataSourcePrivacyResponseSchema, get_schema,
+                     partial_schema_factory)
+from .models import (Attribute, AttributeForeignKey, AttributePrivacy, DataType, db, DataSource, DataSourcePermission, DataSourceFormat,
+                     DataSourceInitialization, DataSourceVariable,
+                     PermissionType, Storage, StorageType,
+                     UploadStatus)
 
 _ = gettext
 log = logging.getLogger(__name__)
@@ -73,10 +95,19 @@ TIME_FORMATS = {
     ' %H:%M:%S': 'hh:mm:ss',
 }
 
-SPECIAL_DELIMITERS = {'{tab}': '\t',
-                      '{new_line \\n}': '\n',
-                      '{new_line \\r\\n}': '\r\n'
-                     }
+# Download tokens in listings are valid for 600s. Cached listings are
+# revalidated at least once in this interval (in seconds).
+DOWNLOAD_TOKEN_WINDOW = 300
+
+# Maximum number of data sources requested by id (?ids=1,2,3)
+MAX_IDS = 500
+
+# Collections not handled by the bulk update of data sources
+BULK_UNSUPPORTED_FIELDS = {'variables', 'permissions'}
+
+# Fields visible only to data source owner or administrators
+RESTRICTED_FIELDS = ['storage.url', 'storage.client_url',
+                     'storage.extra_params', 'url', 'original_url']
 
 def apply_filter(query, args, name, transform=None, transform_name=None):
     result = query
@@ -93,6 +124,20 @@ def is_logged_user_owner_or_admin(data_source):
             'ADMINISTRATOR' in flask_g.user.permissions)
 
 
+def _get_variant(data_source):
+    """ Representation of data source that can be returned to user """
+    return FULL if is_logged_user_owner_or_admin(data_source) else RESTRICTED
+
+
+def _dump_data_source(data_source, variant):
+    if variant == NAMES_ONLY:
+        return {'attributes': [{'name': attr.name} for attr in
+                               data_source.attributes]}
+    exclude = RESTRICTED_FIELDS if variant == RESTRICTED else []
+    return get_schema(DataSourceItemResponseSchema,
+                      exclude=exclude).dump(data_source)
+
+
 def _filter_by_permissions(data_sources, permissions, consider_public=True):
     if flask_g.user.id not in (0, 1):  # It is not a inter service call
         sub_query = DataSourcePermission.query.with_entities(
@@ -109,16 +154,68 @@ def _filter_by_permissions(data_sources, permissions, consider_public=True):
     return data_sources
 
 
+def _get_writable_data_source(data_source_id):
+    """ Data source the user can change (MANAGE or WRITE), or None """
+    filtered = _filter_by_permissions(
+        DataSource.query, [PermissionType.MANAGE, PermissionType.WRITE])
+    return filtered.filter(DataSource.id == data_source_id).first()
+
+
 class DataSourceListApi(Resource):
     """ REST API for listing class DataSource """
 
+    @staticmethod
+    def _get_many(ids):
+        """
+        Returns data sources by id, in the same order. Used by other services,
+        so payloads are read from cache and missing ones are loaded in a
+        single query.
+        """
+        versions = _filter_by_permissions(
+            DataSource.query, list(PermissionType.values())).filter(
+                DataSource.id.in_(ids)).with_entities(
+                    DataSource.id, DataSource.updated,
+                    DataSource.user_id).all()
+        payloads = {}
+        missing = {}
+        for version in versions:
+            variant = _get_variant(version)
+            payload = get_data_source_payload(version.id, variant,
+                                              version.updated)
+            if payload is None:
+                missing[version.id] = (version, variant)
+            else:
+                payloads[version.id] = payload
+        if missing:
+            data_sources = DataSource.query.filter(
+                DataSource.id.in_(list(missing.keys()))).options(
+                    joinedload(DataSource.storage),
+                    selectinload(DataSource.attributes),
+                    selectinload(DataSource.variables),
+                    selectinload(DataSource.permissions))
+            for data_source in data_sources:
+                version, variant = missing[data_source.id]
+                payload = _dump_data_source(data_source, variant)
+                set_data_source_payload(data_source.id, variant,
+                                        version.updated, payload)
+                payloads[data_source.id] = payload
+        return {'data': [payloads[i] for i in ids if i in payloads]}
+
     @staticmethod
     @requires_auth
     def get():
         result, result_code = {'status': 'ERROR',
                                'message': gettext('Internal error')}, 500
+        headers = {}
         # noinspection PyBroadException
         try:
+            if request.args.get('ids'):
+                ids = [int(i) for i in request.args.get('ids').split(',')
+                       if i.strip().isdigit()]
+                if len(ids) > MAX_IDS:
+                    return {'status': 'ERROR', 'message': gettext(
+                        'At most %(max)s ids are allowed.', max=MAX_IDS)}, 400
+                return DataSourceListApi._get_many(ids)
             simple = False
             if request.args.get('simple') != 'true':
                 only = None
@@ -158,9 +255,6 @@ class DataSourceListApi(Resource):
                     DataSource.description.ilike('%%{}%%'.format(query)),
                     DataSource.tags.ilike('%%{}%%'.format(query))
                 ))
-            if not simple:
-                data_sources = data_sources.options(
-                    joinedload(DataSource.attributes))
             data_sources = _filter_by_permissions(
                 data_sources, list(PermissionType.values()))
 
@@ -169,6 +263,21 @@ class DataSourceListApi(Resource):
             if formats:
                 data_sources = data_sources.filter(DataSource.format.in_(
                     formats))
+
+            # Any change in the listing changes the number of rows or the
+            # most recent update. Download tokens expire, so they are
+            # renewed at least once per window.
+            total, last_update = data_sources.with_entities(
+                func.count(DataSource.id), func.max(DataSource.updated)).one()
+            etag = make_etag(
+                sorted(request.args.items(multi=True)), flask_g.user.id,
+                sorted(flask_g.user.permissions or []), current_locale(),
+                total, last_update, wants_ndjson(),
+                int(time.time() // DOWNLOAD_TOKEN_WINDOW), weak=True)
+            if is_not_modified(etag):
+                return not_modified(etag, 'DataSourceListApi')
+            headers = cache_headers(etag, 'DataSourceListApi')
+
             sort = request.args.get('sort', 'name')
             if sort not in ['name', 'id', 'user_id', 'user_name']:
                 sort = 'id'
@@ -182,6 +291,9 @@ class DataSourceListApi(Resource):
             page = request.args.get('page') or '1'
 
             if request.args.get('list') is None:
+                if not simple:
+                    data_sources = data_sources.options(
+                        joinedload(DataSource.attributes))
                 if page is not None and page.isdigit():
                     page_size = int(request.args.get('size', 20))
                     page = int(page)
@@ -195,9 +307,9 @@ class DataSourceListApi(Resource):
                         # No pagination
                         pagination = data_sources
                     result = {
-                        'data': DataSourceListResponseSchema(
-                            many=True, only=only,
-                            exclude=('permissions',)).dump(
+                        'data': get_schema(
+                            DataSourceListResponseSchema, many=True,
+                            only=only, exclude=('permissions',)).dump(
                             pagination.items),
                         'pagination': {
                             'page': page, 'size': page_size,
@@ -207,18 +319,23 @@ class DataSourceListApi(Resource):
                     }
             else:
                 only = ('id', 'name', 'tags')
-                result = DataSourceListResponseSchema(
-                    many=True, only=only).dump(data_sources)
+                schema = get_schema(DataSourceListResponseSchema, only=only)
+                if wants_ndjson():
+                    # Whole catalog, sent while it is read from database
+                    return stream_ndjson(data_sources, schema, headers)
+                result = schema.dump(data_sources, many=True)
             db.session.commit()
             result_code = 200
 
         except NotFound:
             result_code = 404
             result = {'data': []}
+            headers = {}
         except Exception as ex:
             log.exception(str(ex))
+            headers = {}
 
-        return result, result_code
+        return result, result_code, headers
 
     @staticmethod
     @requires_auth
@@ -228,8 +345,8 @@ class DataSourceListApi(Resource):
             message=gettext("Missing json in the request body")), 400
         if request.json is not None:
             request_schema = DataSourceCreateRequestSchema()
-            response_schema = DataSourceItemResponseSchema(
-                exclude=('url', 'storage.url'))
+            response_schema = get_schema(DataSourceItemResponseSchema,
+                                         exclude=('url', 'storage.url'))
             json_data = request.json
 
             json_data['user_id'] = json_data.get('user_id', flask_g.user.id)
@@ -294,25 +411,29 @@ class DataSourceDetailApi(Resource):
         names_only = request.args.get('attributes_name') == 'true'
 
         data_sources = DataSource.query
-        data_source = _filter_by_permissions(data_sources,
-                                             list(PermissionType.values()))
-
-        data_source = data_source.filter(DataSource.id == data_source_id)
-        data_source = data_source.first()
-
-        if data_source is not None:
-            if names_only:
-                attributes = {'attributes': [{'name': attr.name} for attr in
-                                             data_source.attributes]}
-                return attributes
-            else:
-                if not is_logged_user_owner_or_admin(data_source):
-                    exclude = ['storage.url', 'storage.client_url',
-                            'storage.extra_params', 'url' ]
-                else:
-                    exclude = []
-                return DataSourceItemResponseSchema(exclude=exclude).dump(
-                        data_source)
+        data_sources = _filter_by_permissions(data_sources,
+                                              list(PermissionType.values()))
+        data_sources = data_sources.filter(DataSource.id == data_source_id)
+
+        # Single indexed lookup, enough to validate the copy kept by client
+        version = data_sources.with_entities(
+            DataSource.id, DataSource.updated, DataSource.user_id).first()
+
+        if version is not None:
+            variant = NAMES_ONLY if names_only else _get_variant(version)
+            etag = make_etag(version.id, version.updated, variant,
+                             current_locale())
+            if is_not_modified(etag):
+                return not_modified(etag, 'DataSourceDetailApi')
+            headers = cache_headers(etag, 'DataSourceDetailApi')
+
+            payload = get_data_source_payload(version.id, variant,
+                                              version.updated)
+            if payload is None:
+                payload = _dump_data_source(data_sources.first(), variant)
+                set_data_source_payload(version.id, variant, version.updated,
+                                        payload)
+            return payload, 200, headers
         else:
             return dict(status="ERROR",
                         message=gettext("%(type)s not found.",
@@ -326,9 +447,7 @@ class DataSourceDetailApi(Resource):
             message=gettext("%(type)s not found.",
                             type=gettext('Data source'))), 404
 
-        filtered = _filter_by_permissions(
-            DataSource.query, [PermissionType.MANAGE, PermissionType.WRITE])
-        data_source = filtered.filter(DataSource.id == data_source_id).first()
+        data_source = _get_writable_data_source(data_source_id)
         if data_source is not None:
             if not is_logged_user_owner_or_admin(data_source):
                 result, result_code = dict(
@@ -370,18 +489,14 @@ class DataSourceDetailApi(Resource):
             # for attr in json_data.get('attributes', ''):
             #    del attr['attribute_privacy']
 
-            response_schema = DataSourceItemResponseSchema()
+            response_schema = get_schema(DataSourceItemResponseSchema)
 
             try:
                 # Ignore missing fields to allow partial updates
                 entity = request_schema.load(json_data, partial=True)
 
                 entity.id = data_source_id
-                filtered = _filter_by_permissions(
-                    DataSource.query,
-                    [PermissionType.MANAGE, PermissionType.WRITE])
-                data_source = filtered.filter(
-                    DataSource.id == data_source_id).first()
+                data_source = _get_writable_data_source(data_source_id)
 
                 if entity.format in [DataSourceFormat.TEXT]:
                     # Attributes are not supported
@@ -400,7 +515,11 @@ class DataSourceDetailApi(Resource):
                                 "Lookup tables can only "
                                 "have 2 attributes (id and description)")), 401
                     else:
-                        data_source = db.session.merge(entity)
+                        if DataSourceDetailApi._use_bulk_patch(json_data):
+                            DataSourceDetailApi._bulk_patch(
+                                data_source, entity, json_data)
+                        else:
+                            data_source = db.session.merge(entity)
                         db.session.commit()
                         result = {
                                 'status': 'OK',
@@ -430,6 +549,108 @@ class DataSourceDetailApi(Resource):
                 db.session.rollback()
         return result, result_code
 
+    @staticmethod
+    def _use_bulk_patch(json_data):
+        """
+        Attributes are updated in bulk. Other collections are not supported
+        by the bulk path and require merging the whole object graph.
+        """
+        return ('attributes' in json_data and
+                not BULK_UNSUPPORTED_FIELDS.intersection(json_data.keys()))
+
+    @staticmethod
+    def _bulk_patch(data_source, entity, json_data):
+        """
+        Updates a data source and its attributes using a few bulk statements.
+        Current attributes are compared with the incoming ones: only changed
+        ones are updated, new ones are inserted and missing ones are removed.
+        Bulk operations bypass ORM events, so `updated` is set explicitly.
+        """
+        for prop in inspect(DataSource).column_attrs:
+            if prop.key in json_data and prop.key != 'id':
+                setattr(data_source, prop.key, getattr(entity, prop.key))
+
+        attr_columns = [c.key for c in inspect(Attribute).column_attrs
+                        if c.key not in ('id', 'data_source_id')]
+        privacy_columns = [c.key for c in inspect(AttributePrivacy).column_attrs
+                           if c.key not in ('id', 'attribute_id')]
+
+        current = {row.id: row for row in db.session.query(
+            *[getattr(Attribute, c) for c in ['id'] + attr_columns]).filter(
+                Attribute.data_source_id == data_source.id)}
+        current_privacy = dict(db.session.query(
+            AttributePrivacy.attribute_id, AttributePrivacy.id).filter(
+                AttributePrivacy.attribute_id.in_(list(current.keys()))))
+
+        incoming = [] if entity.format == DataSourceFormat.TEXT else list(
+            zip(json_data.get('attributes') or [], entity.attributes))
+
+        to_update, to_insert, privacy_to_update, privacy_to_insert = (
+            [], [], [], [])
+        new_with_privacy = []
+        kept = set()
+        for raw, attr in incoming:
+            values = {k: getattr(attr, k) for k in attr_columns if k in raw}
+            privacy = None
+            if raw.get('attribute_privacy') and attr.attribute_privacy:
+                privacy = {k: getattr(attr.attribute_privacy, k)
+                           for k in privacy_columns
+                           if k in raw['attribute_privacy']}
+            old = current.get(raw.get('id'))
+            if old is not None:
+                kept.add(old.id)
+                changed = {k: v for k, v in values.items()
+                           if getattr(old, k) != v}
+                if changed:
+                    to_update.append(dict(changed, id=old.id))
+                if privacy and old.id in current_privacy:
+                    privacy_to_update.append(
+                        dict(privacy, id=current_privacy[old.id]))
+                elif privacy:
+                    privacy_to_insert.append(dict(privacy, attribute_id=old.id))
+            else:
+                values['data_source_id'] = data_source.id
+                if privacy:
+                    new_with_privacy.append((values, privacy))
+                else:
+                    to_insert.append(values)
+
+        removed = [attr_id for attr_id in current if attr_id not in kept]
+        if removed:
+            AttributePrivacy.query.filter(
+                AttributePrivacy.attribute_id.in_(removed)).delete(
+                    synchronize_session=False)
+            AttributeForeignKey.query.filter(or_(
+                AttributeForeignKey.from_attribute_id.in_(removed),
+                AttributeForeignKey.to_attribute_id.in_(removed))).delete(
+                    synchronize_session=False)
+            Attribute.query.filter(Attribute.id.in_(removed)).delete(
+                synchronize_session=False)
+        if to_update:
+            db.session.bulk_update_mappings(Attribute, to_update)
+        if to_insert:
+            db.session.bulk_insert_mappings(Attribute, to_insert)
+        if new_with_privacy:
+            # Generated ids are required to link privacy information
+            mappings = [values for values, _ in new_with_privacy]
+            db.session.bulk_insert_mappings(Attribute, mappings,
+                                            return_defaults=True)
+            privacy_to_insert.extend(
+                dict(privacy, attribute_id=values['id'])
+                for values, privacy in new_with_privacy)
+        if privacy_to_update:
+            db.session.bulk_update_mappings(AttributePrivacy,
+                                            privacy_to_update)
+        if privacy_to_insert:
+            db.session.bulk_insert_mappings(AttributePrivacy,
+                                            privacy_to_insert)
+
+        if any([removed, to_update, to_insert, new_with_privacy,
+                privacy_to_update, privacy_to_insert]):
+            data_source.updated = datetime.datetime.utcnow()
+        db.session.add(data_source)
+        return data_source
+
 
 class DataSourcePermissionApi(Resource):
     """ REST API for sharing a DataSource """
@@ -484,6 +705,8 @@ class DataSourcePermissionApi(Resource):
                                 user_login=form['user_login'],
                                 permission=form['permission'])
 
+                        # Permissions are part of data source representation
+                        data_source.updated = datetime.datetime.utcnow()
                         db.session.add(permission)
                         db.session.commit()
                         result, result_code = {'message': action_performed,
@@ -521,6 +744,7 @@ class DataSourcePermissionApi(Resource):
                 DataSourcePermission.user_id == user_id).first()
             if permission is not None:
                 try:
+                    data_source.updated = datetime.datetime.utcnow()
                     db.session.delete(permission)
                     db.session.commit()
                     result, result_code = dict(
@@ -538,22 +762,10 @@ class DataSourcePermissionApi(Resource):
         return result, result_code
 
 class DataSourceUploadApi(Resource):
-    """ REST API for upload a DataSource """
-
-    @staticmethod
-    def _get_tmp_path(hdfs, parsed, filename):
-        final_path = parsed.path.replace('//', '/')
-        tmp_dir = f'{final_path}/tmp/upload/{filename}'
-
-        str_uri = f'{parsed.scheme}://{parsed.hostname}'
-        # if parsed.port:
-        #    hdfs = fs.HadoopFileSystem(str_uri, port=int(parsed.port))
-        #else:
-        #    hdfs = fs.HadoopFileSystem(str_uri)
-
-        if not hu.exists(hdfs, tmp_dir):
-            hu.mkdirs(hdfs, tmp_dir)
-        return tmp_dir
+    """
+    REST API for upload a DataSource. Files are sent in chunks (resumable.js),
+    possibly in parallel, tracked by an upload session (util.upload_session).
+    """
 
     @staticmethod
     def _get_ids(request):
@@ -562,6 +774,28 @@ class DataSourceUploadApi(Resource):
         chunk_number = request.args.get('resumableChunkNumber', type=int)
         return identifier, filename, chunk_number
 
+    @staticmethod
+    def _get_user():
+        # noinspection PyBroadException
+        try:
+            return getattr(flask_g, 'user')
+        except:
+            return User(id=1, login='admin',
+                        email='admin@lemonade',
+                        first_name='admin',
+                        last_name='admin',
+                        locale='en')
+
+    @staticmethod
+    def _get_storage(storage_id):
+        storage = Storage.query.get(storage_id)
+        if storage is None:
+            raise ValueError(gettext('Storage not found.'))
+        if storage.type != StorageType.HDFS:
+            raise ValueError(
+                'Unsupported storage type: {}'.format(storage.type))
+        return storage
+
     @staticmethod
     @requires_auth
     def get():
@@ -577,37 +811,14 @@ class DataSourceUploadApi(Resource):
                 result, result_code = {'status': 'ERROR', 'message': gettext(
                     'Missing required parameters')}, 400
             else:
-                storage = Storage.query.get(storage_id)
-                if storage.type != 'HDFS':
-                    raise ValueError(
-                        'Unsupported storage type: {}'.format(storage.type))
-                parsed = urlparse(storage.url)
-
-                if parsed.scheme == 'file':
-                    chunk_filename = f'/tmp/{filename}.part{chunk_number:09d}'
-                    chunk_path = Path(chunk_filename)
-                    if not chunk_path.exists():
-                        result, result_code = {'status': 'OK',
-                                           'message': gettext('Not found')}, 404
-                elif parsed.scheme == 'hdfs':
-                    str_uri = hu.get_parsed_uri(parsed, False)
-                    extra_params = parse_hdfs_extra_params(storage.extra_params)
-                    if parsed.port:
-                        hdfs = fs.HadoopFileSystem(str_uri, user=extra_params.user or 'hadoop',
-                            port=int(parsed.port))
-                    else:
-                        hdfs = fs.HadoopFileSystem(str_uri, user=extra_params.user or 'hadoop',)
-                    tmp_path = DataSourceUploadApi._get_tmp_path(
-                        hdfs, parsed, filename)
-
-                    chunk_filename = f'{tmp_path}/{filename}.part{chunk_number:09d}'
-                    current_app.logger.debug(f'Creating chunk: {chunk_filename}')
-
-                    # time.sleep(1)
-                    if not hu.exists(hdfs, chunk_filename):
-                        # Let resumable.js know this chunk does not exists
-                        #  and needs to be uploaded
-                        result, result_code = {'status': 'OK',
+                storage = DataSourceUploadApi._get_storage(storage_id)
+                session = upload_session.get_session(
+                    storage, DataSourceUploadApi._get_user().id, identifier)
+                if (session is None or chunk_number not in
+                        upload_session.get_received_chunks(session)):
+                    # Let resumable.js know this chunk does not exists
+                    #  and needs to be uploaded
+                    result, result_code = {'status': 'OK',
                                            'message': gettext('Not found')}, 404
 
             return result, result_code
@@ -616,6 +827,141 @@ class DataSourceUploadApi(Resource):
             return {'status': 'ERROR',
                         'message': gettext('Internal error')}, 400
 
+    @staticmethod
+    def _get_format(filename):
+        # Format of compressed files (e.g. people.csv.gz) is in the name
+        extension = compression.strip_extension(filename).rsplit(
+            '.', 1)[-1].lower()
+        if extension == 'csv':
+            return DataSourceFormat.CSV
+        elif extension in ('json', 'jsonl', 'ndjson'):
+            return DataSourceFormat.JSON
+        elif extension == 'xml':
+            return DataSourceFormat.XML_FILE
+        elif extension == 'txt':
+            return DataSourceFormat.TEXT
+        return DataSourceFormat.UNKNOWN
+
+    @staticmethod
+    def _infer_delimiter(filesystem, path):
+        """ Most frequent delimiter in the beginning of the file """
+        with compression.open_input(filesystem, path) as stream:
+            head = stream.read(65536).decode('utf8', errors='ignore')
+        count_delimiters = collections.defaultdict(int)
+        for ch in head:
+            if ch in [',', ';', '\t']:
+                count_delimiters[ch] += 1
+        sorted_delim = sorted(
+            list(count_delimiters.items()),
+            key=operator.itemgetter(1),
+            reverse=True)
+        return sorted_delim[0][0] if sorted_delim else ','
+
+    @staticmethod
+    def _complete(storage, session, filesystem, parsed, to_parquet=False):
+        """ Merges the chunks of a complete upload and creates the DataSource """
+        filename = session.filename
+        final_filename = f'{uuid.uuid4().hex}_{filename}'
+
+        # time to merge all files
+        parsed_path = parsed.path or ''
+        if parsed_path.endswith('/'):
+            parsed_path = parsed_path[:-1]
+        if parsed_path:
+            data_path = f'/{parsed_path.strip("/")}/limonero/data'
+        else:
+            data_path = '/limonero/data'
+        target_path = f'{data_path}/{final_filename}'
+
+        if hu.exists(filesystem, target_path):
+            raise ValueError(gettext(
+                'A file with same name already exists. Try to upload the '
+                'file again.'))
+        checksum = upload_session.merge(filesystem, parsed, session,
+                                        target_path)
+
+        storage_url = storage.url.rstrip('/')
+        data_url = (f'file://{data_path}' if parsed.scheme == 'file'
+                    else f'{storage_url}/limonero/data')
+        url = f'{data_url}/{final_filename}'
+        if upload_session.use_deduplication():
+            existing_url = upload_session.find_duplicate(
+                filesystem, storage, checksum, target_path)
+            if existing_url is not None:
+                # Same content already stored, use the existing file
+                filesystem.delete_file(target_path)
+                target_path = urlparse(existing_url).path
+                url = existing_url
+
+        user = DataSourceUploadApi._get_user()
+        ds = DataSource(
+            format=DataSourceUploadApi._get_format(filename),
+            name=filename,
+            storage_id=storage.id,
+            description=gettext('Imported in Limonero'),
+            enabled=True,
+            url=url,
+            checksum=checksum,
+            estimated_size_in_mega_bytes=(session.total_size or 0) / 1024.0 ** 2,
+            user_id=user.id,
+            user_login=user.login,
+            user_name='{} {}'.format(
+                user.first_name,
+                user.last_name).strip())
+
+        db.session.add(ds)
+        upload_session.close_session(filesystem, parsed, session)
+
+        if compression.strip_extension(filename)[-4:] in [
+                '.csv', '.CSV', '.tsv', '.TSV']:
+            # noinspection PyBroadException
+            try:
+                # try to infer the field delimiter
+                delim = DataSourceUploadApi._infer_delimiter(
+                    filesystem, target_path)
+                ds.is_first_line_header = True
+                ds.attribute_delimiter = delim
+                ds.format = DataSourceFormat.CSV
+                DataSourceUploadApi._try_infer_schema(ds, delim)
+            except:
+                # in case of error, save the upload information
+                db.session.commit()
+            if to_parquet and ds.attributes:
+                DataSourceUploadApi._convert_to_parquet(
+                    ds, filesystem, target_path, data_path, data_url)
+        else:
+            db.session.commit()
+        response_schema = get_schema(DataSourceItemResponseSchema)
+        return {'status': 'OK', 'data': response_schema.dump(ds)}, 200
+
+    @staticmethod
+    def _wants_parquet(storage):
+        """ Conversion requested by upload (to_parquet) or storage """
+        if request.args.get('to_parquet') in ('1', 'true'):
+            return True
+        extra_params = parse_hdfs_extra_params(storage.extra_params)
+        return bool(extra_params and extra_params.to_parquet)
+
+    @staticmethod
+    def _convert_to_parquet(ds, filesystem, source_path, data_path, data_url):
+        """
+        Converts the uploaded CSV to Parquet, keeping the original file for
+        download. If the conversion fails, the data source remains a CSV.
+        """
+        name = '{}_{}.parquet'.format(uuid.uuid4().hex,
+                                      os.path.splitext(ds.name)[0])
+        try:
+            conversion.csv_to_parquet(ds, filesystem, source_path,
+                                      f'{data_path}/{name}')
+        except Exception:
+            log.warning(gettext('Could not convert %s to Parquet'), ds.url,
+                        exc_info=True)
+            return
+        ds.original_url = ds.url
+        ds.url = f'{data_url}/{name}'
+        ds.format = DataSourceFormat.PARQUET
+        db.session.commit()
+
     @staticmethod
     @requires_auth
     def post():
@@ -626,174 +972,61 @@ class DataSourceUploadApi(Resource):
             total_chunks = request.args.get('resumableTotalChunks', type=int)
             total_size = request.args.get('resumableTotalSize', type=int)
             storage_id = request.args.get('storage_id', type=int)
+            max_chunk_size = upload_session.get_max_chunk_size()
 
             result, result_code = 'OK', 200
-            if not all([identifier, filename, chunk_number]):
+            if not all([identifier, filename, chunk_number, total_chunks]):
                 # Parameters are missing or invalid
                 result, result_code = {'status': 'ERROR', 'message': gettext(
                     'Missing required parameters')}, 400
+            elif not 0 < chunk_number <= total_chunks:
+                result, result_code = {'status': 'ERROR', 'message': gettext(
+                    'Invalid chunk number')}, 400
+            elif (request.content_length or 0) > max_chunk_size:
+                result, result_code = {'status': 'ERROR', 'message': gettext(
+                    'Chunk is larger than %(max)s bytes.',
+                    max=max_chunk_size)}, 413
             else:
-                storage = Storage.query.get(storage_id)
-                storage_url = storage.url if storage.url[-1] != '/' \
-                    else storage.url[:-1]
-                parsed = urlparse(storage_url)
-
-                if parsed.scheme == 'file':
-                    str_uri = '{proto}://{path}'.format(
-                        proto=parsed.scheme, path=parsed.path)
-                else:
-                    str_uri = hu.get_parsed_uri(parsed, False)
-
-                extra_params = parse_hdfs_extra_params(storage.extra_params)
-                if extra_params is not None:
-                    # conf = get_hdfs_conf(jvm, extra_params, current_app.config)
-                    hadoop_user = extra_params.user or 'hadoop'
-                else:
-                    hadoop_user = 'hadoop'
-
-                if parsed.scheme == 'hdfs':
-                    if parsed.port:
-                        hdfs = fs.HadoopFileSystem(str_uri, user=hadoop_user,
-                            port=int(parsed.port))
-                    else:
-                        hdfs = fs.HadoopFileSystem(str_uri, user=hadoop_user,)
-
-                    tmp_path = DataSourceUploadApi._get_tmp_path(
-                        hdfs, parsed, filename)
-
-                    chunk_filename = f'{tmp_path}/{filename}.part{chunk_number:09d}'
-                    current_app.logger.debug('Writing chunk: %s', chunk_filename)
-
-                    file_data = request.get_data()
-                    hu.write(hdfs, chunk_filename, file_data)
-                elif parsed.scheme == 'file':
-                    import tempfile
-                    tmp_path = tempfile.gettempdir()
-                    chunk_filename = f'{tmp_path}/{filename}.part{chunk_number:09d}'
-
-                    file_data = request.get_data()
-                    with open(chunk_filename, 'wb') as f:
-                        f.write(file_data)
-                else:
-                    raise ValueError(f'Unsupported scheme: {parsed.scheme}')
-
-                # Checks if all file's parts are present
-                if chunk_number == total_chunks:
-                    final_filename = f'{uuid.uuid4().hex}_{filename}'
-
-                    # time to merge all files
-                    parsed_path = parsed.path or ''
-                    if parsed_path.endswith('/'):
-                        parsed_path = parsed_path[:-1]
-                    if parsed_path:
-                        target_path = (
-                            f'/{parsed_path.strip("/")}/limonero/data/{final_filename}')
-                    else:
-                        target_path = (f'/limonero/data/{final_filename}')
-                    # target_path = (f'/limonero/data/{final_filename}')
-
-                    if parsed.scheme == 'hdfs':
-                        if hu.exists(hdfs, target_path):
-                            result = {'status': 'error',
-                                      'message': gettext(
-                                      'A file with same name already exists. Try to upload the file again.')}
-                            result_code = 500
-                        hu.copy_merge(hdfs, tmp_path, target_path, filename,
-                                      total_chunks)
-                    elif parsed.scheme == 'file':
-                        os.makedirs(os.path.dirname(target_path), exist_ok=True)
-                        with open(target_path, 'wb') as f:
-                            for i in range(total_chunks):
-                                number = str(i + 1).rjust(9, '0')
-                                name = f'{tmp_path.rstrip("/")}/{filename}.part{number}'
-                                with open(name, 'rb') as in_file:
-                                    f.write(in_file.read())
-
-                        for i in range(total_chunks):
-                            number = str(i + 1).rjust(9, '0')
-                            name = f'{tmp_path.rstrip("/")}/{filename}.part{number}'
-                            try:
-                                os.remove(name)
-                            except:
-                                pass
-
-                        ...
-                    else:
-                        raise ValueError(f'Unsupported scheme: {parsed.scheme}')
-
-                    # noinspection PyBroadException
-                    try:
-                        user = getattr(flask_g, 'user')
-                    except:
-                        user = User(id=1, login='admin',
-                                    email='admin@lemonade',
-                                    first_name='admin',
-                                    last_name='admin',
-                                    locale='en')
-
-                    extension = filename[-3:].lower()
-                    if extension == 'csv':
-                        ds_format = DataSourceFormat.CSV
-                    elif extension == 'json':
-                        ds_format = DataSourceFormat.JSON
-                    elif extension == 'xml':
-                        ds_format = DataSourceFormat.XML_FILE
-                    elif extension == 'txt':
-                        ds_format = DataSourceFormat.TEXT
-                    else:
-                        ds_format = DataSourceFormat.UNKNOWN
-
-                    ds = DataSource(
-                        format=ds_format,
-                        name=filename,
-                        storage_id=storage.id,
-                        description=gettext('Imported in Limonero'),
-                        enabled=True,
-                        url=f'file://{target_path}' if parsed.scheme == 'file'
-                            else f'{storage_url.strip("/")}/limonero/data/{final_filename}',
-                        estimated_size_in_mega_bytes=total_size / 1024.0 ** 2,
-                        user_id=user.id,
-                        user_login=user.login,
-                        user_name='{} {}'.format(
-                            user.first_name,
-                            user.last_name).strip())
-
-                    db.session.add(ds)
-
-                    if filename[-4:] in ['.csv', '.CSV', '.tsv', '.TSV']:
-                        # noinspection PyBroadException
+                storage = DataSourceUploadApi._get_storage(storage_id)
+                filesystem, parsed = upload_session.get_filesystem(storage)
+                session = upload_session.open_session(
+                    storage, DataSourceUploadApi._get_user().id, identifier,
+                    filename, total_chunks, total_size)
+
+                if session.status == UploadStatus.OPEN:
+                    current_app.logger.debug('Writing chunk %s of upload %s',
+                                             chunk_number, session.id)
+                    size, checksum = upload_session.write_chunk(
+                        filesystem, parsed, session, chunk_number,
+                        request.stream, max_chunk_size)
+                    upload_session.record_chunk(session, chunk_number, size,
+                                                checksum)
+
+                    # Only one request (the one storing the last missing
+                    # chunk, in any order) merges the file
+                    if upload_session.claim_merge(session):
                         try:
-                            # try to infer the field delimiter
-                            count_delimiters = collections.defaultdict(int)
-                            for ch in file_data:
-                                if ch in [',', ';', '\t']:
-                                    count_delimiters[ch] += 1
-                            sorted_delim = sorted(
-                                list(count_delimiters.items()),
-                                key=operator.itemgetter(1),
-                                reverse=True)
-                            delim = sorted_delim[0][0] if sorted_delim else ','
-                            ds.is_first_line_header = True
-                            ds.attribute_delimiter = delim
-                            ds.format = DataSourceFormat.CSV
-                            DataSourceUploadApi._try_infer_schema(ds, delim)
-                        except:
-                            # in case of error, save the upload information
-                            db.session.commit()
-                    else:
-                        db.session.commit()
-                    response_schema = DataSourceItemResponseSchema()
-                    result = {'status': 'OK',
-                              'data': response_schema.dump(ds)}
+                            result, result_code = DataSourceUploadApi._complete(
+                                storage, session, filesystem, parsed,
+                                DataSourceUploadApi._wants_parquet(storage))
+                        except Exception:
+                            db.session.rollback()
+                            upload_session.close_session(
+                                filesystem, parsed, session)
+                            raise
 
             return result, result_code, {
                 'Content-Type': 'application/json; charset=utf-8'}
+        except upload_session.ChunkTooLarge as e:
+            return {'status': 'ERROR', 'message': str(e)}, 413
+        except ValueError as e:
+            return {'status': 'ERROR', 'message': str(e)}, 400
         except Exception as e:
             log.exception(e)
             result = {'status': 'ERROR',
                      'data': str(e)}
             result_code = 500
-
+            return result, result_code
 
     @staticmethod
     def _try_infer_schema(ds, delim):
@@ -806,6 +1039,21 @@ class DataSourceUploadApi(Resource):
 class DataSourceDownload(MethodView):
     """ Entry point for downloading a DataSource """
 
+    @staticmethod
+    def _download_file(filesystem, path, name, decompress):
+        """
+        Response with the file in path and its name: compressed files are
+        named after their codec (e.g. people.csv.gz), or decompressed
+        """
+        codec = compression.detect_file(filesystem, path)
+        if codec is None or decompress:
+            return Response(stream_with_context(hu.download_file(
+                filesystem, path, decompress=codec is not None))), name
+        return Response(stream_with_context(
+            hu.download_file(filesystem, path)),
+            mimetype=compression.MIME_TYPES[codec]), \
+            compression.with_extension(name, codec)
+
     # noinspection PyUnresolvedReferences
     @staticmethod
     def get(data_source_id):
@@ -832,64 +1080,75 @@ class DataSourceDownload(MethodView):
 
         parsed = urlparse(data_source.url)
         convert_to_csv = request.args.get('to_csv') in ('1', 'true')
-
-        if parsed.scheme == 'file':
+        # Compressed files are downloaded as stored, unless decompress is set
+        decompress = request.args.get('decompress') in ('1', 'true')
+        file_format = data_source.format
+        try:
+            # Only partitions in filters are downloaded (Parquet)
+            filters = partitions.parse_filters(request.args.get('partitions'))
+        except ValueError as ve:
+            return json.dumps({'status': 'ERROR', 'message': str(ve)}), 400
+        if (data_source.original_url and
+                request.args.get('converted') not in ('1', 'true')):
+            # File as uploaded, before its conversion to Parquet
+            parsed = urlparse(data_source.original_url)
+            file_format = DataSourceUploadApi._get_format(parsed.path)
+
+        if is_database_backed(data_source):
+            if not has_fresh_snapshot(data_source):
+                return json.dumps(
+                    {'status': 'ERROR', 'message': gettext(
+                        'Data source has no snapshot. Materialize or export '
+                        'it instead.')}), 400
+            fmt = 'csv' if convert_to_csv else 'parquet'
+            mimetype, extension = EXPORT_FORMATS[fmt]
             name = '{}.{}'.format(data_source.name.replace(' ', '-'),
-                                  data_source.format.lower())
-
-            if data_source.format == 'PARQUET' and convert_to_csv:
-                def do_download(path):
-                    BUFFER_SIZE = 4096
-                    ds = pq.ParquetDataset(path).read()
-                    buf = io.BytesIO()
-                    csv.write_csv(ds, buf, csv.WriteOptions(include_header=True))
-                    buf.seek(0)
-
-                    done = False
-                    while not done:
-                        data = buf.read(BUFFER_SIZE)
-                        amount = len(data)
-                        if amount != BUFFER_SIZE:
-                            done = True
-                        yield data
-
-                name = name + '.csv'
-                result = Response(stream_with_context(
-                    do_download(parsed.path)))
-            else:
-                def do_download(path: str):
-
-                   total = 0
-                   done = False
-                   with open(path, 'rb') as f:
-                       while not done:
-                           read_data = f.read(4096)
-                           total += len(read_data)
-                           if len(read_data) != 4096:
-                               done = True
-                           yield read_data
-
-                result = Response(stream_with_context(
-                    do_download(parsed.path)))
+                                  extension)
+            result = Response(stream_with_context(
+                write_batches(snapshot_batches(data_source), fmt)),
+                mimetype=mimetype)
+            result.headers[
+                'Cache-Control'] = 'no-cache, no-store, must-revalidate'
+            result.headers['Pragma'] = 'no-cache'
+            result.headers["Content-Disposition"] = \
+                f"attachment; filename={name}"
+            return result, 200
+        elif parsed.scheme == 'file':
+            name = '{}.{}'.format(data_source.name.replace(' ', '-'),
+                                  file_format.lower())
+
+            local = fs.LocalFileSystem()
+            try:
+                if file_format == 'PARQUET' and convert_to_csv:
+                    name = name + '.csv'
+                    result = Response(stream_with_context(
+                        hu.download_parquet_as_csv(
+                            local, parsed.path, filters,
+                            partitions.get_names(data_source))),
+                        mimetype='text/csv')
+                elif (file_format == 'PARQUET' and
+                        hu.is_directory(local, parsed.path)):
+                    result = Response(stream_with_context(
+                        hu.download_parquet(
+                            local, parsed.path, filters,
+                            partitions.get_names(data_source))),
+                        mimetype='application/octet-stream')
+                else:
+                    result = None
+            except ValueError as ve:
+                return json.dumps({'status': 'ERROR', 'message': str(ve)}), 400
+            if result is None:
+                result, name = DataSourceDownload._download_file(
+                    local, parsed.path, name, decompress)
             result.headers[
                 'Cache-Control'] = 'no-cache, no-store, must-revalidate'
             result.headers['Pragma'] = 'no-cache'
             result.headers["Content-Disposition"] = f"attachment; filename={name}"
             result_code = 200
         else:
-            str_uri = hu.get_parsed_uri(parsed, False)
             try:
-                extra_params = parse_hdfs_extra_params(
-                        data_source.storage.extra_params)
-                hadoop_user = 'hadoop'
-                if extra_params and extra_params.user:
-                    hadoop_user = extra_params.user
-                # conf = get_hdfs_conf(jvm, extra_params, current_app.config)
-                if parsed.port:
-                    hdfs = fs.HadoopFileSystem(str_uri, port=int(parsed.port),
-                        user=hadoop_user)
-                else:
-                    hdfs = fs.HadoopFileSystem(str_uri, user=hadoop_user)
+                hdfs = hu.get_filesystem(parsed,
+                                         data_source.storage.extra_params)
 
                 if not hu.exists(hdfs, parsed.path):
                     message = gettext("%(type)s not found.",
@@ -899,24 +1158,25 @@ class DataSourceDownload(MethodView):
                         'message': message }, 404
                 else:
                     name = '{}.{}'.format(data_source.name.replace(' ', '-'),
-                                          data_source.format.lower())
+                                          file_format.lower())
 
-                    if data_source.format == 'PARQUET':
+                    result = None
+                    if file_format == 'PARQUET':
+                        names = partitions.get_names(data_source)
                         if convert_to_csv:
                             result = Response(stream_with_context(
-                                hu.download_parquet_as_csv(hdfs, parsed.path)),
+                                hu.download_parquet_as_csv(
+                                    hdfs, parsed.path, filters, names)),
                                 mimetype='text/csv')
                             name = name + '.csv'
                         elif hu.is_directory(hdfs, parsed.path):
                             result = Response(stream_with_context(
-                                hu.download_parquet(hdfs, parsed.path)),
+                                hu.download_parquet(
+                                    hdfs, parsed.path, filters, names)),
                                 mimetype='application/octet-stream')
-                        else:
-                            result = Response(stream_with_context(
-                                hu.download_file(hdfs, parsed.path)))
-                    else:
-                        result = Response(stream_with_context(
-                            hu.download_file(hdfs, parsed.path)))
+                    if result is None:
+                        result, name = DataSourceDownload._download_file(
+                            hdfs, parsed.path, name, decompress)
 
                     result.headers[
                         'Cache-Control'] = 'no-cache, no-store, must-revalidate'
@@ -924,6 +1184,10 @@ class DataSourceDownload(MethodView):
                     result.headers["Content-Disposition"] = \
                         f"attachment; filename={name}"
                     result_code = 200
+            except ValueError as ve:
+                # Invalid filters (partitions)
+                result = json.dumps({'status': 'ERROR', 'message': str(ve)})
+                result_code = 400
             except Exception as e:
                 result = json.dumps(
                     {'status': 'ERROR', 'message': gettext('Internal error')})
@@ -933,11 +1197,59 @@ class DataSourceDownload(MethodView):
         return result, result_code
 
 
+class DataSourceUploadStatusApi(Resource):
+    """
+    Chunks already received of an upload (bitmap), so a resumed upload is
+    tested with a single request instead of one per chunk.
+    """
+
+    @staticmethod
+    @requires_auth
+    def get():
+        # noinspection PyBroadException
+        try:
+            identifier = request.args.get('resumableIdentifier', type=str)
+            storage_id = request.args.get('storage_id', type=int)
+            if not all([storage_id, identifier]):
+                return {'status': 'ERROR', 'message': gettext(
+                    'Missing required parameters')}, 400
+            storage = DataSourceUploadApi._get_storage(storage_id)
+            session = upload_session.get_session(
+                storage, DataSourceUploadApi._get_user().id, identifier)
+            if session is None:
+                return {'status': 'ERROR',
+                        'message': gettext('Not found')}, 404
+            bitmap = upload_session.get_bitmap(session)
+            return {'status': 'OK', 'data': {
+                'identifier': identifier,
+                'total_chunks': session.total_chunks,
+                'received_chunks': bitmap.count('1'),
+                'bitmap': bitmap,
+            }}, 200
+        except ValueError as e:
+            return {'status': 'ERROR', 'message': str(e)}, 400
+        except Exception as e:
+            log.exception(e)
+            return {'status': 'ERROR',
+                    'message': gettext('Internal error')}, 500
+
+
 class DataSourceInferSchemaApi(Resource):
     @staticmethod
     def _infer_schema_from_db(ds, options):
         pass
 
+    @staticmethod
+    def _add_resolved_attributes(ds, resolved):
+        DataSourceInferSchemaApi._delete_old_attributes(ds)
+        for attribute in resolved:
+            attr = Attribute(**attribute)
+            attr.data_source = ds
+            attr.feature = False
+            attr.label = False
+            db.session.add(attr)
+        db.session.commit()
+
     @staticmethod
     def infer_schema(ds, options):
         parsed = urlparse(
@@ -945,169 +1257,53 @@ class DataSourceInferSchemaApi(Resource):
                 if a), None))
 
         if ds.format in (DataSourceFormat.JDBC,):
-            parsed = urlparse(ds.url)
-            qs = dict(x.split('=') for x in parsed.query.split('&'))
-            # Supported DB: mysql
-
-            if parsed.scheme == 'mysql':
-                from pymysql.constants import FIELD_TYPE
-                ft = pymysql.constants.FIELD_TYPE
-                d = {getattr(ft, k): k for k in dir(ft) if
-                     not k.startswith('_')}
-                try:
-                    fix_limit = re.compile(r'\sLIMIT\s+(\d+)')
-
-                    if ds.command is None or ds.command.strip() == '':
-                        raise ValueError(gettext(
-                            'Data source does not have a command specified'))
-                    cmd = fix_limit.sub('', ds.command)
-                    with pymysql.connect(
-                            host=parsed.hostname,
-                            port=parsed.port or '3306',
-                            user=qs.get('user'),
-                            passwd=qs.get('password'),
-                            db=parsed.path[1:]) as cn:
-                        cursor = cn.cursor()
-                        cursor.execute('{} LIMIT 0'.format(cmd))
-
-                        DataSourceInferSchemaApi._delete_old_attributes(ds)
-
-                        for (name, dtype, size, to_ignore, precision, scale,
-                             nullable) in cursor.description:
-                            final_type = get_mysql_data_type(d, dtype)
-                            if d[dtype] == 'BLOB':
-                                precision = None
-                            attr = Attribute(name=name, type=final_type,
-                                             size=size, precision=precision,
-                                             scale=scale, nullable=nullable)
-                            attr.data_source = ds
-                            attr.feature = False
-                            attr.label = False
-                            db.session.add(attr)
-                        db.session.commit()
-                except Exception:
-                    raise ValueError(gettext('Could not connect to database'))
-            else:
-                raise ValueError(
-                    gettext('Unsupported database: %(what)s',
-                            what=parsed.scheme))
+            # Raises an error if database is not supported
+            get_dialect(urlparse(ds.url))
+            try:
+                resolved = resolve_schema(ds,
+                                          bool(options.get('refresh', False)))
+            except Exception:
+                raise ValueError(gettext('Could not connect to database'))
+            DataSourceInferSchemaApi._add_resolved_attributes(ds, resolved)
 
         elif ds.format in (DataSourceFormat.HIVE):
-            parsed = urlparse(ds.storage.client_url)
-            from pyhive import hive
-            from TCLIService.ttypes import TOperationState
-            if ds.storage.extra_params:
-                extra = json.loads(ds.storage.extra_params)
-            else:
-                extra = {}
-            print('=' * 20)
-            print(parsed)
-            print('=' * 20)
-            cursor = hive.connect(
-                   host=parsed.hostname,
-                   port=int(parsed.port or 10000),
-                   username=parsed.username,
-                   password=parsed.password,
-                   database=(parsed.path or 'default').replace('/', ''),
-                   auth=extra.get('auth', 'CUSTOM') if parsed.password else None,
-                   configuration={
-                       'hive.cli.print.header': 'true'},
-                   kerberos_service_name=extra.get('kerberos_service_name'),
-                   thrift_transport=None).cursor()
-
-            if ds.command is None or ds.command.strip() == '':
-                raise ValueError(gettext(
-                    'Data source does not have a command specified'))
-            fix_limit = re.compile(r'\sLIMIT\s+(\d+)')
-            cmd = fix_limit.sub('', ds.command)
-            cursor.execute('{} LIMIT 0'.format(cmd), async_=True)
-            status = cursor.poll().operationState
-            while status in (TOperationState.INITIALIZED_STATE,
-                    TOperationState.RUNNING_STATE):
-                status = cursor.poll().operationState
-
-            tables = set()
-            attrs = []
-            attrs_name = []
-            types = []
-            for t in cursor.description:
-                attr, attr_type = t[0:2]
-                types.append(attr_type)
-                table, name = attr.split('.', 2)
-                attrs.append(attr)
-                attrs_name.append(name)
-                tables.add(table)
-            if len(tables) == 1:
-                final_names = attrs_name
-            else:
-                final_names = attrs
-
-            DataSourceInferSchemaApi._delete_old_attributes(ds)
-            for (name, d) in zip(final_names, types):
-                final_type = get_hive_data_type(d)
-                attr = Attribute(name=name, type=final_type,
-                                 size=None, precision=None,
-                                 scale=None, nullable=None)
-                attr.data_source = ds
-                attr.feature = False
-                attr.label = False
-                db.session.add(attr)
-            db.session.commit()
-
+            resolved = resolve_schema(ds, bool(options.get('refresh', False)))
+            DataSourceInferSchemaApi._add_resolved_attributes(ds, resolved)
 
         elif ds.format in (DataSourceFormat.PARQUET,):
 
             #extra_params = parse_hdfs_extra_params(ds.storage.extra_params)
             #conf = get_hdfs_conf(jvm, extra_params, current_app.config)
             path = parsed.path
-            if parsed.scheme == 'hdfs':
-                str_uri = hu.get_parsed_uri(parsed, False)
-                if parsed.port:
-                    use_fs = fs.HadoopFileSystem(str_uri, port=int(parsed.port))
-                else:
-                    use_fs = fs.HadoopFileSystem(str_uri)
-                schema = hu.infer_parquet(use_fs, path)
-            elif parsed.schema == 'file':
-                str_uri = hu.get_parsed_uri(parsed, False)
-                use_fs = fs.LocalFileSystem()
+            if parsed.scheme in ('hdfs', 'file'):
+                use_fs = hu.get_filesystem(parsed, ds.storage.extra_params)
+                if bool(options.get('refresh', False)):
+                    hu.invalidate_listing(use_fs, path)
                 schema = hu.infer_parquet(use_fs, path)
+                partitioning = partitions.discover(use_fs, path)
             else:
-                raise ValueError(gettext('Unsupported filesystem: {fs}',
-                    fs=parsed.schema))
-
-            DataSourceInferSchemaApi._delete_old_attributes(ds)
-            for name, (dtype, precision, scale) in schema:
-                attr = Attribute(name=name,
-                                 nullable=True,
-                                 enumeration=False,
-                                 type=dtype,
-                                 feature=False, label=False,
-                                 precision=precision if precision != 0 else None,
-                                 scale=scale,
-                                 )
-                attr.data_source = ds
-                db.session.add(attr)
-            db.session.commit()
+                raise ValueError(gettext('Unsupported filesystem: %(fs)s',
+                    fs=parsed.scheme))
+
+            DataSourceInferSchemaApi._add_inferred_attributes(
+                ds, schema, partitioning.names if partitioning else [])
+
+        elif ds.format == DataSourceFormat.JSON:
+            if parsed.scheme not in ('hdfs', 'file'):
+                raise ValueError(gettext('Unsupported filesystem: %(fs)s',
+                    fs=parsed.scheme))
+            use_fs = hu.get_filesystem(parsed, ds.storage.extra_params)
+            if bool(options.get('refresh', False)):
+                hu.invalidate_listing(use_fs, parsed.path)
+            files = [f for f, _ in conversion.list_files(use_fs, parsed.path)]
+            DataSourceInferSchemaApi._add_inferred_attributes(
+                ds, hu.infer_json(use_fs, files))
 
         elif ds.format in (DataSourceFormat.CSV, DataSourceFormat.SHAPEFILE):
-            str_uri = hu.get_parsed_uri(parsed, False)
-
-            #conf, hadoop_pkg, hdfs, jvm, path, buffered_reader = [None] * 6
-            if parsed.scheme == 'hdfs':
-                # noinspection PyUnresolvedReferences
-                extra_params = parse_hdfs_extra_params(ds.storage.extra_params)
-                hadoop_user = extra_params.user or 'hadoop'
-                if parsed.port:
-                    use_fs = fs.HadoopFileSystem(str_uri, user=hadoop_user,
-                        port=int(parsed.port))
-                else:
-                    use_fs = fs.HadoopFileSystem(str_uri, user=hadoop_user)
-            elif parsed.scheme == 'file':
-                str_uri = f'{parsed.scheme}://{parsed.path}'
-                use_fs = fs.LocalFileSystem()
-            else:
+            if parsed.scheme not in ('file', 'hdfs'):
                 raise ValueError(gettext('Unsupported filesystem: ') +
                     parsed.scheme)
+            use_fs = hu.get_filesystem(parsed, ds.storage.extra_params)
             if ds.format == DataSourceFormat.CSV:
                 try:
                     use_header = options.get('use_header',
@@ -1125,23 +1321,10 @@ class DataSourceInferSchemaApi(Resource):
                     else:
                         missing_values = []
 
-                    encoding = 'utf8'
-
-                    is_gzip = parsed.path.endswith('.gz')
-
-                    if parsed.scheme == 'file':
-                        encoding = ds.encoding or 'utf8'
-                        if is_gzip:
-                            gz_file = gzip.open(parsed.path, 'rb')
-                            buffered_reader = codecs.getreader(encoding)(gz_file)
-                        else:
-                            buffered_reader = codecs.open(parsed.path,
-                                                    'rb', encoding=encoding)
-                    elif parsed.scheme == 'hdfs':
-                        buffered_reader = io.BufferedReader(
-                            use_fs.open_input_stream(parsed.path))
-
-                    reader = buffered_reader
+                    encoding = ds.encoding or 'utf8'
+                    # Compressed files are detected by their content
+                    reader = codecs.getreader(encoding)(
+                        compression.open_input(use_fs, parsed.path))
 
                     quote_char = options.get('quote_char', None)
                     quote_char = quote_char.encode(
@@ -1152,16 +1335,9 @@ class DataSourceInferSchemaApi(Resource):
 
                     for i in range(1000):
                         line = reader.readline()
-                        if line is None:
+                        if not line:
                             break
-
-                        if isinstance(line, bytes):
-                            line = line.decode(encoding)
-                        else:
-                            line = line.encode(encoding).decode('utf8')
-                        line = line.replace('\0', '')
-                        lines.write(line)
-                        lines.write('\n')
+                        lines.write(line.replace('\0', ''))
                     reader.close()
                     lines.seek(0)
                     if quote_char:
@@ -1255,6 +1431,24 @@ class DataSourceInferSchemaApi(Resource):
                 gettext('Cannot infer the schema for format %(format)s',
                         format=ds.format))
 
+    @staticmethod
+    def _add_inferred_attributes(ds, schema, partition_names=()):
+        """ Replaces attributes by the inferred ones (hu.infer_*) """
+        DataSourceInferSchemaApi._delete_old_attributes(ds)
+        for name, (dtype, precision, scale) in schema:
+            attr = Attribute(name=name,
+                             nullable=True,
+                             enumeration=False,
+                             type=dtype,
+                             feature=False, label=False,
+                             precision=precision if precision != 0 else None,
+                             scale=scale,
+                             partition_key=name in partition_names,
+                             )
+            attr.data_source = ds
+            db.session.add(attr)
+        db.session.commit()
+
     @staticmethod
     def _delete_old_attributes(ds):
         old_attrs = Attribute.query.filter(
@@ -1273,9 +1467,18 @@ class DataSourceInferSchemaApi(Resource):
         ds = DataSource.query.get_or_404(data_source_id)
         request_body = request.json
 
+        def infer():
+            # Runs in a worker, with its own database session
+            DataSourceInferSchemaApi.infer_schema(
+                DataSource.query.get(data_source_id), request_body)
+
         # noinspection PyBroadException
         try:
-            DataSourceInferSchemaApi.infer_schema(ds, request_body)
+            get_execution_manager().run(infer, _get_source_kind(ds))
+        except ExecutionTimeout as timeout:
+            result = {'status': 'ERROR', 'message': str(timeout)}, 504
+        except (ExecutionCancelled, TooManyExecutions) as e:
+            result = {'status': 'ERROR', 'message': str(e)}, 503
         except UnicodeEncodeError:
             log.exception('Invalid CSV encoding')
             result = {'status': 'ERROR',
@@ -1456,7 +1659,7 @@ class DataSourcePrivacyApi(Resource):
             .options(options) \
             .all()
         if attr_privacy:
-            return {'data': DataSourcePrivacyResponseSchema().dump(
+            return {'data': get_schema(DataSourcePrivacyResponseSchema).dump(
                 attr_privacy[0], many=False)}
         else:
             return dict(status="ERROR",
@@ -1472,7 +1675,7 @@ class DataSourcePrivacyApi(Resource):
         if json_data:
             request_schema = partial_schema_factory(
                 DataSourceCreateRequestSchema)
-            response_schema = DataSourceItemResponseSchema()
+            response_schema = get_schema(DataSourceItemResponseSchema)
             if not form.errors:
                 try:
                     # Ignore missing fields to allow partial updates
@@ -1527,11 +1730,111 @@ class DataSourceInitializationApi(Resource):
 
 
 
+# Kinds of executions of samples (see _get_source_kind)
+SOURCE_KINDS = (DataSourceFormat.HIVE, DataSourceFormat.JDBC, 'HDFS', 'LOCAL',
+                'default')
+
+
+def _get_source_kind(data_source):
+    """ Type of source, used to define execution deadlines """
+    if data_source.format in (DataSourceFormat.HIVE, DataSourceFormat.JDBC):
+        return data_source.format
+    parsed = urlparse(data_source.url or '')
+    return {'hdfs': 'HDFS', 'file': 'LOCAL'}.get(parsed.scheme, 'default')
+
+
+def _wants_async():
+    return (request.args.get('async') in ('1', 'true') or
+            'respond-async' in request.headers.get('Prefer', ''))
+
+
 class DataSourceSampleApi(Resource):
+    """
+    Sample of a data source. It is read by a worker with a deadline (see
+    util.execution). With ?async=true (or Prefer: respond-async), the
+    response is 202 and the sample is polled in DataSourceSampleExecutionApi.
+    """
     @staticmethod
     @requires_auth
     def get(data_source_id: int):
-        return DataSourceSampleApi._get_sample(data_source_id)
+        data_source = DataSource.query.get_or_404(data_source_id)
+        manager = get_execution_manager()
+        try:
+            execution = manager.submit(
+                lambda: DataSourceSampleApi._get_sample(data_source_id),
+                _get_source_kind(data_source), owner=flask_g.user.id,
+                resource=data_source_id)
+        except TooManyExecutions as e:
+            return dict(status='ERROR', message=str(e)), 503
+
+        if _wants_async():
+            location = '/datasources/sample/{}/executions/{}'.format(
+                data_source_id, execution.id)
+            return dict(status=execution.status, execution_id=execution.id,
+                        timeout=execution.timeout), 202, {'Location': location}
+        try:
+            return manager.wait(execution)
+        except ExecutionTimeout as e:
+            return dict(status='ERROR', message=str(e)), 504
+        except ExecutionCancelled as e:
+            return dict(status='ERROR', message=str(e)), 503
+        finally:
+            manager.discard(execution)
+
+    @staticmethod
+    def _sample_files(data_source, parsed, limit, filters):
+        """
+        Sample of CSV, JSON lines or Parquet files or directories (HDFS or
+        local), read with pyarrow. Only partitions in filters are read.
+        """
+        if data_source.format not in (DataSourceFormat.CSV,
+                                      DataSourceFormat.JSON,
+                                      DataSourceFormat.PARQUET):
+            return dict(status='ERROR', message=gettext(
+                'Format %(format)s is not supported.',
+                format=data_source.format)), 400
+        warnings = []
+        try:
+            filesystem = hu.get_filesystem(
+                parsed, data_source.storage.extra_params)
+
+            if not hu.exists(filesystem, parsed.path):
+                return {'status': 'ERROR', 'message': 'Not found'}, 404
+            if data_source.format == DataSourceFormat.CSV:
+                if filters or hu.is_directory(filesystem, parsed.path):
+                    data, warnings = hu.sample_csv_directory(
+                        filesystem, parsed.path, limit, data_source, filters)
+                else:
+                    data, warnings = hu.sample_csv(
+                        filesystem, parsed.path, limit, data_source)
+            elif data_source.format == DataSourceFormat.JSON:
+                if filters:
+                    raise ValueError(gettext(
+                        'Filters on partitions are not supported for '
+                        '%(format)s.', format=data_source.format))
+                files = conversion.list_files(filesystem, parsed.path)
+                data = hu.sample_json(filesystem, [f for f, _ in files],
+                                      limit)
+            else:
+                schema = (hu.get_parquet_schema(data_source)
+                          if data_source.attributes else None)
+                data = hu.sample_parquet(filesystem, parsed.path, limit,
+                                         schema, filters,
+                                         partitions.get_names(data_source))
+            return dict(status='OK', warnings=warnings, data=data), 200
+        except ArrowInvalid:
+            log.exception(gettext('Internal error'))
+            return dict(
+                status='ERROR',
+                message=gettext('Data type are not correctly defined. '
+                                'Please, revise them.')), 400
+        except ValueError as ve:
+            # Invalid filters (partitions)
+            return dict(status='ERROR', message=str(ve)), 400
+        except Exception:
+            log.exception(gettext('Internal error'))
+            return dict(
+                status='ERROR', message=gettext('Internal error')), 400
 
     @staticmethod
     def _get_sample(data_source_id: int):
@@ -1545,197 +1848,56 @@ class DataSourceSampleApi(Resource):
 
         limit = int(request.args.get('limit', 100))
         result, status_code = dict(status='ERROR', message='Not found'), 404
+        try:
+            # Only partitions in filters are read (directories)
+            filters = partitions.parse_filters(request.args.get('partitions'))
+        except ValueError as ve:
+            return dict(status='ERROR', message=str(ve)), 400
 
-        warnings = []
         if limit > 1000:
             result, status_code = dict(
                 status='ERROR',
                 message='The maximum number of records allowed is 1000'), 400
         elif data_source is not None:
-            treat_as_missing = (data_source.treat_as_missing or '').split(',')
             parsed = urlparse(
                 next((a for a in [data_source.url, data_source.storage.client_url,
                     data_source.storage.url]
                     if a), None))
 
-            if parsed.scheme == 'mysql':
-                qs = {}
-                if parsed.query and parsed.query.strip():
-                    qs_args = parsed.query.split('&')
-                    if qs_args:
-                        qs = dict(x.split('=') for x in qs_args)
-                fix_limit = re.compile(r'\sLIMIT\s+(\d+)')
-                cmd = fix_limit.sub('', data_source.command)
-
-                with pymysql.connect(
-                        host=parsed.hostname,
-                        port=parsed.port or '3306',
-                        user=parsed.username or qs.get('user'),
-                        passwd=parsed.password or qs.get('password'),
-                        db=parsed.path[1:],
-                        charset='UTF8',
-                        cursorclass=pymysql.cursors.DictCursor) as cn:
-                    cursor = cn.cursor()
-                    cursor.execute('{} LIMIT {}'.format(cmd, limit))
-                    result, status_code = dict(status='OK',
-                                           data=cursor.fetchall()), 200
+            if has_fresh_snapshot(data_source):
+                result, status_code = dict(
+                    status='OK',
+                    data=sample_snapshot(data_source, limit)), 200
+            elif data_source.format == DataSourceFormat.JDBC:
+                dialect = get_dialect(urlparse(data_source.url))
+                result, status_code = dict(
+                    status='OK',
+                    data=dialect.sample(data_source.command, limit)), 200
             elif data_source.format == 'HIVE':
-                from pyhive import hive
-                from TCLIService.ttypes import TOperationState
                 parsed = urlparse(data_source.storage.client_url)
 
                 if data_source.command is None or \
                         data_source.command.strip() == '':
                     raise ValueError(gettext(
                         'Data source does not have a command specified'))
-                if data_source.storage.extra_params:
-                    extra = json.loads(data_source.storage.extra_params)
-                else:
-                    extra = {}
-                if parsed.password is not None:
-                    cursor = hive.connect(
-                          host=parsed.hostname,
-                          port=int(parsed.port or 10000),
-                          username=parsed.username,
-                          password=parsed.password,
-                          database=(parsed.path or 'default').replace('/', ''),
-                          auth=extra.get('auth', 'CUSTOM'),
-                          configuration={
-                              'hive.cli.print.header': 'true'},
-                          kerberos_service_name=extra.get('kerberos_service_name'),
-                          thrift_transport=None).cursor()
-                else:
-                    cursor = hive.connect(
-                          host=parsed.hostname,
-                          port=int(parsed.port or 10000),
-                          database=(parsed.path or 'default').replace('/', ''),
-                          configuration={
-                              'hive.cli.print.header': 'true'},
-                          kerberos_service_name=extra.get('kerberos_service_name'),
-                          thrift_transport=None).cursor()
-
 
                 fix_limit = re.compile(r'\sLIMIT\s+(\d+)')
                 cmd = fix_limit.sub('', data_source.command)
-                cursor.execute('{} LIMIT {}'.format(cmd, limit))
-                status = cursor.poll().operationState
-                while status in (TOperationState.INITIALIZED_STATE,
-                        TOperationState.RUNNING_STATE):
-                    status = cursor.poll().operationState
 
                 #col_names = [desc[0] for desc in cursor.description]
                 col_names = [attr.name for attr in data_source.attributes]
                 result = []
-                for row in cursor:
-                    result.append(dict(zip(col_names, row)))
+                pool = get_hive_pool(parsed, data_source.storage.extra_params)
+                with pool.connection() as cn, closing(cn.cursor()) as cursor:
+                    hive_util.execute(cursor,
+                                      '{} LIMIT {}'.format(cmd, limit))
+                    for row in cursor:
+                        result.append(dict(zip(col_names, row)))
                 result, status_code = dict(status='OK',
                                            data=result), 200
-            elif parsed.scheme == 'file':
-                # Support JSON and CSV
-                if data_source.format == DataSourceFormat.CSV:
-                    encoding = data_source.encoding or 'utf8'
-                    csvfile = gzip.open(parsed.path, mode='rt') \
-                        if parsed.path.endswith('.gz') else \
-                            codecs.open(parsed.path, 'rb', encoding=encoding)
-
-                    header = []
-                    converters = []
-                    if data_source.attributes:
-                        csv_params = {
-                            'delimiter': data_source.attribute_delimiter or ','}
-                        if data_source.text_delimiter:
-                            csv_params['quoting'] = csv.QUOTE_MINIMAL
-                            csv_params[
-                                'quotechar'] = data_source.text_delimiter
-                        for attr in data_source.attributes:
-                            header.append(attr.name)
-                            if attr.type in [DataType.DECIMAL]:
-                                converters.append(decimal.Decimal)
-                            elif attr.type in [DataType.DOUBLE,
-                                               DataType.FLOAT]:
-                                converters.append(float)
-                            elif attr.type in [DataType.INTEGER,
-                                               DataType.LONG]:
-                                converters.append(int)
-                            else:
-                                converters.append(str.strip)
-                        reader = csv.reader(csvfile, **csv_params)
-                    else:
-                        header.append(_('row'))
-                        converters.append(str.strip)
-                        reader = csv.reader(
-                            csvfile,
-                            delimiter=';')
-
-                    if data_source.is_first_line_header:
-                        next(reader)
-                    data = []
-                    for i, line in enumerate(reader):
-                        if i >= limit:
-                            break
-                        row = {}
-                        for h, v, conv in zip(header, line, converters):
-                            try:
-                                row[h] = conv(v) if v != '' else ''
-                            except decimal.InvalidOperation:
-                                row[h] = gettext(
-                                    "<Invalid data>: `{}`".format(v))
-                                warnings.append(h)
-                        data.append(row)
-                        result, status_code = dict(
-                            status='OK', warnings=list(set(warnings)),
-                            data=data), 200
-                    csvfile.close()
-                elif data_source.format == DataSourceFormat.JSON:
-                    data = []
-                    with open(parsed.path) as f:
-                        for i, line in enumerate(f):
-                            if i >= limit:
-                                break
-                            data.append(json.loads(line))
-                    result, status_code = dict(status='OK',
-                                               data=data), 200
-                else:
-                    result, status_code = dict(
-                        status='ERROR',
-                        message='Format {} is not supported'.format(
-                            data_source.format)), 400
-            elif parsed.scheme == 'hdfs' and data_source.format in('CSV', 'PARQUET'):
-                import pyarrow
-                from pyarrow import fs
-                try:
-                    str_uri = f'{parsed.scheme}://{parsed.hostname}'
-                    extra_params = parse_hdfs_extra_params(data_source.storage.extra_params)
-                    hadoop_user = extra_params.user or 'hadoop'
-                    if parsed.port:
-                        hdfs = fs.HadoopFileSystem(str_uri, port=int(parsed.port),
-                            user=hadoop_user)
-                    else:
-                        hdfs = fs.HadoopFileSystem(str_uri, user=hadoop_user)
-
-                    if not hu.exists(hdfs, parsed.path):
-                        result = ({ 'status': 'ERROR',
-                                      'message': 'Not found'}, 404)
-                    else:
-                        if data_source.format == 'CSV':
-                            data = hu.sample_csv(hdfs, parsed.path, limit, data_source)
-                        elif data_source.attributes:
-                            schema = hu.get_parquet_schema(data_source)
-                            data = hu.sample_parquet(hdfs, parsed.path, limit, schema)
-                        else:
-                            data = hu.sample_parquet(hdfs, parsed.path, limit)
-                        result, status_code = dict(status='OK',
-                                               data=data), 200
-                except pyarrow.lib.ArrowInvalid:
-                    log.exception(gettext('Internal error'))
-                    result, status_code = dict(
-                        status='ERROR',
-                        message=gettext('Data type are not correctly defined. Please, revise them.')), 400
-                except Exception as e:
-                    log.exception(gettext('Internal error'))
-                    result, status_code = dict(
-                        status='ERROR',
-                        message=gettext('Internal error')), 400
+            elif parsed.scheme in ('file', 'hdfs'):
+                result, status_code = DataSourceSampleApi._sample_files(
+                    data_source, parsed, limit, filters)
             else:
                 return dict(status="ERROR",
                             message="Unsupported protocol {}".format(
@@ -1744,233 +1906,414 @@ class DataSourceSampleApi(Resource):
             return dict(status="ERROR", message="Not found"), 400
         return result, status_code
 
-# class DataSourceConvertApi(Resource):
-#     @staticmethod
-#     @requires_auth
-#     def post(data_source_id: int, target_type: str):
-
-#         data_sources = DataSource.query
-#         data_source = _filter_by_permissions(data_sources,
-#                                              list(PermissionType.values()))
-
-#         data_source = data_source.filter(
-#             DataSource.id == data_source_id).first()
-
-#         result, status_code = dict(status='ERROR', message='Not found'), 404
-
-#         warnings = []
-#         if data_source is not None:
-#             treat_as_missing = (data_source.treat_as_missing or '').split(',')
-#             parsed = urlparse(
-#                 next((a for a in [data_source.url, data_source.storage.client_url,
-#                     data_source.storage.url]
-#                     if a), None))
-
-#             if parsed.scheme in( 'mysql', 'hive'):
-#                 result = dict(status='Error',
-#                     message='Invalid source type. Only file-based '
-#                         'types can be converted.')
-#                 status_code = 400
-#             elif (data_source.format != DataSourceFormat.CSV and
-#                     data_source.format != DataSourceFormat.JSON):
-#                 result= dict(
-#                     status='ERROR',
-#                     message=f'Format {data_source.format} is not supported')
-#                 status_code = 400
-
-#             elif parsed.scheme == 'file':
-#                 # Support JSON and CSV
-#                 if data_source.format == DataSourceFormat.CSV:
-#                     encoding = data_source.encoding or 'utf8'
-#                     csvfile = gzip.open(parsed.path, mode='rt') \
-#                         if parsed.path.endswith('.gz') else \
-#                             codecs.open(parsed.path, 'rb', encoding=encoding)
-
-#                     header = []
-#                     converters = []
-#                     if data_source.attributes:
-#                         csv_params = {
-#                             'delimiter': data_source.attribute_delimiter or ','}
-#                         if data_source.text_delimiter:
-#                             csv_params['quoting'] = csv.QUOTE_MINIMAL
-#                             csv_params[
-#                                 'quotechar'] = data_source.text_delimiter
-#                         for attr in data_source.attributes:
-#                             header.append(attr.name)
-#                             if attr.type in [DataType.DECIMAL]:
-#                                 converters.append(decimal.Decimal)
-#                             elif attr.type in [DataType.DOUBLE,
-#                                                DataType.FLOAT]:
-#                                 converters.append(float)
-#                             elif attr.type in [DataType.INTEGER,
-#                                                DataType.LONG]:
-#                                 converters.append(int)
-#                             else:
-#                                 converters.append(str.strip)
-#                         reader = csv.reader(csvfile, **csv_params)
-#                     else:
-#                         header.append(_('row'))
-#                         converters.append(str.strip)
-#                         reader = csv.reader(
-#                             csvfile,
-#                             delimiter=';')
-
-#                     if data_source.is_first_line_header:
-#                         next(reader)
-#                     data = []
-#                     for i, line in enumerate(reader):
-#                         if i >= limit:
-#                             break
-#                         row = {}
-#                         for h, v, conv in zip(header, line, converters):
-#                             try:
-#                                 row[h] = conv(v) if v != '' else ''
-#                             except decimal.InvalidOperation:
-#                                 row[h] = gettext(
-#                                     "<Invalid data>: `{}`".format(v))
-#                                 warnings.append(h)
-#                         data.append(row)
-#                         result, status_code = dict(
-#                             status='OK', warnings=list(set(warnings)),
-#                             data=data), 200
-#                     csvfile.close()
-#                 elif data_source.format == DataSourceFormat.JSON:
-#                     data = []
-#                     with open(parsed.path) as f:
-#                         for i, line in enumerate(f):
-#                             if i >= limit:
-#                                 break
-#                             data.append(json.loads(line))
-#                     result, status_code = dict(status='OK',
-#                                                data=data), 200
-#             elif parsed.scheme == 'hdfs':
-#                 gateway = create_gateway(log, current_app.gateway_port)
-#                 jvm = gateway.jvm
-#                 str_uri = hu.get_parsed_uri(parsed)
-
-#                 try:
-#                     uri = jvm.java.net.URI(str_uri)
-
-#                     extra_params = parse_hdfs_extra_params(
-#                             data_source.storage.extra_params)
-#                     conf = get_hdfs_conf(jvm, extra_params, current_app.config)
-
-#                     hdfs = jvm.org.apache.hadoop.fs.FileSystem.get(uri, conf)
-
-#                     chunk_path = jvm.org.apache.hadoop.fs.Path(parsed.path)
-#                     if not hdfs.exists(chunk_path):
-#                         result = ({
-#                                       'status': 'ERROR',
-#                                       'message': 'Not found'}, 404)
-#                     else:
-#                         input_in = hdfs.open(chunk_path)
-
-#                         bom_input_stream = \
-#                             jvm.org.apache.commons.io.input.BOMInputStream(
-#                                 input_in)
-
-#                         if bom_input_stream.getBOM() is not None:
-#                             encoding = \
-#                                 bom_input_stream.getBOM().getCharsetName()
-#                         else:
-#                             encoding = data_source.encoding or 'UTF-8'
-#                         if parsed.path.endswith('.gz'):
-#                             buffered_reader = jvm.java.io.BufferedReader(
-#                                 jvm.java.io.InputStreamReader(
-#                                     jvm.java.util.zip.GZIPInputStream(
-#                                         bom_input_stream), encoding))
-#                         else:
-#                             buffered_reader = jvm.java.io.BufferedReader(
-#                                 jvm.java.io.InputStreamReader(
-#                                     bom_input_stream, encoding))
-
-#                         header = []
-#                         converters = []
-#                         csv_buf = StringIO()
-
-#                         if data_source.attributes:
-#                             for attr in data_source.attributes:
-#                                 header.append(attr.name)
-#                                 if attr.type in [DataType.DECIMAL]:
-#                                     converters.append(decimal.Decimal)
-#                                 elif attr.type in [DataType.DOUBLE,
-#                                                    DataType.FLOAT]:
-#                                     converters.append(float)
-#                                 elif attr.type in [DataType.INTEGER,
-#                                                    DataType.LONG]:
-#                                     converters.append(int)
-#                                 else:
-#                                     converters.append(str.strip)
-#                             d = data_source.attribute_delimiter or str(',')
-#                             csv_params = {'delimiter': SPECIAL_DELIMITERS.get(d, d)}
-#                             reader = csv.reader(csv_buf, **csv_params)
-#                         else:
-#                             header.append(_('row'))
-#                             converters.append(str.strip)
-#                             reader = csv.reader(
-#                                 csv_buf,
-#                                 delimiter=';')
-#                         data = []
-#                         i = 0
-#                         if data_source.is_first_line_header:
-#                             buffered_reader.readLine()
-
-#                         limit = 40
-#                         while i < limit:
-#                             tmp_line = buffered_reader.readLine()
-#                             if tmp_line:
-#                                 csv_buf.write(tmp_line)
-#                                 csv_buf.write('\n')
-#                             i += 1
-
-#                         csv_buf.seek(0)
-#                         from collections import OrderedDict
-#                         for line in reader:
-#                             row = OrderedDict()
-#                             for h, v, conv in zip(header, line, converters):
-#                                 # noinspection PyBroadException
-#                                 try:
-#                                     if v not in treat_as_missing:
-#                                         row[h] = conv(v)
-#                                     else:
-#                                         row[h] = None
-#                                 except:
-#                                     status_code = 422
-#                                     return dict(
-#                                         status='ERROR',
-#                                         message=INVALID_FORMAT_ERROR.format(
-#                                             type=str(conv), attr=h,
-#                                             v=str(v)
-#                                         )), status_code
-#                             data.append(row)
-
-#                         result, status_code = dict(status='OK',
-#                                                    data=data), 200
-#                 except Py4JJavaError as java_ex:
-#                     if 'Could not obtain block' in \
-#                             java_ex.java_exception.getMessage():
-#                         return {'status': 'ERROR',
-#                                 'message': WRONG_HDFS_CONFIG}, 400
-#                     log.exception('Java error')
-#                 except Exception as e:
-#                     result = {'status': 'ERROR',
-#                               'message': 'Internal error:',
-#                               'details': str(e)}
-#                     status_code = 500
-#                     log.exception(str(e))
-#             else:
-#                 return dict(status="ERROR",
-#                             message=f"Unsupported protocol {parsed.scheme}"), 400
-#         else:
-#             return dict(status="ERROR", message="Not found"), 404
-#         return result, status_code
 
+class DataSourceSampleExecutionApi(Resource):
+    """
+    Result of a sample started in background (see DataSourceSampleApi) and
+    its progress, if reported.
+    """
+    # Kinds of executions read (and cancelled) by this resource
+    kinds = SOURCE_KINDS
+
+    @classmethod
+    def _get_execution(cls, data_source_id, execution_id):
+        execution = get_execution_manager().get(execution_id)
+        if (execution is None or execution.kind not in cls.kinds or
+                execution.resource != data_source_id or
+                execution.owner != flask_g.user.id):
+            return None
+        return execution
+
+    @classmethod
+    @requires_auth
+    def get(cls, data_source_id: int, execution_id: str):
+        execution = cls._get_execution(data_source_id, execution_id)
+        if execution is None:
+            return dict(status='ERROR', message=gettext('Not found')), 404
+        if not execution.done():
+            if execution.remaining() <= 0:
+                execution.cancel()
+                return dict(status='ERROR', message=gettext(
+                    'Operation did not finish in %(timeout)s seconds.',
+                    timeout=execution.timeout)), 504
+            result = dict(status=execution.status,
+                          execution_id=execution.id,
+                          remaining=int(execution.remaining()))
+            if execution.progress:
+                result['progress'] = dict(execution.progress)
+            return result, 202
+        try:
+            return execution.result()
+        except ExecutionCancelled as e:
+            return dict(status='ERROR', message=str(e)), 410
+        except Exception:
+            log.exception(gettext('Internal error'))
+            return dict(status='ERROR',
+                        message=gettext('Internal error')), 400
+
+    @classmethod
+    @requires_auth
+    def delete(cls, data_source_id: int, execution_id: str):
+        execution = cls._get_execution(data_source_id, execution_id)
+        if execution is None:
+            return dict(status='ERROR', message=gettext('Not found')), 404
+        execution.cancel()
+        return dict(status='OK', message=gettext('Execution was cancelled.'))
+
+
+class DataSourcePartitionsApi(Resource):
+    """
+    Partitions of a directory data source (Hive style or plain directories,
+    see util.partitions): their values, number of files and size. Partition
+    keys are also attributes of the data source (partition_key) and can be
+    used to filter samples and downloads (?partitions=year=2024/month=01).
+    """
+
+    @staticmethod
+    @requires_auth
+    def get(data_source_id: int):
+        filtered = _filter_by_permissions(
+            DataSource.query, list(PermissionType.values()))
+        data_source = filtered.filter(DataSource.id == data_source_id).first()
+        if data_source is None:
+            return dict(status='ERROR', message=gettext(
+                "%(type)s not found.", type=gettext('Data source'))), 404
+
+        parsed = urlparse(data_source.url or '')
+        if parsed.scheme not in ('file', 'hdfs'):
+            return dict(status='ERROR', message=gettext(
+                'Only data sources stored in HDFS or local files can be '
+                'partitioned.')), 400
+
+        # Worker has its own database session
+        extra_params = data_source.storage.extra_params
+        names = partitions.get_names(data_source)
+
+        def list_partitions():
+            filesystem = hu.get_filesystem(parsed, extra_params)
+            return partitions.list_partitions(filesystem, parsed.path, names)
+
+        try:
+            result = get_execution_manager().run(
+                list_partitions, _get_source_kind(data_source))
+        except ExecutionTimeout as e:
+            return dict(status='ERROR', message=str(e)), 504
+        except (ExecutionCancelled, TooManyExecutions) as e:
+            return dict(status='ERROR', message=str(e)), 503
+        if result is None:
+            return dict(status='ERROR', message=gettext(
+                'Data source is not partitioned.')), 400
+        return dict(status='OK', data=result)
+
+
+class DataSourceExportApi(Resource):
+    """
+    Exports a database-backed data source (JDBC, Hive) as CSV, Parquet or
+    Arrow. Result is streamed, so any table size can be extracted.
+    """
+
+    @staticmethod
+    @requires_auth
+    def get(data_source_id: int):
+        data_source = _filter_by_permissions(
+            DataSource.query, list(PermissionType.values())).filter(
+            DataSource.id == data_source_id).first()
+        if data_source is None:
+            return dict(status='ERROR', message=gettext(
+                "%(type)s not found.", type=gettext('Data source'))), 404
+
+        fmt = request.args.get('format', 'csv').lower()
+        if fmt not in EXPORT_FORMATS:
+            return dict(status='ERROR', message=gettext(
+                'Format %(format)s is not supported', format=fmt)), 400
+        if not is_database_backed(data_source):
+            return dict(status='ERROR', message=gettext(
+                'Only data sources backed by databases can be exported. '
+                'Use download instead.')), 400
+        limit = request.args.get('limit') or None
+        if limit is not None:
+            if not limit.isdigit() or int(limit) == 0:
+                return dict(status='ERROR', message=gettext(
+                    'Invalid limit: %(limit)s.', limit=limit)), 400
+            limit = int(limit)
+
+        if has_fresh_snapshot(data_source) and limit is None and \
+                request.args.get('live') not in ('1', 'true'):
+            batches = snapshot_batches(data_source)
+        else:
+            batches = database_batches(data_source, limit)
+        chunks = write_batches(batches, fmt)
+        try:
+            # Query is executed before the response starts, so errors are
+            # still reported as JSON
+            first = next(chunks, b'')
+        except ValueError as ve:
+            chunks.close()
+            return dict(status='ERROR', message=str(ve)), 400
+        except PoolTimeout as e:
+            chunks.close()
+            return dict(status='ERROR', message=str(e)), 503
+        except QueryTimeout as e:
+            chunks.close()
+            return dict(status='ERROR', message=str(e)), 504
+        except Exception as e:
+            # Database errors (e.g. invalid command)
+            log.exception(gettext('Could not export data source %s'),
+                          data_source_id)
+            chunks.close()
+            return dict(status='ERROR', message=gettext(
+                'Cannot export the data source: %(what)s', what=e)), 400
+
+        mimetype, extension = EXPORT_FORMATS[fmt]
+        name = '{}.{}'.format(data_source.name.replace(' ', '-'), extension)
+        result = Response(stream_with_context(
+            itertools.chain([first], chunks)), mimetype=mimetype)
+        result.headers['Cache-Control'] = 'no-cache, no-store, must-revalidate'
+        result.headers['Content-Disposition'] = \
+            f'attachment; filename={name}'
+        return result
+
+
+class DataSourceMaterializeApi(Resource):
+    """
+    Materializes a database-backed data source as a Parquet snapshot, read
+    by sample, download and export instead of the database. Materialization
+    runs in background: the response is 202 and its progress is polled in
+    DataSourceMaterializeExecutionApi.
+    """
+
+    @staticmethod
+    @requires_auth
+    def post(data_source_id: int):
+        data_source = _get_writable_data_source(data_source_id)
+        if data_source is None:
+            return dict(status='ERROR', message=gettext(
+                "%(type)s not found.", type=gettext('Data source'))), 404
+
+        params = request.get_json(silent=True) or {}
+        config = current_app.config['LIMONERO_CONFIG']
+        storage_id = (params.get('storage_id') or
+                      data_source.snapshot_storage_id or
+                      (config.get('snapshots') or {}).get('storage_id'))
+        storage = Storage.query.get(storage_id) if storage_id else None
+        if storage is None:
+            return dict(status='ERROR', message=gettext(
+                "%(type)s not found.", type=gettext('Storage'))), 400
+        try:
+            snapshot.validate(data_source, storage)
+        except ValueError as ve:
+            return dict(status='ERROR', message=str(ve)), 400
+
+        def materialize():
+            source = DataSource.query.get(data_source_id)
+            try:
+                snapshot.materialize(source, Storage.query.get(storage.id),
+                                     params.get('ttl'))
+            except ValueError as ve:
+                db.session.rollback()
+                return dict(status='ERROR', message=str(ve)), 400
+            return dict(status='OK', message=gettext(
+                'Snapshot of %(name)s created.', name=source.name),
+                data={'snapshot_updated': source.snapshot_updated,
+                      'snapshot_ttl': source.snapshot_ttl}), 200
+
+        try:
+            execution = get_execution_manager().submit(
+                materialize, 'MATERIALIZATION', owner=flask_g.user.id,
+                resource=data_source_id)
+        except TooManyExecutions as e:
+            return dict(status='ERROR', message=str(e)), 503
+        location = '/datasources/{}/materialize/executions/{}'.format(
+            data_source_id, execution.id)
+        return dict(status=execution.status, execution_id=execution.id,
+                    timeout=execution.timeout), 202, {'Location': location}
+
+    @staticmethod
+    @requires_auth
+    def delete(data_source_id: int):
+        data_source = _get_writable_data_source(data_source_id)
+        if data_source is None:
+            return dict(status='ERROR', message=gettext(
+                "%(type)s not found.", type=gettext('Data source'))), 404
+        remove_snapshot(data_source)
+        return dict(status='OK', message=gettext(
+            'Snapshot of %(name)s removed.', name=data_source.name)), 200
+
+
+class DataSourceMaterializeExecutionApi(DataSourceSampleExecutionApi):
+    """
+    Progress and result of a materialization (see DataSourceMaterializeApi)
+    """
+    kinds = ('MATERIALIZATION',)
+
+
+class DataSourceConvertApi(Resource):
+    """
+    Converts a file data source (CSV, JSON lines, Parquet) to Parquet, CSV or
+    Arrow, creating a new data source with the same attributes and
+    permissions (see util.conversion). Conversion runs in background: the
+    response is 202 and its progress is polled in
+    DataSourceConvertExecutionApi.
+    """
+
+    @staticmethod
+    @requires_auth
+    def post(data_source_id: int, target: str):
+        filtered = _filter_by_permissions(
+            DataSource.query, list(PermissionType.values()))
+        data_source = filtered.filter(DataSource.id == data_source_id).first()
+        if data_source is None:
+            return dict(status='ERROR', message=gettext(
+                "%(type)s not found.", type=gettext('Data source'))), 404
+
+        params = request.get_json(silent=True) or {}
+        compression = params.get('compression')
+        storage_id = params.get('storage_id') or data_source.storage_id
+        storage = Storage.query.get(storage_id)
+        if storage is None:
+            return dict(status='ERROR', message=gettext(
+                "%(type)s not found.", type=gettext('Storage'))), 400
+        try:
+            conversion.validate(data_source, target, compression)
+            if storage.type not in (StorageType.HDFS, StorageType.LOCAL):
+                raise ValueError(gettext(
+                    'Converted data sources must be stored in HDFS or '
+                    'local storages.'))
+        except ValueError as ve:
+            return dict(status='ERROR', message=str(ve)), 400
+
+        def convert():
+            user = flask_g.user
+            source = DataSource.query.get(data_source_id)
+            converted = conversion.convert_data_source(
+                source, target, Storage.query.get(storage_id), user,
+                compression, params.get('name'))
+            response_schema = get_schema(DataSourceItemResponseSchema)
+            return dict(status='OK', data=response_schema.dump(converted)), 200
+
+        try:
+            execution = get_execution_manager().submit(
+                convert, 'CONVERSION', owner=flask_g.user.id,
+                resource=data_source_id)
+        except TooManyExecutions as e:
+            return dict(status='ERROR', message=str(e)), 503
+        location = '/datasources/{}/convert/executions/{}'.format(
+            data_source_id, execution.id)
+        return dict(status=execution.status, execution_id=execution.id,
+                    timeout=execution.timeout), 202, {'Location': location}
+
+
+class DataSourceConvertExecutionApi(DataSourceSampleExecutionApi):
+    """ Progress and result of a conversion (see DataSourceConvertApi) """
+    kinds = ('CONVERSION',)
+
+
+class DataSourceCompactApi(Resource):
+    """
+    Rewrites a directory data source (Parquet, DATA_FOLDER) with many small
+    files into fewer, larger ones (see util.compaction). Compaction runs in
+    background: the response is 202 and its progress is polled in
+    DataSourceCompactExecutionApi.
+    """
+
+    @staticmethod
+    @requires_auth
+    def post(data_source_id: int):
+        data_source = _get_writable_data_source(data_source_id)
+        if data_source is None:
+            return dict(status='ERROR', message=gettext(
+                "%(type)s not found.", type=gettext('Data source'))), 404
+
+        params = request.get_json(silent=True) or {}
+        if data_source.format not in compaction.COMPACTION_FORMATS:
+            return dict(status='ERROR', message=gettext(
+                'Format %(format)s cannot be compacted.',
+                format=data_source.format)), 400
+
+        def compact():
+            result = compaction.compact(
+                DataSource.query.get(data_source_id), params.get('sort_by'),
+                params.get('target_file_bytes'), params.get('compression'))
+            return dict(status='OK', data=result), 200
+
+        try:
+            execution = get_execution_manager().submit(
+                compact, 'COMPACTION', owner=flask_g.user.id,
+                resource=data_source_id)
+        except TooManyExecutions as e:
+            return dict(status='ERROR', message=str(e)), 503
+        location = '/datasources/{}/compact/executions/{}'.format(
+            data_source_id, execution.id)
+        return dict(status=execution.status, execution_id=execution.id,
+                    timeout=execution.timeout), 202, {'Location': location}
+
+
+class DataSourceCompactExecutionApi(DataSourceSampleExecutionApi):
+    """ Progress and result of a compaction (see DataSourceCompactApi) """
+    kinds = ('COMPACTION',)
 
 
 # Events
+CHANGED_DATA_SOURCES = 'limonero_changed_data_sources'
+
+
+def _mark_as_changed(target, data_source_id):
+    """ Cached representations are invalidated after commit """
+    session = object_session(target)
+    if session is not None and data_source_id is not None:
+        session.info.setdefault(CHANGED_DATA_SOURCES, set()).add(
+            data_source_id)
+
+
+# noinspection PyUnusedLocal
+@listens_for(DataSource, 'after_update')
+@listens_for(DataSource, 'after_delete')
+def receive_data_source_change(mapper, connection, target):
+    _mark_as_changed(target, target.id)
+
+
+# noinspection PyUnusedLocal
+@listens_for(Attribute, 'after_insert')
+@listens_for(Attribute, 'after_update')
+@listens_for(Attribute, 'after_delete')
+@listens_for(DataSourcePermission, 'after_insert')
+@listens_for(DataSourcePermission, 'after_update')
+@listens_for(DataSourcePermission, 'after_delete')
+@listens_for(DataSourceVariable, 'after_insert')
+@listens_for(DataSourceVariable, 'after_update')
+@listens_for(DataSourceVariable, 'after_delete')
+def receive_data_source_child_change(mapper, connection, target):
+    _mark_as_changed(target, target.data_source_id)
+
+
+# noinspection PyUnusedLocal
+@listens_for(AttributePrivacy, 'after_insert')
+@listens_for(AttributePrivacy, 'after_update')
+@listens_for(AttributePrivacy, 'after_delete')
+def receive_privacy_change(mapper, connection, target):
+    if target.attribute is not None:
+        _mark_as_changed(target, target.attribute.data_source_id)
+
+
+@listens_for(Session, 'after_commit')
+def receive_after_commit(session):
+    changed = session.info.pop(CHANGED_DATA_SOURCES, None)
+    if changed and has_app_context():
+        invalidate_data_source(*changed)
+
+
+@listens_for(Session, 'after_soft_rollback')
+def receive_after_rollback(session, previous_transaction):
+    session.info.pop(CHANGED_DATA_SOURCES, None)
+
+
 # noinspection PyUnusedLocal
 @listens_for(inspect(DataSource).relationships['attributes'], 'append')
 @listens_for(inspect(DataSource).relationships['attributes'], 'remove')
+@listens_for(inspect(DataSource).relationships['permissions'], 'append')
+@listens_for(inspect(DataSource).relationships['permissions'], 'remove')
+@listens_for(inspect(DataSource).relationships['variables'], 'append')
+@listens_for(inspect(DataSource).relationships['variables'], 'remove')
 def receive_append_or_remove(target, value, initiator):
     target.updated = datetime.datetime.utcnow()
 
@@ -1980,3 +2323,43 @@ def receive_append_or_remove(target, value, initiator):
 def receive_attribute_change(mapper, connection, target):
     if target.data_source:
         target.data_source.updated = datetime.datetime.utcnow()
+
+
+# noinspection PyUnusedLocal
+@listens_for(AttributePrivacy, 'after_update')
+def receive_attribute_privacy_change(mapper, connection, target):
+    if target.attribute and target.attribute.data_source:
+        target.attribute.data_source.updated = datetime.datetime.utcnow()
+
+
+# Columns of Storage that are not in the representation of data sources
+STORAGE_INTERNAL_FIELDS = ('catalog_updated',)
+
+
+def _touch_data_sources(connection, storage):
+    # Storage is part of the representation of its data sources (ETags and
+    # cached payloads depend on DataSource.updated)
+    table = DataSource.__table__
+    connection.execute(table.update().where(
+        table.c.storage_id == storage.id).values(
+        updated=datetime.datetime.utcnow()))
+    for (data_source_id,) in connection.execute(
+            select(table.c.id).where(table.c.storage_id == storage.id)):
+        _mark_as_changed(storage, data_source_id)
+
+
+# noinspection PyUnusedLocal
+@listens_for(Storage, 'after_update')
+def receive_storage_change(mapper, connection, target):
+    # Refreshes of the catalog only change internal fields
+    state = inspect(target)
+    if any(state.attrs[attr.key].history.has_changes()
+           for attr in mapper.column_attrs
+           if attr.key not in STORAGE_INTERNAL_FIELDS):
+        _touch_data_sources(connection, target)
+
+
+# noinspection PyUnusedLocal
+@listens_for(Storage, 'after_delete')
+def receive_storage_delete(mapper, connection, target):
+    _touch_data_sources(connection, target)
@@ -1,10 +1,38 @@
 from pyarrow import fs, csv, types as pa_types
 import pyarrow as pa
+import pyarrow.json as pa_json
+import pyarrow.compute as pc
+import pyarrow.dataset as pa_dataset
 import pyarrow.parquet as pq
+import collections
 import io
-import gzip
+import json
+import threading
+import time
 from gettext import gettext
 
+from flask import current_app, has_app_context
+
+from limonero.util import SPECIAL_DELIMITERS, compression, partitions
+from limonero.util.execution import check_cancelled
+
+# Size (bytes) of blocks read when copying streams
+BUFFER_SIZE = 1024 * 1024
+
+# Size (bytes) of blocks of JSON lines read at once, and read to infer the
+# attributes of a JSON data source
+JSON_BLOCK_SIZE = 1024 * 1024
+
+# Cache of file information and directory listings of HDFS paths (see
+# CachedFileSystemHandler). Lifetimes in seconds, overridden by config
+# (listing_cache); timeout 0 disables the cache.
+DEFAULT_LISTING_CACHE_OPTIONS = {
+    'timeout': 30,
+    # Paths not found, usually tested again soon (e.g. before a write)
+    'not_found_timeout': 5,
+    'max_entries': 10000,
+}
+
 def copy_merge(local: fs.HadoopFileSystem, source_dir: str, 
         target: str, filename: str, n_chunks: int):
     """ """
@@ -12,14 +40,31 @@ def copy_merge(local: fs.HadoopFileSystem, source_dir: str,
         for i in range(n_chunks):
             number = str(i + 1).rjust(9, '0')
             name = f'{source_dir.rstrip("/")}/{filename}.part{number}'
-            with local.open_input_file(name) as in_file:
-                stream.write(in_file.readall())
+            with local.open_input_stream(name) as in_file:
+                copy_stream(in_file, stream)
         
     for i in range(n_chunks):
         number = str(i + 1).rjust(9, '0')
         name = f'{source_dir.rstrip("/")}/{filename}.part{number}'
         local.delete_file(name)
         
+def copy_stream(source, target, buffer_size: int = BUFFER_SIZE,
+                digests=()) -> int:
+    """
+    Copy source into target (file-like objects), in blocks of buffer_size,
+    and return the number of bytes copied. Digests (hashlib objects) are
+    updated with the data copied.
+    """
+    total = 0
+    while True:
+        block = source.read(buffer_size)
+        if not block:
+            return total
+        for digest in digests:
+            digest.update(block)
+        target.write(block)
+        total += len(block)
+
 def write(local: fs.HadoopFileSystem, path: str, chunk: any):
     """ Write data """
     with local.open_output_stream(path) as stream:
@@ -43,13 +88,14 @@ def exists(local: fs.HadoopFileSystem, path: str) -> bool:
     """
     return local.get_file_info(path).type != fs.FileType.NotFound
 
-def sample_parquet(local: fs.HadoopFileSystem, path: str, size: int, schema=None):
-    """ Return a sample of size rows from Parquet file """
-    if schema:
-        ds = pq.ParquetDataset(path, filesystem=local, schema=schema)
-    else:
-        ds = pq.ParquetDataset(path, filesystem=local)
-    return ds.read().slice(0, size).to_pylist()
+def sample_parquet(local: fs.HadoopFileSystem, path: str, size: int,
+                   schema=None, filters=None, names=None):
+    """
+    Return a sample of size rows from Parquet file or directory, reading
+    only the partitions in filters (see util.partitions)
+    """
+    return partitions.read_sample(local, path, 'parquet', size, schema,
+                                  filters, names)
 
 def get_parquet_schema(ds):
     """ Return a sample of size rows from Parquet file """
@@ -65,18 +111,20 @@ def get_parquet_schema(ds):
          (pa.binary, 'BINARY'),
          (lambda p, s: pa.decimal128(p or 10, 4 if s is None else s), 'DECIMAL'),
          (pa.large_string, 'TEXT'),
-         (pa.time64, 'TIME'),
-         (lambda: pa.list(pa.string), 'VECTOR'),
+         (lambda: pa.time64('us'), 'TIME'),
+         (lambda: pa.list_(pa.string()), 'VECTOR'),
     ]
 
     for attr in ds.attributes:
+        ok = False
         for dtype, limonero_type in tests:
-            ok = False
-            if limonero_type == 'DECIMAL':
+            if attr.type != limonero_type:
+                continue
+            elif limonero_type == 'DECIMAL':
                 new_attrs.append((attr.name, dtype(attr.precision, attr.scale)))
                 ok = True
                 break
-            elif attr.type == limonero_type:
+            else:
                 new_attrs.append((attr.name, dtype()))
                 ok = True
                 break
@@ -84,13 +132,12 @@ def get_parquet_schema(ds):
             new_attrs.append((attr.name, pa.string()))
     return pa.schema(new_attrs)
 
-def infer_parquet(local: fs.FileSystem, path: str):
-    """ Return a sample of size rows from Parquet file """
-    ds = pq.ParquetDataset(path, filesystem=local)
-    schema = ds.read().schema
+def _limonero_types(schema: pa.Schema):
+    """ Limonero types (type, precision, scale) of the fields in schema """
     tests = [
          (pa_types.is_unicode, 'CHARACTER'),
          (pa_types.is_boolean, 'INTEGER'),
+         (pa_types.is_int64, 'LONG'),
          (pa_types.is_integer, 'INTEGER'),
          (pa_types.is_float64, 'DOUBLE'),
          (pa_types.is_floating, 'FLOAT'),
@@ -100,6 +147,8 @@ def infer_parquet(local: fs.FileSystem, path: str):
          (pa_types.is_decimal, 'DECIMAL'),
          (pa_types.is_list, 'VECTOR'),
          (pa_types.is_large_string, 'TEXT'),
+         # Only nulls found (e.g. in a sample of JSON lines)
+         (pa_types.is_null, 'CHARACTER'),
     ]
 
     limonero_types = []
@@ -117,50 +166,176 @@ def infer_parquet(local: fs.FileSystem, path: str):
                 break  
         if not ok:
             raise ValueError(gettext(
-                'Unsupported Parquet data type: {t}').format( 
+                'Unsupported data type: {t}').format( 
                 t = str(t))) 
             
     return zip(schema.names, limonero_types)
 
+def infer_parquet(local: fs.FileSystem, path: str):
+    """ Infer attributes from Parquet file or directory """
+    return _limonero_types(
+        partitions.open_dataset(local, path, 'parquet')[0].schema)
+
+def _parse_json(block: bytes, schema=None) -> pa.Table:
+    parse_options = pa_json.ParseOptions(
+        explicit_schema=schema,
+        unexpected_field_behavior='ignore' if schema else 'infer')
+    return pa_json.read_json(io.BytesIO(block), parse_options=parse_options)
+
+def read_json_blocks(local: fs.FileSystem, path: str, schema=None,
+                     block_size: int = JSON_BLOCK_SIZE):
+    """
+    Tables with the JSON lines in path, parsed in blocks of about
+    block_size bytes (whole lines). Without schema, it is inferred from each
+    block and merged with the schema of the previous ones, so a column that
+    is null (or integer) in the first block may be string (or double) in the
+    next ones, and new fields are added.
+    Compressed files are detected by their content (see util.compression).
+    """
+    inferred = schema is None
+    with compression.open_input(local, path) as reader:
+        while True:
+            block = reader.read(block_size)
+            if not block:
+                break
+            block += reader.readline()
+            if not inferred:
+                table = _parse_json(block, schema)
+            else:
+                table = _parse_json(block, None)
+                if schema is not None:
+                    merged = pa.unify_schemas(
+                        [schema, table.schema], promote_options='permissive')
+                    if not merged.equals(table.schema):
+                        # Parsed again, with the promoted types
+                        table = _parse_json(block, merged)
+                schema = table.schema
+            yield table
+
+def flatten_json(table: pa.Table) -> pa.Table:
+    """ Nested objects (structs) as columns named parent.child """
+    while any(pa_types.is_struct(t) for t in table.schema.types):
+        table = table.flatten()
+    return table
+
+def sample_json(local: fs.FileSystem, paths, size: int):
+    """ Return a sample of size rows from JSON lines files """
+    lines = []
+    for path in paths:
+        for table in read_json_blocks(local, path):
+            check_cancelled()
+            table = flatten_json(table.slice(0, size - len(lines)))
+            lines.extend(table.to_pylist())
+            if len(lines) >= size:
+                return lines
+    return lines
+
+def infer_json(local: fs.FileSystem, paths):
+    """
+    Infer attributes from the first block of JSON lines (JSON_BLOCK_SIZE)
+    of the first file in paths. Nested objects are flattened and lists are
+    vectors.
+    """
+    for path in paths:
+        table = next(read_json_blocks(local, path), None)
+        if table is not None:
+            return _limonero_types(flatten_json(table).schema)
+    raise ValueError(gettext('File is empty.'))
+
 def _csv_options(ds):
+    """
+    Options to read CSV files of data source ds. Values of its attributes
+    are read as strings and converted by _typed_table
+    """
+    delimiter = ds.attribute_delimiter or ','
+    missing = [v for v in (ds.treat_as_missing or '').split(',') if v]
+    # Partition keys are not in the files, but in their paths
+    column_names = [attr.name for attr in ds.attributes
+                    if not attr.partition_key]
     convert_options = csv.ConvertOptions(
-        null_values=(ds.treat_as_missing or '').split(','),
+        null_values=[''] + missing,
+        strings_can_be_null=True,
+        column_types={name: pa.string() for name in column_names},
     )
     parse_options = csv.ParseOptions(
-        delimiter=ds.attribute_delimiter or ',',
+        delimiter=SPECIAL_DELIMITERS.get(delimiter, delimiter),
         quote_char=ds.text_delimiter or '"',
         newlines_in_values=bool(ds.is_multiline),
         invalid_row_handler=lambda row: 'skip',
     )
     read_options = csv.ReadOptions(
-        column_names=[attr.name for attr in ds.attributes],
+        column_names=column_names,
         encoding=ds.encoding or 'utf8',
-        skip_rows=0 if len(ds.attributes) == 0 else 1
+        skip_rows=1 if column_names and ds.is_first_line_header else 0,
+        autogenerate_column_names=(not column_names and
+                                   not ds.is_first_line_header),
     )
     return convert_options, parse_options, read_options
 
+def _typed_table(table: pa.Table, ds):
+    """
+    Convert columns (strings) of table to the types of the attributes of ds.
+    Columns with invalid values are kept as strings, and their names are
+    returned as warnings.
+    """
+    schema = get_parquet_schema(ds)
+    columns = []
+    warnings = []
+    for name, column in zip(table.column_names, table.columns):
+        if pa_types.is_string(column.type):
+            column = pc.utf8_trim_whitespace(column)
+            if name in schema.names:
+                try:
+                    column = column.cast(schema.field(name).type)
+                except pa.ArrowNotImplementedError:
+                    # e.g. VECTOR and TIME, kept as strings
+                    pass
+                except pa.ArrowInvalid:
+                    warnings.append(name)
+        columns.append(column)
+    return pa.table(columns, names=table.column_names), warnings
+
 def sample_csv(local: fs.HadoopFileSystem, path: str, size: int, ds):
-    """ Return a sample of size rows from CSV file """
-    lines = []
+    """
+    Return a sample of size rows from CSV file (compressed files are
+    detected by their content) and the attributes with invalid values
+    """
     convert_options, parse_options, read_options = _csv_options(ds)
-    is_gzip = path.endswith('.gz')
-
-    with local.open_input_file(path) as f:
-        if is_gzip:
-            reader = gzip.open(io.BufferedReader(f), mode='rb')
-        else:
-            reader = f
-        with csv.open_csv(reader, convert_options=convert_options,
+    batches = []
+    total = 0
+    with compression.open_input(local, path) as f:
+        with csv.open_csv(f, convert_options=convert_options,
                 read_options=read_options,
                 parse_options=parse_options) as reader:
+            schema = reader.schema
             for next_chunk in reader:
-                next_table = pa.Table.from_batches([next_chunk])
-                next_table = next_table.slice(0, size - len(lines))
-                lines.extend(next_table.to_pylist())
-                if len(lines) >= size:
+                check_cancelled()
+                batches.append(next_chunk)
+                total += next_chunk.num_rows
+                if total >= size:
                     break
 
-    return lines[:size]
+    table = pa.Table.from_batches(batches, schema).slice(0, size)
+    table, warnings = _typed_table(table, ds)
+    return table.to_pylist(), warnings
+
+def sample_csv_directory(local: fs.FileSystem, path: str, size: int, ds,
+                         filters=None):
+    """
+    Return a sample of size rows from the CSV files in a directory,
+    reading only the partitions in filters (see util.partitions), and the
+    attributes with invalid values
+    """
+    convert_options, parse_options, read_options = _csv_options(ds)
+    file_format = pa_dataset.CsvFileFormat(
+        parse_options=parse_options, read_options=read_options,
+        convert_options=convert_options)
+    table = partitions.read_head(local, path, file_format, size,
+                                 filters=filters,
+                                 names=partitions.get_names(ds))
+    table, warnings = _typed_table(table, ds)
+    return table.to_pylist(), warnings
+
 def infer_csv(local: fs.HadoopFileSystem, path: str, size: int, ds):
     """ Infer attributes from CSV file """
     convert_options, parse_options, read_options = _csv_options(ds)
@@ -234,10 +409,18 @@ def download_parquet3(local: fs.HadoopFileSystem, path: str):
         lixo.write(final)
     yield 'ok'
 
-def download_parquet(local: fs.HadoopFileSystem, path: str):
-    """ """
-    ds = pq.ParquetDataset(path, filesystem=local).read()
-    batches = ds.to_batches(max_chunksize=10_000)
+def download_parquet(local: fs.HadoopFileSystem, path: str, filters=None,
+                     names=None):
+    """
+    Stream Parquet file or directory, only the partitions in filters. The
+    dataset is opened before streaming, so invalid filters raise ValueError
+    """
+    ds, expression = partitions.open_dataset(local, path, 'parquet',
+                                             filters=filters, names=names)
+    return _stream_parquet(ds, expression)
+
+def _stream_parquet(ds, expression):
+    batches = ds.to_batches(filter=expression, batch_size=10_000)
 
     sink = io.BytesIO()
     writer = pq.ParquetWriter(sink, ds.schema, store_schema=True)
@@ -252,12 +435,19 @@ def download_parquet(local: fs.HadoopFileSystem, path: str):
     writer.close()
     yield sink.getbuffer().tobytes()
 
-def download_parquet_as_csv(local: fs.HadoopFileSystem, path: str):
-    ds = pq.ParquetDataset(path, filesystem=local).read()
+def download_parquet_as_csv(local: fs.HadoopFileSystem, path: str,
+                            filters=None, names=None):
+    """ Stream Parquet file or directory as CSV (see download_parquet) """
+    ds, expression = partitions.open_dataset(local, path, 'parquet',
+                                             filters=filters, names=names)
+    return _stream_csv(ds, expression)
+
+def _stream_csv(ds, expression):
     BUFFER_SIZE = 4096
 
     buf = io.BytesIO()
-    for i, batch in enumerate(ds.to_batches(max_chunksize=1000)):
+    for i, batch in enumerate(ds.to_batches(filter=expression,
+                                            batch_size=1000)):
         csv.write_csv(batch, buf, csv.WriteOptions(include_header=(i==0)))
         buf.seek(0) # for reading
         done = False
@@ -270,10 +460,13 @@ def download_parquet_as_csv(local: fs.HadoopFileSystem, path: str):
         buf.truncate(0) 
         buf.seek(0) # for writing
 
-def download_file(local: fs.HadoopFileSystem, path: str):
+def download_file(local: fs.HadoopFileSystem, path: str,
+                  decompress: bool = False):
+    """ Content of the file, decompressed if decompress is True """
     BUFFER_SIZE = 4096
     done = False
-    with local.open_input_file(path) as stream:
+    with (compression.open_input(local, path) if decompress
+          else local.open_input_file(path)) as stream:
         while not done:
             data = stream.read(BUFFER_SIZE)
             amount = len(data)
@@ -282,6 +475,271 @@ def download_file(local: fs.HadoopFileSystem, path: str):
             yield bytes(data)
 
 
+class _ListingCache:
+    """
+    Entries (file information or listings) with an expiration time, shared
+    by all file systems of the process. Keys are (namespace, kind, path),
+    where namespace identifies the file system (e.g. HDFS URI and user).
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = collections.OrderedDict()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] <= time.monotonic():
+                del self._entries[key]
+                return None
+            return entry[1]
+
+    def set(self, key, value, timeout, max_entries):
+        if timeout <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (time.monotonic() + timeout, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, namespace, path=None):
+        """
+        Removes entries of path, its ancestors (their listings include it)
+        and descendants (e.g. a directory removed or moved). Without path,
+        removes all entries of the namespace.
+        """
+        with self._lock:
+            for key in [k for k in self._entries if k[0] == namespace and (
+                    path is None or _is_related(k[2], path))]:
+                del self._entries[key]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+_listing_cache = _ListingCache()
+
+# Marker of a directory not found (listing)
+_NOT_FOUND = object()
+
+
+def _cache_path(path):
+    return path.rstrip('/') or '/'
+
+
+def _is_related(path, other):
+    """ Test if paths are the same or one is an ancestor of the other """
+    return (path == other or path.startswith(other.rstrip('/') + '/') or
+            other.startswith(path.rstrip('/') + '/'))
+
+
+class CachedFileSystemHandler(fs.FileSystemHandler):
+    """
+    Handler (for fs.PyFileSystem) caching file information and directory
+    listings of another file system. Each exists()/is_directory() test and
+    ParquetDataset discovery is a RPC to the HDFS namenode, repeated by
+    every request while users browse data sources.
+
+    Writes done through the handler (uploads, merges, conversions,
+    deletes) invalidate the paths changed. Changes done by other processes
+    are seen after the entries expire; use invalidate_listing() after
+    changes done elsewhere. Paths not found are cached too, for a shorter
+    time (not_found_timeout).
+    """
+    def __init__(self, base, namespace, timeout, not_found_timeout,
+                 max_entries):
+        self.base = base
+        self.namespace = namespace
+        self.timeout = timeout
+        self.not_found_timeout = not_found_timeout
+        self.max_entries = max_entries
+
+    def __eq__(self, other):
+        return (isinstance(other, CachedFileSystemHandler) and
+                self.namespace == other.namespace and
+                self.base.equals(other.base))
+
+    def __ne__(self, other):
+        return not self == other
+
+    def _set_info(self, info):
+        timeout = (self.not_found_timeout
+                   if info.type == fs.FileType.NotFound else self.timeout)
+        _listing_cache.set((self.namespace, 'info', _cache_path(info.path)),
+                           info, timeout, self.max_entries)
+
+    def invalidate(self, path=None):
+        _listing_cache.invalidate(
+            self.namespace, None if path is None else _cache_path(path))
+
+    def get_type_name(self):
+        return f'cached-{self.base.type_name}'
+
+    def normalize_path(self, path):
+        return self.base.normalize_path(path)
+
+    def get_file_info(self, paths):
+        infos = [_listing_cache.get((self.namespace, 'info',
+                                     _cache_path(path))) for path in paths]
+        missing = [path for path, info in zip(paths, infos) if info is None]
+        if missing:
+            fetched = iter(self.base.get_file_info(missing))
+            for i, info in enumerate(infos):
+                if info is None:
+                    infos[i] = next(fetched)
+                    self._set_info(infos[i])
+        return infos
+
+    def get_file_info_selector(self, selector):
+        path = _cache_path(selector.base_dir)
+        key = (self.namespace,
+               'list-recursive' if selector.recursive else 'list', path)
+        infos = _listing_cache.get(key)
+        if infos is None:
+            info = _listing_cache.get((self.namespace, 'info', path))
+            if info is not None and info.type == fs.FileType.NotFound:
+                infos = _NOT_FOUND
+            else:
+                try:
+                    infos = tuple(self.base.get_file_info(fs.FileSelector(
+                        selector.base_dir, recursive=selector.recursive)))
+                except FileNotFoundError:
+                    infos = _NOT_FOUND
+                    self._set_info(fs.FileInfo(
+                        path, type=fs.FileType.NotFound))
+                else:
+                    for child in infos:
+                        self._set_info(child)
+                _listing_cache.set(
+                    key, infos, self.not_found_timeout
+                    if infos is _NOT_FOUND else self.timeout,
+                    self.max_entries)
+        if infos is _NOT_FOUND:
+            if selector.allow_not_found:
+                return []
+            raise FileNotFoundError(
+                gettext('Path not found: {}').format(selector.base_dir))
+        return list(infos)
+
+    def create_dir(self, path, recursive):
+        try:
+            self.base.create_dir(path, recursive=recursive)
+        finally:
+            self.invalidate(path)
+
+    def delete_dir(self, path):
+        try:
+            self.base.delete_dir(path)
+        finally:
+            self.invalidate(path)
+
+    def delete_dir_contents(self, path, missing_dir_ok=False):
+        try:
+            self.base.delete_dir_contents(path, missing_dir_ok=missing_dir_ok)
+        finally:
+            self.invalidate(path)
+
+    def delete_root_dir_contents(self):
+        try:
+            self.base.delete_dir_contents('/', accept_root_dir=True)
+        finally:
+            self.invalidate()
+
+    def delete_file(self, path):
+        try:
+            self.base.delete_file(path)
+        finally:
+            self.invalidate(path)
+
+    def move(self, src, dest):
+        try:
+            self.base.move(src, dest)
+        finally:
+            self.invalidate(src)
+            self.invalidate(dest)
+
+    def copy_file(self, src, dest):
+        try:
+            self.base.copy_file(src, dest)
+        finally:
+            self.invalidate(dest)
+
+    def open_input_stream(self, path):
+        return self.base.open_input_stream(path)
+
+    def open_input_file(self, path):
+        return self.base.open_input_file(path)
+
+    def open_output_stream(self, path, metadata):
+        try:
+            return self.base.open_output_stream(path, metadata=metadata)
+        finally:
+            self.invalidate(path)
+
+    def open_append_stream(self, path, metadata):
+        try:
+            return self.base.open_append_stream(path, metadata=metadata)
+        finally:
+            self.invalidate(path)
+
+
+def get_listing_cache_options():
+    options = dict(DEFAULT_LISTING_CACHE_OPTIONS)
+    if has_app_context():
+        config = current_app.config.get('LIMONERO_CONFIG') or {}
+        options.update(config.get('listing_cache') or {})
+    return options
+
+
+def cached_filesystem(base: fs.FileSystem, namespace) -> fs.FileSystem:
+    """ Wraps base with a cache of file information (if enabled) """
+    options = get_listing_cache_options()
+    if options['timeout'] <= 0:
+        return base
+    return fs.PyFileSystem(CachedFileSystemHandler(
+        base, namespace, options['timeout'], options['not_found_timeout'],
+        options['max_entries']))
+
+
+def invalidate_listing(local: fs.FileSystem, path: str = None):
+    """
+    Removes cached information of path (and its ancestors and descendants)
+    or, without path, of the whole file system. Required only after changes
+    not done through local (e.g. by other processes or jobs).
+    """
+    handler = getattr(local, 'handler', None)
+    if isinstance(handler, CachedFileSystemHandler):
+        handler.invalidate(path)
+
+
+def clear_listing_cache():
+    _listing_cache.clear()
+
+
+def get_filesystem(parsed, extra_params=None) -> fs.FileSystem:
+    """
+    File system for a (parsed) storage URL: local (file://) or HDFS. HDFS
+    user is read from storage extra params (default: hadoop). Information
+    about HDFS files is cached (see CachedFileSystemHandler).
+    """
+    if parsed.scheme == 'file':
+        return fs.LocalFileSystem()
+    params = None
+    if extra_params:
+        params = json.loads(extra_params)
+    hadoop_user = (params or {}).get('user') or 'hadoop'
+    str_uri = get_parsed_uri(parsed, False)
+    if parsed.port:
+        hdfs = fs.HadoopFileSystem(str_uri, port=int(parsed.port),
+                                   user=hadoop_user)
+    else:
+        hdfs = fs.HadoopFileSystem(str_uri, user=hadoop_user)
+    return cached_filesystem(hdfs, (str_uri, parsed.port, hadoop_user))
+
+
 def get_parsed_uri(parsed, include_port=True):
     if parsed.port and include_port:
         str_uri = f'{parsed.scheme}://{parsed.hostname}:{parsed.port}'
@@ -16,6 +16,7 @@ from marshmallow.exceptions import ValidationError
 
 from limonero.py4j_init import create_gateway
 from limonero.util import upload, parse_hdfs_extra_params, get_hdfs_conf
+from limonero.util.serialization import stream_ndjson, wants_ndjson
 from .app_auth import requires_auth
 from .schema import *
 
@@ -96,15 +97,20 @@ class ModelListApi(Resource):
 
             models = models.order_by(sort_option)
 
-            page = request.args.get("page") or "1"
-            if page is not None and page.isdigit():
+            page = request.args.get("page")
+            if page is None and wants_ndjson():
+                # Whole list, sent while it is read from database
+                return stream_ndjson(
+                    models, get_schema(ModelListResponseSchema, only=only))
+            page = page or "1"
+            if page.isdigit():
                 page_size = int(request.args.get("size", 20))
                 page = int(page)
                 pagination = models.paginate(page, page_size, True)
                 result = {
-                    "data": ModelListResponseSchema(many=True, only=only).dump(
-                        pagination.items
-                    ),
+                    "data": get_schema(
+                        ModelListResponseSchema, many=True, only=only
+                    ).dump(pagination.items),
                     "pagination": {
                         "page": page,
                         "size": page_size,
@@ -114,7 +120,9 @@ class ModelListApi(Resource):
                 }
             else:
                 result = {
-                    "data": ModelListResponseSchema(many=True, only=only).dump(models)
+                    "data": get_schema(
+                        ModelListResponseSchema, many=True, only=only
+                    ).dump(models)
                 }
             db.session.commit()
             result_code = 200
@@ -180,7 +188,7 @@ class ModelDetailApi(Resource):
         model = filtered.filter(Model.id == model_id).first()
         if model is not None:
             return {"status": "OK", 
-                    "data": [ModelItemResponseSchema().dump(model)]}
+                    "data": [get_schema(ModelItemResponseSchema).dump(model)]}
         else:
             return (
                 dict(status="ERROR", 
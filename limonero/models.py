@@ -1,7 +1,7 @@
 import datetime
 from flask_sqlalchemy import SQLAlchemy
 from sqlalchemy import Column, Integer, String, Boolean, ForeignKey, Float, \
-    Enum, DateTime, Numeric, Text
+    Enum, DateTime, Numeric, Text, UniqueConstraint, BigInteger
 from sqlalchemy.sql import func
 from sqlalchemy.orm import relationship, backref
 
@@ -10,6 +10,7 @@ db = SQLAlchemy()
 
 # noinspection PyClassHasNoInit
 class DataSourceFormat:
+    ARROW = 'ARROW'
     CSV = 'CSV'
     CUSTOM = 'CUSTOM'
     GEO_JSON = 'GEO_JSON'
@@ -102,6 +103,28 @@ class StorageType:
                 if n[0] != '_' and n != 'values']
 
 
+# noinspection PyClassHasNoInit
+class CatalogTableType:
+    TABLE = 'TABLE'
+    VIEW = 'VIEW'
+
+    @staticmethod
+    def values():
+        return [n for n in list(CatalogTableType.__dict__.keys())
+                if n[0] != '_' and n != 'values']
+
+
+# noinspection PyClassHasNoInit
+class UploadStatus:
+    OPEN = 'OPEN'
+    MERGING = 'MERGING'
+
+    @staticmethod
+    def values():
+        return [n for n in list(UploadStatus.__dict__.keys())
+                if n[0] != '_' and n != 'values']
+
+
 # noinspection PyClassHasNoInit
 class DataType:
     BINARY = 'BINARY'
@@ -222,6 +245,8 @@ class Attribute(db.Model):
     format = Column(String(100))
     key = Column(Boolean,
                  default=False, nullable=False)
+    partition_key = Column(Boolean,
+                           default=False, nullable=False)
 
     # Associations
     data_source_id = Column(
@@ -430,6 +455,11 @@ class DataSource(db.Model):
                        default=0, nullable=False)
     use_in_workflow = Column(Boolean,
                              default=0, nullable=False, index=True)
+    snapshot_url = Column(String(1000))
+    snapshot_updated = Column(DateTime)
+    snapshot_ttl = Column(Integer)
+    checksum = Column(String(100), index=True)
+    original_url = Column(String(1000))
 
     # Associations
     storage_id = Column(
@@ -442,6 +472,13 @@ class DataSource(db.Model):
         "Storage",
         overlaps='storage',
         foreign_keys=[storage_id])
+    snapshot_storage_id = Column(
+        Integer,
+        ForeignKey("storage.id",
+                   name="fk_data_source_snapshot_storage_id"))
+    snapshot_storage = relationship(
+        "Storage",
+        foreign_keys=[snapshot_storage_id])
 
     def __str__(self):
         return self.name
@@ -682,6 +719,47 @@ class Storage(db.Model):
     url = Column(String(1000), nullable=False)
     client_url = Column(String(1000))
     extra_params = Column(Text(4294000000))
+    catalog_updated = Column(DateTime)
+
+    def __str__(self):
+        return self.name
+
+    def __repr__(self):
+        return '<Instance {}: {}>'.format(self.__class__, self.id)
+
+
+class StorageCatalogTable(db.Model):
+    """ Table or view of a storage, collected by the metadata catalog """
+    __tablename__ = 'storage_catalog_table'
+    __table_args__ = (
+        UniqueConstraint('storage_id', 'name',
+                         name='uq_storage_catalog_table_name'),
+    )
+
+    # Fields
+    id = Column(Integer, primary_key=True)
+    name = Column(String(250), nullable=False)
+    type = Column(Enum(*list(CatalogTableType.values()),
+                       name='CatalogTableTypeEnumType'), nullable=False)
+    columns = Column(Text(4294000000))
+    columns_updated = Column(DateTime)
+    updated = Column(DateTime,
+                     default=datetime.datetime.utcnow, nullable=False)
+
+    # Associations
+    storage_id = Column(
+        Integer,
+        ForeignKey("storage.id",
+                   name="fk_storage_catalog_table_storage_id"),
+        nullable=False,
+        index=True)
+    storage = relationship(
+        "Storage",
+        overlaps='catalog_tables',
+        foreign_keys=[storage_id],
+        backref=backref("catalog_tables",
+                        lazy='dynamic',
+                        cascade="all, delete-orphan"))
 
     def __str__(self):
         return self.name
@@ -720,3 +798,87 @@ class StoragePermission(db.Model):
     def __repr__(self):
         return '<Instance {}: {}>'.format(self.__class__, self.id)
 
+
+class UploadSession(db.Model):
+    """ Chunked (resumable) upload of a file, until its chunks are merged """
+    __tablename__ = 'upload_session'
+    __table_args__ = (
+        UniqueConstraint('storage_id', 'user_id', 'identifier',
+                         name='uq_upload_session_identifier'),
+    )
+
+    # Fields
+    id = Column(Integer, primary_key=True)
+    identifier = Column(String(250), nullable=False)
+    filename = Column(String(500), nullable=False)
+    total_chunks = Column(Integer, nullable=False)
+    total_size = Column(BigInteger)
+    received_chunks = Column(Integer, default=0, nullable=False)
+    status = Column(Enum(*list(UploadStatus.values()),
+                         name='UploadStatusEnumType'),
+                    default=UploadStatus.OPEN, nullable=False)
+    user_id = Column(Integer, nullable=False)
+    created = Column(DateTime,
+                     default=datetime.datetime.utcnow, nullable=False)
+    updated = Column(DateTime,
+                     default=datetime.datetime.utcnow, nullable=False,
+                     onupdate=datetime.datetime.utcnow)
+
+    # Associations
+    storage_id = Column(
+        Integer,
+        ForeignKey("storage.id",
+                   name="fk_upload_session_storage_id"),
+        nullable=False,
+        index=True)
+    storage = relationship(
+        "Storage",
+        overlaps='upload_sessions',
+        foreign_keys=[storage_id],
+        backref=backref("upload_sessions",
+                        lazy='dynamic',
+                        cascade="all, delete-orphan"))
+
+    def __str__(self):
+        return self.identifier
+
+    def __repr__(self):
+        return '<Instance {}: {}>'.format(self.__class__, self.id)
+
+
+class UploadChunk(db.Model):
+    """ Chunk received in an upload session """
+    __tablename__ = 'upload_chunk'
+    __table_args__ = (
+        UniqueConstraint('session_id', 'number',
+                         name='uq_upload_chunk_number'),
+    )
+
+    # Fields
+    id = Column(Integer, primary_key=True)
+    number = Column(Integer, nullable=False)
+    size = Column(BigInteger, nullable=False)
+    checksum = Column(String(100))
+    created = Column(DateTime,
+                     default=datetime.datetime.utcnow, nullable=False)
+
+    # Associations
+    session_id = Column(
+        Integer,
+        ForeignKey("upload_session.id",
+                   name="fk_upload_chunk_session_id"),
+        nullable=False,
+        index=True)
+    session = relationship(
+        "UploadSession",
+        overlaps='chunks',
+        foreign_keys=[session_id],
+        backref=backref("chunks",
+                        lazy='dynamic',
+                        cascade="all, delete-orphan"))
+
+    def __str__(self):
+        return str(self.number)
+
+    def __repr__(self):
+        return '<Instance {}: {}>'.format(self.__class__, self.id)
@@ -1,4 +1,5 @@
 import datetime
+import functools
 import json
 import re
 from copy import deepcopy
@@ -18,6 +19,22 @@ def partial_schema_factory(schema_cls):
     return schema
 
 
+@functools.lru_cache(maxsize=256)
+def _cached_schema(schema_cls, many, only, exclude):
+    return schema_cls(many=many, only=only, exclude=exclude)
+
+
+def get_schema(schema_cls, many=False, only=None, exclude=()):
+    """
+    Returns a shared schema instance. Building a schema (fields, nested
+    schemas, only/exclude resolution) is expensive and dumping does not
+    change its state, so instances are reused between requests.
+    """
+    return _cached_schema(schema_cls, many,
+                          tuple(only) if only is not None else None,
+                          tuple(sorted(exclude or ())))
+
+
 enum_re = re.compile(r'(Must be one of:) (.+)')
 
 enum_re = re.compile(r'(Must be one of:) (.+)')
@@ -117,6 +134,11 @@ class AttributeListResponseSchema(BaseSchema):
         allow_none=True,
         load_default=False,
         dump_default=False)
+    partition_key = fields.Boolean(
+        required=False,
+        allow_none=True,
+        load_default=False,
+        dump_default=False)
     attribute_privacy = fields.Nested(
         'limonero.schema.AttributePrivacyListResponseSchema',
         allow_none=True)
@@ -177,6 +199,11 @@ class AttributeItemResponseSchema(BaseSchema):
         allow_none=True,
         load_default=False,
         dump_default=False)
+    partition_key = fields.Boolean(
+        required=False,
+        allow_none=True,
+        load_default=False,
+        dump_default=False)
     attribute_privacy = fields.Nested(
         'limonero.schema.AttributePrivacyItemResponseSchema',
         allow_none=True)
@@ -237,6 +264,11 @@ class AttributeCreateRequestSchema(BaseSchema):
         allow_none=True,
         load_default=False,
         dump_default=False)
+    partition_key = fields.Boolean(
+        required=False,
+        allow_none=True,
+        load_default=False,
+        dump_default=False)
     attribute_privacy = fields.Nested(
         'limonero.schema.AttributePrivacyCreateRequestSchema',
         allow_none=True)
@@ -780,6 +812,11 @@ class DataSourceItemResponseSchema(BaseSchema):
         allow_none=True,
         load_default=0,
         dump_default=0)
+    snapshot_updated = fields.DateTime(required=False, allow_none=True)
+    snapshot_ttl = fields.Integer(required=False, allow_none=True)
+    snapshot_storage_id = fields.Integer(required=False, allow_none=True)
+    checksum = fields.String(required=False, allow_none=True)
+    original_url = fields.String(required=False, allow_none=True)
     attributes = fields.Nested(
         'limonero.schema.AttributeItemResponseSchema',
         allow_none=True,
@@ -1177,3 +1214,19 @@ class StorageCreateRequestSchema(BaseSchema):
         ordered = True
         unknown = EXCLUDE
 
+
+
+class StorageCatalogTableResponseSchema(BaseSchema):
+    """ JSON serialization schema """
+    id = fields.Integer(required=True)
+    name = fields.String(required=True)
+    type = fields.String(required=True,
+                         validate=[OneOf(CatalogTableType.values())])
+    columns = fields.Function(lambda x: load_json(x.columns)
+                              if x.columns else None)
+    columns_updated = fields.DateTime(required=False, allow_none=True)
+    updated = fields.DateTime(required=True)
+
+    class Meta:
+        ordered = True
+        unknown = EXCLUDE
@@ -1,7 +1,5 @@
-import json
 import logging
 import math
-from urllib.parse import urlparse
 
 from flask import g as flask_g
 from flask import request
@@ -10,10 +8,17 @@ from flask_restful import Resource
 from sqlalchemy import or_
 
 from limonero.app_auth import requires_auth, requires_permission
-from limonero.models import Storage, db
-from limonero.schema import (StorageCreateRequestSchema,
+from limonero.models import Storage, StorageCatalogTable, db
+from limonero.util.catalog import (CATALOG_STORAGE_TYPES, ensure_catalog,
+                                   ensure_columns, refresh_catalog)
+from limonero.util.http_cache import (cache_headers, etag_for_payload,
+                                      is_not_modified, not_modified)
+from limonero.util.pool import get_pools_stats
+from limonero.schema import (StorageCatalogTableResponseSchema,
+                             StorageCreateRequestSchema,
                              StorageItemResponseSchema,
-                             StorageListResponseSchema, partial_schema_factory)
+                             StorageListResponseSchema, get_schema,
+                             partial_schema_factory)
 
 log = logging.getLogger(__name__)
 
@@ -65,8 +70,9 @@ class StorageListApi(Resource):
         pagination = storages.paginate(page, page_size, True)
 
         result = {
-            'data': StorageListResponseSchema(
-                many=True, only=only, exclude=exclude).dump(pagination.items),
+            'data': get_schema(
+                StorageListResponseSchema, many=True, only=only,
+                exclude=exclude).dump(pagination.items),
             'pagination': {
                 'page': page, 'size': page_size,
                 'total': pagination.total,
@@ -75,7 +81,12 @@ class StorageListApi(Resource):
 
         if log.isEnabledFor(logging.DEBUG):
             log.debug(gettext('Listing %(name)s', name=self.human_name))
-        return result
+
+        # Storage has no version column, ETag is derived from content
+        etag = etag_for_payload(result)
+        if is_not_modified(etag):
+            return not_modified(etag, 'StorageListApi')
+        return result, 200, cache_headers(etag, 'StorageListApi')
 
     @requires_auth
     @requires_permission('ADMINISTRATOR')
@@ -121,9 +132,14 @@ class StorageDetailApi(Resource):
         if storage is not None:
             result = {
                 'status': 'OK',
-                'data': [StorageItemResponseSchema(exclude=exclude).dump(
-                    storage)]
+                'data': [get_schema(StorageItemResponseSchema,
+                                    exclude=exclude).dump(storage)]
             }
+            etag = etag_for_payload(result)
+            if is_not_modified(etag):
+                return not_modified(etag, 'StorageDetailApi')
+            return result, return_code, cache_headers(
+                etag, 'StorageDetailApi')
         else:
             return_code = 404
             result = {
@@ -186,64 +202,121 @@ class StorageDetailApi(Resource):
         return result, return_code
 
 
+def _get_catalog_storage(storage_id):
+    storage = Storage.query.filter(Storage.enabled,
+                                   Storage.id == storage_id).first()
+    if storage is None or storage.type not in CATALOG_STORAGE_TYPES:
+        return None
+    return storage
+
+
+def _storage_not_found():
+    return dict(status="ERROR",
+                message=gettext("%(type)s not found.",
+                                type=gettext('Storage'))), 404
+
+
 class StorageMetadataApi(Resource):
-    """ REST API for a single instance of class storage metadata"""
+    """
+    Tables and views of a storage (Hive or JDBC), served from the metadata
+    catalog. Catalog is crawled when older than TTL (config catalog_ttl).
+    Without page argument, returns only the names of all tables.
+    """
 
     @staticmethod
     @requires_auth
     def get(storage_id):
-        # user = getattr(flask_g, 'user')
-        # exclude = tuple() if user.id in (0, 1) else tuple(['url'])
+        storage = _get_catalog_storage(storage_id)
+        if storage is None:
+            return _storage_not_found()
+        try:
+            ensure_catalog(storage)
+        except Exception as ex:
+            log.exception(str(ex))
+            return dict(status="ERROR", message=str(ex)), 500
+
+        tables = StorageCatalogTable.query.filter(
+            StorageCatalogTable.storage_id == storage.id)
+        query = request.args.get('query') or request.args.get('name')
+        if query:
+            tables = tables.filter(
+                StorageCatalogTable.name.ilike(f'%%{query}%%'))
+        table_type = request.args.get('type')
+        if table_type:
+            tables = tables.filter(
+                StorageCatalogTable.type == table_type.upper())
+        tables = tables.order_by(StorageCatalogTable.name)
+
+        page = request.args.get('page', type=int)
+        if page is None:
+            names = [name for (name, ) in tables.with_entities(
+                StorageCatalogTable.name)]
+            return dict(status='OK', data=names), 200
+
+        page_size = request.args.get('size', type=int, default=20)
+        pagination = tables.paginate(page, page_size, True)
+        return {
+            'status': 'OK',
+            'data': get_schema(StorageCatalogTableResponseSchema, many=True,
+                               exclude=('columns', )).dump(pagination.items),
+            'pagination': {
+                'page': page, 'size': page_size,
+                'total': pagination.total,
+                'pages': int(math.ceil(1.0 * pagination.total / page_size))}
+        }, 200
+
 
-        storage = Storage.query.filter(Storage.enabled,
-                                       Storage.id == storage_id).first()
+class StorageMetadataTableApi(Resource):
+    """ Columns of a table or view in the metadata catalog """
 
-        parsed = urlparse(
-            next((a for a in [storage.client_url, storage.url]
-                  if a), None))
-        result = {}
-        status_code = 200
+    @staticmethod
+    @requires_auth
+    def get(storage_id, table_name):
+        storage = _get_catalog_storage(storage_id)
+        if storage is None:
+            return _storage_not_found()
         try:
-            if storage is not None:
-                if storage.type in ('HIVE', 'HIVE_WAREHOUSE'):
-                    from pyhive import hive
-                    from TCLIService.ttypes import TOperationState
-                    extra = {}
-                    if storage.extra_params:
-                        extra = json.loads(storage.extra_params)
-                    auth = extra.get('auth', 'CUSTOM')
-                    if not parsed.password:
-                        auth = None
-                    cursor = hive.connect(
-                        host=parsed.hostname,
-                        port=int(parsed.port or 10000),
-                        username=parsed.username,
-                        password=parsed.password if parsed.password else None,
-                        database=(parsed.path or 'default').replace('/', ''),
-                        auth=auth,
-                        configuration={
-                            'hive.cli.print.header': 'true'},
-                        kerberos_service_name=extra.get(
-                            'kerberos_service_name'),
-                        thrift_transport=None).cursor()
-
-                    tables = []
-                    for cmd in ['SHOW TABLES', 'SHOW VIEWS']:
-                        cursor.execute(cmd, async_=True)
-                        status = cursor.poll().operationState
-                        while status in (TOperationState.INITIALIZED_STATE,
-                                         TOperationState.RUNNING_STATE):
-                            status = cursor.poll().operationState
-                        tables.extend(row[0] for row in cursor)
-                    result, status_code = dict(status='OK',
-                                               data=tables), 200
-                    cursor.close()
-                elif storage.type == 'JDBC':
-                    pass  # FIXME: Implement
-                return result, status_code
-            else:
-                return dict(status="ERROR",
-                            message=gettext("%(type)s not found.",
-                                      type=gettext('Storage'))), 404
+            ensure_catalog(storage)
+            table = StorageCatalogTable.query.filter(
+                StorageCatalogTable.storage_id == storage.id,
+                StorageCatalogTable.name == table_name).first()
+            if table is not None:
+                table = ensure_columns(storage, table)
         except Exception as ex:
+            log.exception(str(ex))
             return dict(status="ERROR", message=str(ex)), 500
+        if table is None:
+            return dict(status="ERROR",
+                        message=gettext("%(type)s not found.",
+                                        type=gettext('Table'))), 404
+        return get_schema(StorageCatalogTableResponseSchema).dump(table), 200
+
+
+class StorageMetadataRefreshApi(Resource):
+    """ Crawls a storage and refreshes its metadata catalog """
+
+    @staticmethod
+    @requires_auth
+    @requires_permission('ADMINISTRATOR')
+    def post(storage_id):
+        storage = _get_catalog_storage(storage_id)
+        if storage is None:
+            return _storage_not_found()
+        with_columns = request.args.get('columns') in ('1', 'true')
+        try:
+            total = refresh_catalog(storage, with_columns)
+        except Exception as ex:
+            log.exception(str(ex))
+            return dict(status="ERROR", message=str(ex)), 500
+        return dict(status='OK', message=gettext(
+            'Catalog refreshed: %(total)s tables.', total=total)), 200
+
+
+class StoragePoolsApi(Resource):
+    """ Metrics of the pools of connections to external databases """
+
+    @staticmethod
+    @requires_auth
+    @requires_permission('ADMINISTRATOR')
+    def get():
+        return dict(status='OK', data=get_pools_stats()), 200
@@ -20,10 +20,15 @@ def strip_accents(s):
     return ''.join(c for c in unicodedata.normalize('NFD', s)
                    if unicodedata.category(c) != 'Mn')
 
+SPECIAL_DELIMITERS = {'{tab}': '\t',
+                      '{new_line \\n}': '\n',
+                      '{new_line \\r\\n}': '\r\n'
+                     }
+
 HdfsExtraParameters = collections.namedtuple('HdfsExtraParameters', 
-    ['user', 'use_hostname', 'resources'])
+    ['user', 'use_hostname', 'resources', 'to_parquet'])
 # Python 3.6
-HdfsExtraParameters.__new__.__defaults__ = (None, None)
+HdfsExtraParameters.__new__.__defaults__ = (None, None, None)
 
 def parse_hdfs_extra_params(data):
     if data is not None:
@@ -0,0 +1,191 @@
+# -*- coding: utf-8 -*-
+"""
+Metadata catalog of storages backed by databases (Hive and JDBC).
+Tables, views and their columns are crawled and kept in Limonero's database,
+so browsing a storage does not depend on the database server.
+"""
+import collections
+import datetime
+import json
+import logging
+import threading
+from contextlib import closing
+from urllib.parse import urlparse
+
+from flask import current_app
+from flask_babel import gettext
+
+import limonero.util.hive as hive_util
+from limonero.models import (CatalogTableType, StorageCatalogTable,
+                             StorageType, db)
+from limonero.util.dialects import get_dialect
+from limonero.util.hive import get_hive_pool
+
+log = logging.getLogger(__name__)
+
+CONFIG_KEY = 'LIMONERO_CONFIG'
+DEFAULT_CATALOG_TTL = 3600
+
+CATALOG_STORAGE_TYPES = (StorageType.HIVE, StorageType.HIVE_WAREHOUSE,
+                         StorageType.JDBC)
+
+# Rows changed per statement when synchronizing the catalog
+SYNC_BATCH_SIZE = 500
+
+_locks = collections.defaultdict(threading.Lock)
+
+
+def get_catalog_ttl():
+    config = current_app.config.get(CONFIG_KEY) or {}
+    return int(config.get('catalog_ttl', DEFAULT_CATALOG_TTL))
+
+
+def _is_stale(updated):
+    return updated is None or (
+        datetime.datetime.utcnow() - updated >
+        datetime.timedelta(seconds=get_catalog_ttl()))
+
+
+def _hive_pool(storage):
+    parsed = urlparse(storage.client_url or storage.url)
+    return get_hive_pool(parsed, storage.extra_params)
+
+
+def _crawl_hive(storage):
+    """ Tables and views. Columns are described on demand """
+    with _hive_pool(storage).connection() as cn, \
+            closing(cn.cursor()) as cursor:
+        hive_util.execute(cursor, 'SHOW TABLES')
+        # Views are also listed by SHOW TABLES
+        result = {row[0]: (CatalogTableType.TABLE, None) for row in cursor}
+        hive_util.execute(cursor, 'SHOW VIEWS')
+        result.update({row[0]: (CatalogTableType.VIEW, None)
+                       for row in cursor})
+    return result
+
+
+def _describe_hive(storage, name):
+    with _hive_pool(storage).connection() as cn, \
+            closing(cn.cursor()) as cursor:
+        hive_util.execute(cursor, 'DESCRIBE `{}`'.format(
+            name.replace('`', '``')))
+        columns = []
+        for col_name, data_type, *_ in cursor:
+            # Partition and detailed information come after an empty line
+            col_name = (col_name or '').strip()
+            if not col_name or col_name.startswith('#'):
+                break
+            columns.append({'name': col_name, 'type': data_type.strip()})
+    return columns
+
+
+def _crawl_jdbc(storage, name=None):
+    """ Tables, views and columns, read from database metadata """
+    dialect = get_dialect(urlparse(storage.client_url or storage.url))
+    with dialect.get_pool().connection() as cn:
+        return dialect.crawl(cn, name)
+
+
+def _crawl(storage):
+    if storage.type == StorageType.JDBC:
+        return _crawl_jdbc(storage)
+    elif storage.type in (StorageType.HIVE, StorageType.HIVE_WAREHOUSE):
+        return _crawl_hive(storage)
+    raise ValueError(gettext('Storage type %(type)s has no catalog.',
+                             type=storage.type))
+
+
+def _describe(storage, name):
+    if storage.type == StorageType.JDBC:
+        found = _crawl_jdbc(storage, name).get(name)
+        return found[1] if found else None
+    return _describe_hive(storage, name)
+
+
+def _batches(items):
+    items = list(items)
+    for i in range(0, len(items), SYNC_BATCH_SIZE):
+        yield items[i:i + SYNC_BATCH_SIZE]
+
+
+def refresh_catalog(storage, with_columns=False):
+    """
+    Crawls the storage and synchronizes its catalog. Only new, changed and
+    removed tables are written. For Hive, columns are described only if
+    with_columns is True (one request per table), otherwise on demand.
+    """
+    with _locks[storage.id]:
+        crawled = _crawl(storage)
+        now = datetime.datetime.utcnow()
+        existing = {t.name: t for t in StorageCatalogTable.query.filter(
+            StorageCatalogTable.storage_id == storage.id)}
+
+        if with_columns and storage.type != StorageType.JDBC:
+            crawled = {name: (table_type, _describe(storage, name))
+                       for name, (table_type, _) in crawled.items()}
+
+        removed = [t.id for name, t in existing.items() if name not in crawled]
+        inserted = []
+        updated = []
+        for name, (table_type, columns) in crawled.items():
+            columns = json.dumps(columns) if columns is not None else None
+            table = existing.get(name)
+            if table is None:
+                inserted.append({
+                    'name': name, 'type': table_type, 'columns': columns,
+                    'columns_updated': now if columns is not None else None,
+                    'updated': now, 'storage_id': storage.id})
+                continue
+            changes = {}
+            if table.type != table_type:
+                changes['type'] = table_type
+            if columns is not None and table.columns != columns:
+                changes.update({'columns': columns, 'columns_updated': now})
+            if changes:
+                changes.update({'id': table.id, 'updated': now})
+                updated.append(changes)
+
+        for ids in _batches(removed):
+            StorageCatalogTable.query.filter(
+                StorageCatalogTable.id.in_(ids)).delete(
+                synchronize_session=False)
+        for rows in _batches(inserted):
+            db.session.bulk_insert_mappings(StorageCatalogTable, rows)
+        # Grouped by keys, so each group is a single executemany()
+        by_keys = collections.defaultdict(list)
+        for row in updated:
+            by_keys[tuple(sorted(row))].append(row)
+        for rows in by_keys.values():
+            db.session.bulk_update_mappings(StorageCatalogTable, rows)
+
+        storage.catalog_updated = now
+        db.session.commit()
+        log.info(gettext('Catalog of storage %s refreshed: %s new, %s '
+                         'changed and %s removed tables.'),
+                 storage.id, len(inserted), len(updated), len(removed))
+        return len(crawled)
+
+
+def ensure_catalog(storage):
+    """ Refreshes the catalog if it was never crawled or is older than TTL """
+    if _is_stale(storage.catalog_updated):
+        refresh_catalog(storage)
+
+
+def ensure_columns(storage, table):
+    """
+    Describes the table if its columns are unknown or, for Hive, older than
+    TTL. JDBC columns are refreshed with the catalog (see ensure_catalog).
+    """
+    if table.columns is None or (storage.type != StorageType.JDBC and
+                                 _is_stale(table.columns_updated)):
+        columns = _describe(storage, table.name)
+        if columns is None:
+            # Table was removed since last crawl
+            db.session.delete(table)
+            db.session.commit()
+            return None
+        table.columns = json.dumps(columns)
+        table.columns_updated = datetime.datetime.utcnow()
+        db.session.commit()
+    return table
@@ -0,0 +1,191 @@
+# -*- coding: utf-8 -*-
+"""
+Compaction of directory data sources (Parquet, DATA_FOLDER with Parquet
+files), usually written by Spark as thousands of small part files, which
+makes listing, sampling and downloading slow. The directory is rewritten
+into files of about target_file_bytes (row groups as in util.conversion),
+optionally sorted by an attribute, and swapped with the original one.
+"""
+import datetime
+import logging
+import uuid
+from urllib.parse import urlparse
+
+import pyarrow as pa
+import pyarrow.dataset as pa_dataset
+from flask import current_app, has_app_context
+from flask_babel import gettext
+
+import limonero.hdfs_util as hu
+from limonero.models import DataSourceFormat, db
+from limonero.util.conversion import list_files, write_batches
+from limonero.util.execution import set_progress
+
+log = logging.getLogger(__name__)
+
+COMPACTION_FORMATS = (DataSourceFormat.PARQUET, DataSourceFormat.DATA_FOLDER)
+
+DEFAULT_COMPACTION_OPTIONS = {
+    # Size (bytes, in memory) of compacted files
+    'target_file_bytes': 256 * 1024 ** 2,
+    # Directories with at least min_files files are compacted by the
+    # command compact-data-sources
+    'min_files': 100,
+}
+
+# Rows read at once from the original files
+READ_BATCH_SIZE = 65536
+
+
+def get_options():
+    options = dict(DEFAULT_COMPACTION_OPTIONS)
+    if has_app_context():
+        config = current_app.config.get('LIMONERO_CONFIG') or {}
+        options.update(config.get('compaction') or {})
+    return options
+
+
+def _get_files(data_source):
+    """ File system, path of the directory and its files (path, size) """
+    if data_source.format not in COMPACTION_FORMATS:
+        raise ValueError(gettext(
+            'Format %(format)s cannot be compacted.',
+            format=data_source.format))
+    parsed = urlparse(data_source.url or '')
+    if parsed.scheme not in ('file', 'hdfs'):
+        raise ValueError(gettext(
+            'Only data sources stored in HDFS or local files can be '
+            'compacted.'))
+    filesystem = hu.get_filesystem(parsed, data_source.storage.extra_params)
+    path = parsed.path.rstrip('/')
+    if not hu.is_directory(filesystem, path):
+        raise ValueError(gettext('Data source is not a directory.'))
+    files = list_files(filesystem, path)
+    if any(f.rsplit('/', 1)[0] != path for f, _ in files):
+        raise ValueError(gettext(
+            'Directories with sub-directories (partitions) cannot be '
+            'compacted.'))
+    return filesystem, path, files
+
+
+def needs_compaction(data_source, min_files=None):
+    if min_files is None:
+        min_files = get_options()['min_files']
+    _, _, files = _get_files(data_source)
+    return len(files) >= min_files
+
+
+def _split(batches, target_bytes):
+    """ Groups batches by output file, each with about target_bytes """
+    batches = iter(batches)
+
+    def file_batches(batch):
+        size = 0
+        while batch is not None:
+            yield batch
+            size += batch.nbytes
+            if size >= target_bytes:
+                return
+            batch = next(batches, None)
+
+    while True:
+        first = next(batches, None)
+        if first is None:
+            return
+        yield file_batches(first)
+
+
+def _sorted(batches, sort_by, schema):
+    table = pa.Table.from_batches(list(batches), schema)
+    return table.sort_by(sort_by).to_batches()
+
+
+def _swap(filesystem, path, compacted):
+    """ Replaces the directory in path by the compacted one """
+    parent, name = path.rsplit('/', 1)
+    old = f'{parent}/.{name}.old-{uuid.uuid4().hex}'
+    filesystem.move(path, old)
+    try:
+        filesystem.move(compacted, path)
+    except BaseException:
+        filesystem.move(old, path)
+        raise
+    try:
+        filesystem.delete_dir(old)
+    except (FileNotFoundError, OSError):
+        log.warning(gettext('Could not remove %s'), old, exc_info=True)
+
+
+def compact(data_source, sort_by=None, target_file_bytes=None,
+            compression=None):
+    """
+    Rewrites the files of data_source into files of about target_file_bytes
+    (optionally sorted by the attribute sort_by, within each file) and
+    updates its estimated rows and size. Returns statistics.
+    """
+    filesystem, path, files = _get_files(data_source)
+    if target_file_bytes is None:
+        target_file_bytes = get_options()['target_file_bytes']
+
+    dataset = pa_dataset.dataset([f for f, _ in files], format='parquet',
+                                 filesystem=filesystem)
+    schema = dataset.schema
+    if sort_by is not None and sort_by not in schema.names:
+        raise ValueError(gettext('Attribute %(name)s not found.',
+                                 name=sort_by))
+
+    parent, name = path.rsplit('/', 1)
+    compacted = f'{parent}/.{name}.compact-{uuid.uuid4().hex}'
+    filesystem.create_dir(compacted)
+    total_bytes = sum(size for _, size in files)
+    set_progress(files=len(files), bytes=total_bytes, rows=0)
+    rows = 0
+    parts = 0
+    try:
+        groups = _split(dataset.to_batches(batch_size=READ_BATCH_SIZE),
+                        target_file_bytes)
+        for part, batches in enumerate(groups):
+            if sort_by is not None:
+                batches = _sorted(batches, sort_by, schema)
+            rows += write_batches(
+                batches, filesystem, f'{compacted}/part-{part:05}.parquet',
+                'parquet', schema, compression)
+            parts = part + 1
+            set_progress(rows=rows, files_written=parts)
+        if parts == 0:
+            # Empty data source, the schema is still required by readers
+            rows += write_batches([], filesystem,
+                                  f'{compacted}/part-00000.parquet',
+                                  'parquet', schema, compression)
+            parts = 1
+        _swap(filesystem, path, compacted)
+    except BaseException:
+        if hu.exists(filesystem, compacted):
+            filesystem.delete_dir(compacted)
+        raise
+
+    size = sum(size for _, size in list_files(filesystem, path))
+    data_source.estimated_rows = rows
+    data_source.estimated_size_in_mega_bytes = size / 1024.0 ** 2
+    data_source.updated = datetime.datetime.utcnow()
+    db.session.commit()
+    return {'files_before': len(files), 'files_after': parts, 'rows': rows,
+            'bytes_before': total_bytes, 'bytes_after': size}
+
+
+def compact_small_files(data_sources, min_files=None):
+    """ Compacts the data sources with at least min_files files """
+    compacted = 0
+    for data_source in data_sources:
+        try:
+            if needs_compaction(data_source, min_files):
+                compact(data_source)
+                compacted += 1
+        except ValueError:
+            log.info(gettext('Data source %s cannot be compacted'),
+                     data_source.id, exc_info=True)
+        except Exception:
+            db.session.rollback()
+            log.exception(gettext('Could not compact data source %s'),
+                          data_source.id)
+    return compacted
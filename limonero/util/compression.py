@@ -0,0 +1,274 @@
+# -*- coding: utf-8 -*-
+"""
+Compressed files (gzip, bz2, zstd, lz4, xz and zip), detected by their first
+bytes (magic numbers) instead of the extension, because uploaded and
+generated files are often named data.csv or part-00000 even if compressed.
+
+Files are decompressed while they are read. A gzip or zstd stream must be
+decompressed from its beginning, in a single thread, except if it is split
+into independent blocks: BGZF (gzip written by bgzip, used in bioinformatics)
+and seekable Zstandard (zstd --seekable, t2sz). Their blocks are read in
+order and decompressed in parallel (zlib and zstd release the GIL), a few
+blocks ahead of the reader.
+"""
+import collections
+import io
+import lzma
+import struct
+import zipfile
+import zlib
+from concurrent import futures
+
+import pyarrow as pa
+from flask_babel import gettext
+
+GZIP = 'gzip'
+BZ2 = 'bz2'
+ZSTD = 'zstd'
+LZ4 = 'lz4'
+XZ = 'xz'
+ZIP = 'zip'
+
+# BZh, block size (1-9) and the magic of the first block or, if the stream
+# is empty, of its end (BZh alone is also the start of text files)
+_BZ2_MAGIC_NUMBERS = tuple(
+    (b'BZh%d%s' % (level, block), BZ2) for level in range(1, 10)
+    for block in (b'1AY&SY', b'\x17rE8P\x90'))
+
+MAGIC_NUMBERS = (
+    (b'\x1f\x8b', GZIP),
+    *_BZ2_MAGIC_NUMBERS,
+    (b'\x28\xb5\x2f\xfd', ZSTD),
+    # Frame format (lz4 command line), not the raw block format
+    (b'\x04\x22\x4d\x18', LZ4),
+    (b'\xfd7zXZ\x00', XZ),
+    (b'PK\x03\x04', ZIP),
+)
+MAGIC_SIZE = max(len(magic) for magic, _ in MAGIC_NUMBERS)
+
+EXTENSIONS = {GZIP: 'gz', BZ2: 'bz2', ZSTD: 'zst', LZ4: 'lz4', XZ: 'xz',
+              ZIP: 'zip'}
+MIME_TYPES = {GZIP: 'application/gzip', BZ2: 'application/x-bzip2',
+              ZSTD: 'application/zstd', LZ4: 'application/x-lz4',
+              XZ: 'application/x-xz', ZIP: 'application/zip'}
+
+# Codecs decompressed by pyarrow (CompressedInputStream), without the GIL
+ARROW_CODECS = (GZIP, BZ2, ZSTD, LZ4)
+
+# Blocks decompressed at the same time (BGZF, seekable zstd)
+MAX_WORKERS = 4
+
+BUFFER_SIZE = 1024 * 1024
+
+# BGZF: gzip members with the extra field BC, holding the size of the block
+_BGZF_HEADER_SIZE = 18
+
+# Seekable zstd: skippable frame with the seek table at the end of the file
+_SKIPPABLE_MAGIC = 0x184D2A5E
+_SEEKABLE_MAGIC = 0x8F92EAB1
+_SEEK_TABLE_FOOTER = struct.Struct('<IBI')
+_SKIPPABLE_HEADER = struct.Struct('<II')
+
+
+def detect(header: bytes):
+    """ Codec of a file starting with header, or None if not compressed """
+    for magic, codec in MAGIC_NUMBERS:
+        if header.startswith(magic):
+            return codec
+    return None
+
+
+def detect_file(filesystem, path):
+    """ Codec of the file in path, or None if it is not compressed """
+    with filesystem.open_input_stream(path, compression=None) as stream:
+        return detect(stream.read(MAGIC_SIZE))
+
+
+def strip_extension(filename):
+    """ File name without the extension of a codec (data.csv.gz) """
+    name, _, extension = filename.rpartition('.')
+    if name and extension.lower() in EXTENSIONS.values():
+        return name
+    return filename
+
+
+def with_extension(filename, codec):
+    """ File name with the extension of codec, if it is not there yet """
+    if codec is None or strip_extension(filename) != filename:
+        return filename
+    return f'{filename}.{EXTENSIONS[codec]}'
+
+
+class _ChunkReader(io.RawIOBase):
+    """
+    Raw stream over an iterator of chunks (bytes). Resources (e.g. the
+    compressed file) are closed with it.
+    """
+    def __init__(self, chunks, resources=()):
+        super().__init__()
+        self._chunks = iter(chunks)
+        self._resources = resources
+        self._chunk = memoryview(b'')
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        while not self._chunk:
+            chunk = next(self._chunks, None)
+            if chunk is None:
+                return 0
+            self._chunk = memoryview(chunk)
+        size = min(len(buffer), len(self._chunk))
+        buffer[:size] = self._chunk[:size]
+        self._chunk = self._chunk[size:]
+        return size
+
+    def close(self):
+        if not self.closed:
+            close = getattr(self._chunks, 'close', None)
+            if close is not None:
+                close()
+            for resource in self._resources:
+                resource.close()
+        super().close()
+
+
+def _read_chunks(stream):
+    return iter(lambda: stream.read(BUFFER_SIZE), b'')
+
+
+def _decompress_parallel(blocks, decompress, max_workers):
+    """
+    Decompressed blocks (tuples of arguments of decompress), in order. Up
+    to 2 * max_workers blocks are read ahead and decompressed in parallel.
+    """
+    with futures.ThreadPoolExecutor(max_workers) as executor:
+        pending = collections.deque()
+        for block in blocks:
+            pending.append(executor.submit(decompress, *block))
+            if len(pending) >= 2 * max_workers:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def _is_bgzf(header):
+    # Flag FEXTRA, extra field of 6 bytes with subfield BC of 2 bytes
+    return (len(header) == _BGZF_HEADER_SIZE and
+            header[:4] == b'\x1f\x8b\x08\x04' and
+            header[10:16] == b'\x06\x00BC\x02\x00')
+
+
+def _bgzf_blocks(stream):
+    while True:
+        header = stream.read(_BGZF_HEADER_SIZE)
+        if not header:
+            return
+        if not _is_bgzf(header):
+            raise ValueError(gettext('Invalid BGZF block.'))
+        size = struct.unpack('<H', header[16:])[0] + 1
+        yield (header + stream.read(size - _BGZF_HEADER_SIZE),)
+
+
+def _decompress_gzip_member(block):
+    return zlib.decompress(block, wbits=31)
+
+
+def _zstd_seek_table(f):
+    """
+    Frames (compressed and decompressed sizes) of a seekable zstd file, or
+    None if the file has no seek table
+    """
+    size = f.size()
+    if size < _SKIPPABLE_HEADER.size + _SEEK_TABLE_FOOTER.size:
+        return None
+    f.seek(size - _SEEK_TABLE_FOOTER.size)
+    frames, descriptor, magic = _SEEK_TABLE_FOOTER.unpack(
+        f.read(_SEEK_TABLE_FOOTER.size))
+    if magic != _SEEKABLE_MAGIC:
+        return None
+    # Entries with checksum have 4 bytes more
+    entry_size = 12 if descriptor & 0x80 else 8
+    table_size = frames * entry_size + _SEEK_TABLE_FOOTER.size
+    start = size - table_size - _SKIPPABLE_HEADER.size
+    if start < 0:
+        return None
+    f.seek(start)
+    skippable, frame_size = _SKIPPABLE_HEADER.unpack(
+        f.read(_SKIPPABLE_HEADER.size))
+    if skippable != _SKIPPABLE_MAGIC or frame_size != table_size:
+        return None
+    entries = f.read(frames * entry_size)
+    return [struct.unpack_from('<II', entries, i * entry_size)
+            for i in range(frames)]
+
+
+def _zstd_frames(f, seek_table):
+    f.seek(0)
+    for compressed, decompressed in seek_table:
+        yield f.read(compressed), decompressed
+
+
+def _decompress_zstd_frame(frame, size):
+    return pa.decompress(frame, decompressed_size=size, codec=ZSTD,
+                         asbytes=True)
+
+
+def _open_zip(filesystem, path):
+    f = filesystem.open_input_file(path)
+    try:
+        archive = zipfile.ZipFile(f)
+        names = [info.filename for info in archive.infolist()
+                 if not info.is_dir() and
+                 not info.filename.startswith('__MACOSX/')]
+        if not names:
+            raise ValueError(gettext('Zip file is empty.'))
+        # Only the first file is read (data sources have a single file)
+        member = archive.open(names[0])
+    except BaseException:
+        f.close()
+        raise
+    return _ChunkReader(_read_chunks(member), (member, archive, f))
+
+
+def open_input(filesystem, path, max_workers=MAX_WORKERS):
+    """
+    Buffered binary stream (with read and readline) with the content of the
+    file in path, decompressed if its codec is detected. BGZF and seekable
+    zstd files are decompressed by up to max_workers threads.
+    """
+    codec = detect_file(filesystem, path)
+    if codec == ZIP:
+        return io.BufferedReader(_open_zip(filesystem, path), BUFFER_SIZE)
+
+    if codec in (GZIP, ZSTD) and max_workers > 1:
+        f = filesystem.open_input_file(path)
+        try:
+            if codec == GZIP and _is_bgzf(f.read(_BGZF_HEADER_SIZE)):
+                f.seek(0)
+                chunks = _decompress_parallel(
+                    _bgzf_blocks(f), _decompress_gzip_member, max_workers)
+                return io.BufferedReader(_ChunkReader(chunks, (f,)),
+                                         BUFFER_SIZE)
+            seek_table = _zstd_seek_table(f) if codec == ZSTD else None
+            if seek_table is not None:
+                chunks = _decompress_parallel(
+                    _zstd_frames(f, seek_table), _decompress_zstd_frame,
+                    max_workers)
+                return io.BufferedReader(_ChunkReader(chunks, (f,)),
+                                         BUFFER_SIZE)
+        except BaseException:
+            f.close()
+            raise
+        f.close()
+
+    stream = filesystem.open_input_stream(path, compression=None)
+    if codec in ARROW_CODECS:
+        stream = pa.CompressedInputStream(stream, codec)
+    elif codec == XZ:
+        xz_file = lzma.LZMAFile(stream)
+        return io.BufferedReader(
+            _ChunkReader(_read_chunks(xz_file), (xz_file, stream)),
+            BUFFER_SIZE)
+    return io.BufferedReader(stream, BUFFER_SIZE)
@@ -0,0 +1,411 @@
+# -*- coding: utf-8 -*-
+"""
+Conversion of file data sources between formats. Sources (CSV, JSON lines
+and Parquet) are read in batches, using the types of the data source
+attributes, and written as Parquet (row groups of about row_group_bytes),
+CSV or Arrow (Feather v2) files, so memory used does not depend on the size
+of the data source. Compressed sources are decompressed while read (see
+util.compression). When the data source is a directory (e.g. written by
+Spark), its files are converted in parallel, each one into a part of the
+target directory.
+
+Uploaded CSV files may also be converted to Parquet on ingest (see
+csv_to_parquet()), so samples, downloads with projection and Spark jobs do
+not parse text again.
+"""
+import logging
+import os
+import threading
+import uuid
+from concurrent import futures
+from urllib.parse import urlparse
+
+import pyarrow as pa
+import pyarrow.csv as pa_csv
+import pyarrow.parquet as pq
+from flask import current_app, has_app_context
+from flask_babel import gettext
+from pyarrow import fs
+
+import limonero.hdfs_util as hu
+from limonero.models import (Attribute, DataSource, DataSourceFormat,
+                             DataSourcePermission, db)
+from limonero.util import SPECIAL_DELIMITERS, compression
+from limonero.util.execution import (ExecutionCancelled, bind_current,
+                                     check_cancelled, set_progress)
+
+log = logging.getLogger(__name__)
+
+# Target: (format of the new data source, file extension)
+TARGETS = {
+    'parquet': (DataSourceFormat.PARQUET, 'parquet'),
+    'csv': (DataSourceFormat.CSV, 'csv'),
+    'arrow': (DataSourceFormat.ARROW, 'arrow'),
+}
+SOURCE_FORMATS = (DataSourceFormat.CSV, DataSourceFormat.JSON,
+                  DataSourceFormat.PARQUET)
+
+COMPRESSIONS = {
+    'parquet': ('snappy', 'gzip', 'zstd', 'brotli', 'lz4', 'none'),
+    'csv': ('none',),
+    'arrow': ('lz4', 'zstd', 'none'),
+}
+DEFAULT_COMPRESSIONS = {'parquet': 'snappy', 'csv': 'none', 'arrow': 'lz4'}
+
+# Size (bytes, in memory) of row groups, overridden by config
+# (conversion.row_group_bytes). Similar to the HDFS block size, so each row
+# group is read by a single task.
+DEFAULT_ROW_GROUP_BYTES = 128 * 1024 ** 2
+
+# Files of a directory converted at the same time, overridden by config
+# (conversion.max_workers). Each one may keep a row group in memory.
+DEFAULT_MAX_WORKERS = 4
+
+# Size (bytes) of blocks read from CSV and JSON files
+READ_BLOCK_SIZE = 16 * 1024 ** 2
+
+# Rows read at once from Parquet files
+READ_BATCH_SIZE = 65536
+
+CONVERSION_DIR = 'limonero/data'
+PARQUET_PART = 'part-00000.parquet'
+
+
+def _get_config():
+    if has_app_context():
+        config = current_app.config.get('LIMONERO_CONFIG') or {}
+        return config.get('conversion') or {}
+    return {}
+
+
+def get_row_group_bytes():
+    return _get_config().get('row_group_bytes', DEFAULT_ROW_GROUP_BYTES)
+
+
+def get_max_workers():
+    return _get_config().get('max_workers', DEFAULT_MAX_WORKERS)
+
+
+def validate(data_source, target, compression=None):
+    """ Raises ValueError if data_source cannot be converted to target """
+    if target not in TARGETS:
+        raise ValueError(gettext('Unsupported format: %(format)s',
+                                 format=target))
+    if data_source.format not in SOURCE_FORMATS:
+        raise ValueError(gettext(
+            'Format %(format)s cannot be converted.',
+            format=data_source.format))
+    if urlparse(data_source.url or '').scheme not in ('file', 'hdfs'):
+        raise ValueError(gettext(
+            'Only data sources stored in HDFS or local files can be '
+            'converted.'))
+    if (data_source.format != DataSourceFormat.PARQUET and
+            not data_source.attributes):
+        raise ValueError(gettext(
+            'Data source has no attributes, infer its schema first.'))
+    if compression is not None and compression not in COMPRESSIONS[target]:
+        raise ValueError(gettext(
+            'Unsupported compression for %(format)s: %(compression)s',
+            format=target, compression=compression))
+
+
+def list_files(filesystem, path):
+    """
+    Files (path, size) of the data source. Hidden files in directories
+    (e.g. _SUCCESS, .crc) are ignored.
+    """
+    info = filesystem.get_file_info(path)
+    if info.type == fs.FileType.File:
+        return [(info.path, info.size)]
+    elif info.type == fs.FileType.Directory:
+        selector = fs.FileSelector(path, recursive=True)
+        return sorted((f.path, f.size)
+                      for f in filesystem.get_file_info(selector)
+                      if f.type == fs.FileType.File and
+                      not f.base_name.startswith(('_', '.')))
+    raise ValueError(gettext('File %(path)s not found.', path=path))
+
+
+def _csv_options(data_source, schema):
+    delimiter = data_source.attribute_delimiter or ','
+    missing = [v for v in (data_source.treat_as_missing or '').split(',')
+               if v]
+    read_options = pa_csv.ReadOptions(
+        column_names=schema.names,
+        skip_rows=1 if data_source.is_first_line_header else 0,
+        encoding=data_source.encoding or 'utf8',
+        block_size=READ_BLOCK_SIZE)
+    parse_options = pa_csv.ParseOptions(
+        delimiter=SPECIAL_DELIMITERS.get(delimiter, delimiter),
+        quote_char=data_source.text_delimiter or '"',
+        newlines_in_values=bool(data_source.is_multiline))
+    convert_options = pa_csv.ConvertOptions(
+        column_types=schema,
+        null_values=[''] + missing,
+        strings_can_be_null=True)
+    return read_options, parse_options, convert_options
+
+
+def _read_csv(data_source, filesystem, path, schema):
+    read_options, parse_options, convert_options = _csv_options(
+        data_source, schema)
+    with compression.open_input(filesystem, path) as stream, \
+            pa_csv.open_csv(stream, read_options=read_options,
+                            parse_options=parse_options,
+                            convert_options=convert_options) as reader:
+        yield from reader
+
+
+def _read_json(filesystem, path, schema):
+    """ JSON lines, parsed in blocks of READ_BLOCK_SIZE (whole lines) """
+    for table in hu.read_json_blocks(filesystem, path, schema,
+                                     READ_BLOCK_SIZE):
+        yield from table.to_batches()
+
+
+def _read_parquet(filesystem, path):
+    with filesystem.open_input_file(path) as f:
+        yield from pq.ParquetFile(f).iter_batches(batch_size=READ_BATCH_SIZE)
+
+
+def _get_schema(data_source, filesystem, path):
+    if data_source.format == DataSourceFormat.PARQUET:
+        return pq.read_schema(path, filesystem=filesystem)
+    return hu.get_parquet_schema(data_source)
+
+
+def read_batches(data_source, filesystem, path, schema):
+    """ Batches of a file of the data source, with the given schema """
+    if data_source.format == DataSourceFormat.CSV:
+        return _read_csv(data_source, filesystem, path, schema)
+    elif data_source.format == DataSourceFormat.JSON:
+        return _read_json(filesystem, path, schema)
+    elif data_source.format == DataSourceFormat.PARQUET:
+        return _read_parquet(filesystem, path)
+    raise ValueError(gettext('Format %(format)s cannot be converted.',
+                             format=data_source.format))
+
+
+def _open_writer(target, sink, schema, compression):
+    compression = compression or DEFAULT_COMPRESSIONS[target]
+    if target == 'parquet':
+        return pq.ParquetWriter(sink, schema, compression=compression)
+    elif target == 'csv':
+        return pa_csv.CSVWriter(sink, schema)
+    elif target == 'arrow':
+        return pa.ipc.new_file(sink, schema, options=pa.ipc.IpcWriteOptions(
+            compression=None if compression == 'none' else compression))
+    raise ValueError(gettext('Unsupported format: %(format)s',
+                             format=target))
+
+
+def write_batches(batches, filesystem, path, target, schema,
+                  compression=None, row_group_bytes=None):
+    """
+    Writes batches to the file in path. Batches are grouped until
+    row_group_bytes (Parquet row groups). Returns the number of rows.
+    """
+    if row_group_bytes is None:
+        row_group_bytes = get_row_group_bytes()
+    if target != 'parquet':
+        # Batches are written as they are read
+        row_group_bytes = 0
+
+    rows = 0
+    with filesystem.open_output_stream(path, compression=None) as sink:
+        writer = _open_writer(target, sink, schema, compression)
+        try:
+            pending = []
+            pending_bytes = 0
+            for batch in batches:
+                check_cancelled()
+                pending.append(batch)
+                pending_bytes += batch.nbytes
+                if pending_bytes >= row_group_bytes:
+                    table = pa.Table.from_batches(pending, schema)
+                    writer.write_table(table, table.num_rows)
+                    rows += table.num_rows
+                    pending = []
+                    pending_bytes = 0
+            if pending:
+                table = pa.Table.from_batches(pending, schema)
+                writer.write_table(table, table.num_rows)
+                rows += table.num_rows
+        finally:
+            writer.close()
+    return rows
+
+
+def _delete(filesystem, path):
+    try:
+        if filesystem.get_file_info(path).type == fs.FileType.Directory:
+            filesystem.delete_dir(path)
+        else:
+            filesystem.delete_file(path)
+    except (FileNotFoundError, OSError):
+        log.warning(gettext('Could not remove %s'), path, exc_info=True)
+
+
+def convert(data_source, filesystem, target_filesystem, target_path, target,
+            compression=None, row_group_bytes=None, max_workers=None):
+    """
+    Converts the files of data_source to target, in target_path. If the
+    target is Parquet, or there are many files, target_path is a directory
+    with a part for each file, converted in parallel (max_workers).
+    Progress is reported to the current execution (see util.execution).
+    Returns the number of rows converted.
+    """
+    source_path = urlparse(data_source.url).path
+    files = list_files(filesystem, source_path)
+    extension = TARGETS[target][1]
+    if target == 'parquet' or len(files) > 1:
+        target_filesystem.create_dir(target_path)
+        outputs = [f'{target_path}/part-{i:05}.{extension}'
+                   for i in range(len(files))]
+    else:
+        target_filesystem.create_dir(target_path.rsplit('/', 1)[0])
+        outputs = [target_path]
+
+    total_bytes = sum(size for _, size in files)
+    state = {'files_done': 0, 'bytes_done': 0, 'rows': 0}
+    lock = threading.Lock()
+    failed = threading.Event()
+    set_progress(files=len(files), bytes=total_bytes, percent=0, **state)
+
+    def guard(batches):
+        for batch in batches:
+            if failed.is_set():
+                raise ExecutionCancelled(gettext(
+                    'Execution was cancelled.'))
+            yield batch
+
+    def run(i):
+        path, size = files[i]
+        schema = _get_schema(data_source, filesystem, path)
+        rows = write_batches(
+            guard(read_batches(data_source, filesystem, path, schema)),
+            target_filesystem, outputs[i], target, schema, compression,
+            row_group_bytes)
+        with lock:
+            state['files_done'] += 1
+            state['bytes_done'] += size
+            state['rows'] += rows
+            set_progress(percent=round(
+                100.0 * state['bytes_done'] / (total_bytes or 1), 1), **state)
+        return rows
+
+    run = bind_current(run)
+
+    def run_or_stop(i):
+        try:
+            return run(i)
+        except BaseException:
+            failed.set()
+            raise
+
+    workers = max(1, min(max_workers or get_max_workers(), len(files)))
+    try:
+        with futures.ThreadPoolExecutor(
+                workers, thread_name_prefix='limonero-conversion') as pool:
+            return sum(pool.map(run_or_stop, range(len(files))))
+    except BaseException:
+        _delete(target_filesystem, target_path)
+        raise
+
+
+def _copy_attributes(source, target):
+    columns = [c.key for c in Attribute.__table__.columns
+               if c.key not in ('id', 'data_source_id')]
+    for attr in source.attributes:
+        copy = Attribute(**{c: getattr(attr, c) for c in columns})
+        copy.data_source = target
+
+
+def _copy_permissions(source, target):
+    for permission in source.permissions:
+        DataSourcePermission(
+            permission=permission.permission, user_id=permission.user_id,
+            user_login=permission.user_login,
+            user_name=permission.user_name, data_source=target)
+
+
+def convert_data_source(data_source, target, storage, user,
+                        compression=None, name=None):
+    """
+    Converts data_source to target, stored in storage (HDFS or local), and
+    registers the result as a new data source, with the same attributes and
+    permissions. Returns the new data source.
+    """
+    validate(data_source, target, compression)
+    target_format, extension = TARGETS[target]
+    parsed = urlparse(data_source.url)
+    filesystem = hu.get_filesystem(parsed, data_source.storage.extra_params)
+
+    storage_parsed = urlparse(storage.url.rstrip('/'))
+    target_filesystem = hu.get_filesystem(storage_parsed, storage.extra_params)
+    base_name = os.path.splitext(os.path.basename(parsed.path))[0]
+    file_name = f'{uuid.uuid4().hex}_{base_name}.{extension}'
+    target_path = '{}/{}/{}'.format(storage_parsed.path.rstrip('/'),
+                                    CONVERSION_DIR, file_name)
+
+    rows = convert(data_source, filesystem, target_filesystem, target_path,
+                   target, compression)
+    if storage_parsed.scheme == 'file':
+        url = f'file://{target_path}'
+    else:
+        url = '{}/{}/{}'.format(storage.url.rstrip('/'), CONVERSION_DIR,
+                                file_name)
+
+    converted = DataSource(
+        name=name or '{} ({})'.format(data_source.name, target),
+        description=gettext('Converted from %(name)s',
+                            name=data_source.name),
+        format=target_format, url=url, storage_id=storage.id, enabled=True,
+        estimated_rows=rows, tags=data_source.tags,
+        is_public=data_source.is_public,
+        privacy_aware=data_source.privacy_aware,
+        user_id=user.id, user_login=user.login,
+        user_name='{} {}'.format(user.first_name, user.last_name).strip())
+    if target == 'csv':
+        converted.attribute_delimiter = ','
+        converted.text_delimiter = '"'
+        converted.is_first_line_header = True
+        converted.encoding = 'utf8'
+    _copy_attributes(data_source, converted)
+    _copy_permissions(data_source, converted)
+    db.session.add(converted)
+    try:
+        db.session.commit()
+    except BaseException:
+        db.session.rollback()
+        _delete(target_filesystem, target_path)
+        raise
+    return converted
+
+
+def csv_to_parquet(data_source, filesystem, source_path, target_path,
+                   row_group_bytes=None):
+    """
+    Converts the uploaded CSV file in source_path, described by data_source
+    (its attributes, delimiters, header), to a Parquet dataset in
+    target_path. Returns the number of rows converted. Fails (and removes
+    target_path) if a value does not match the type of its attribute.
+    """
+    if data_source.format != DataSourceFormat.CSV:
+        raise ValueError(gettext(
+            'Format %(format)s cannot be converted to Parquet.',
+            format=data_source.format))
+    if not data_source.attributes:
+        raise ValueError(gettext(
+            'Data source has no attributes, infer its schema first.'))
+
+    schema = hu.get_parquet_schema(data_source)
+    filesystem.create_dir(target_path)
+    try:
+        return write_batches(
+            _read_csv(data_source, filesystem, source_path, schema),
+            filesystem, f'{target_path}/{PARQUET_PART}', 'parquet', schema,
+            row_group_bytes=row_group_bytes)
+    except BaseException:
+        _delete(filesystem, target_path)
+        raise
@@ -0,0 +1,571 @@
+# -*- coding: utf-8 -*-
+"""
+Database engines supported by JDBC data sources and storages. Each dialect
+maps the engine types to Limonero types and implements schema inference,
+sampling and streaming of results as Arrow record batches, using the fastest
+path available in the engine (e.g. COPY in PostgreSQL).
+
+New engines are supported by registering a Dialect subclass for the URL
+schemes they use (see register_dialect).
+
+The PostgreSQL driver (psycopg2) is optional and installed separately.
+"""
+import logging
+import os
+import re
+import sqlite3
+import threading
+from contextlib import closing
+
+import pyarrow as pa
+import pyarrow.csv as pa_csv
+import pymysql
+from flask import current_app, has_app_context
+from flask_babel import gettext
+
+try:
+    import psycopg2
+except ImportError:  # pragma: no cover
+    psycopg2 = None
+
+from limonero.models import CatalogTableType, DataType
+from limonero.util.jdbc import (_parse_query_string, get_mysql_data_type,
+                                get_mysql_pool, make_attribute,
+                                parse_type_name)
+from limonero.util.pool import get_pool
+
+log = logging.getLogger(__name__)
+
+CONFIG_KEY = 'LIMONERO_CONFIG'
+
+# Rows fetched from database at once (one record batch)
+BATCH_SIZE = 10000
+
+# Rows used to infer types when the engine does not inform them (SQLite)
+INFER_ROWS = 100
+
+_FIX_LIMIT = re.compile(r'\sLIMIT\s+(\d+)')
+
+_dialects = {}
+
+
+def register_dialect(*schemes):
+    """ Class decorator registering a dialect for URL schemes """
+
+    def decorator(cls):
+        for scheme in schemes:
+            _dialects[scheme] = cls
+        return cls
+
+    return decorator
+
+
+def get_dialect(parsed):
+    """ Dialect for a (parsed) database URL """
+    cls = _dialects.get(parsed.scheme)
+    if cls is None:
+        raise ValueError(gettext('Unsupported database: %(what)s',
+                                 what=parsed.scheme))
+    return cls(parsed)
+
+
+def get_supported_schemes():
+    return sorted(_dialects.keys())
+
+
+class Dialect:
+    """
+    Generic implementation, based on DB-API cursors. Subclasses must
+    implement the connection pool and metadata queries.
+    """
+    # Declared type (lower case, without parameters) -> Limonero type
+    types = {}
+
+    def __init__(self, parsed):
+        self.parsed = parsed
+
+    def get_pool(self):
+        raise NotImplementedError()
+
+    def data_type(self, type_name):
+        base = parse_type_name(type_name)[0].lower()
+        return self.types.get(base, DataType.CHARACTER)
+
+    def arrow_column(self, description):
+        """
+        Arrow type and value converter for a column of a result, given its
+        cursor description. Type None means inferred from data.
+        """
+        return None, None
+
+    def table_schema(self, cn, database, table):
+        """ Attributes of a table, read from metadata ([] if not found) """
+        raise NotImplementedError()
+
+    def query_schema(self, cn, cmd):
+        """ Attributes of the result of a command """
+        raise NotImplementedError()
+
+    def crawl(self, cn, name=None):
+        """
+        Tables and views of the database, as {name: (type, columns)},
+        where columns is a list of {'name', 'type'}.
+        """
+        raise NotImplementedError()
+
+    def limit(self, cmd, limit):
+        return '{} LIMIT {}'.format(_FIX_LIMIT.sub('', cmd), int(limit))
+
+    def sample(self, cmd, limit):
+        """ First rows of the result, as dicts """
+        with self.get_pool().connection() as cn:
+            with closing(cn.cursor()) as cursor:
+                cursor.execute(self.limit(cmd, limit))
+                names = [d[0] for d in cursor.description]
+                return [dict(zip(names, row)) for row in cursor.fetchall()]
+
+    def _open_cursor(self, cn):
+        return cn.cursor()
+
+    def batches(self, cmd, batch_size=BATCH_SIZE):
+        """
+        Generator of schema and record batches of the result (see
+        export.database_batches()).
+        """
+        # Module export depends on dialects
+        from limonero.util.export import RecordBatchReader
+        with self.get_pool().connection() as cn:
+            cursor = self._open_cursor(cn)
+            cursor.execute(cmd)
+            reader = RecordBatchReader(cursor, self.arrow_column,
+                                       batch_size=batch_size)
+            batches = iter(reader)
+            # Types inferred from data are only known after first batch
+            first = next(batches, None)
+            yield reader.schema
+            if first is not None:
+                yield first
+                yield from batches
+            cursor.close()
+
+
+class InformationSchemaDialect(Dialect):
+    """ Engines describing tables in information_schema (SQL standard) """
+    # Expression returning the default schema
+    current_schema = None
+    # Column (in information_schema.columns) with the declared type
+    column_type_field = 'data_type'
+
+    def table_schema(self, cn, database, table):
+        with closing(cn.cursor()) as cursor:
+            cursor.execute(
+                'SELECT column_name, data_type, character_maximum_length, '
+                'numeric_precision, numeric_scale, is_nullable '
+                'FROM information_schema.columns '
+                'WHERE table_schema = COALESCE(%s, {}) AND table_name = %s '
+                'ORDER BY ordinal_position'.format(self.current_schema),
+                (database, table))
+            return [make_attribute(name, self.data_type(data_type), size,
+                                   precision, scale, nullable == 'YES')
+                    for (name, data_type, size, precision, scale, nullable)
+                    in cursor.fetchall()]
+
+    def _describe_column(self, description):
+        raise NotImplementedError()
+
+    def query_schema(self, cn, cmd):
+        with closing(cn.cursor()) as cursor:
+            # Only metadata is returned. Inner LIMIT clauses are kept
+            cursor.execute(
+                'SELECT * FROM ({}) AS limonero_schema LIMIT 0'.format(cmd))
+            return [self._describe_column(d) for d in cursor.description]
+
+    def crawl(self, cn, name=None):
+        tables_cmd = ('SELECT table_name, table_type FROM '
+                      'information_schema.tables WHERE table_schema = {}'
+                      ).format(self.current_schema)
+        columns_cmd = ('SELECT table_name, column_name, {} FROM '
+                       'information_schema.columns WHERE table_schema = {}'
+                       ).format(self.column_type_field, self.current_schema)
+        params = ()
+        if name is not None:
+            tables_cmd += ' AND table_name = %s'
+            columns_cmd += ' AND table_name = %s'
+            params = (name,)
+        columns_cmd += ' ORDER BY table_name, ordinal_position'
+
+        with closing(cn.cursor()) as cursor:
+            cursor.execute(tables_cmd, params)
+            result = {
+                table: (CatalogTableType.VIEW if table_type == 'VIEW'
+                        else CatalogTableType.TABLE, [])
+                for table, table_type in cursor.fetchall()}
+            cursor.execute(columns_cmd, params)
+            for table, column, column_type in cursor.fetchall():
+                if table in result:
+                    result[table][1].append({'name': column,
+                                             'type': column_type})
+        return result
+
+
+_MYSQL_INTEGER_TYPES = ('TINY', 'SHORT', 'INT24', 'LONG', 'LONGLONG', 'YEAR')
+
+
+@register_dialect('mysql')
+class MySQLDialect(InformationSchemaDialect):
+    current_schema = 'DATABASE()'
+    column_type_field = 'column_type'
+    types = {
+        'tinyint': DataType.INTEGER,
+        'smallint': DataType.INTEGER,
+        'mediumint': DataType.INTEGER,
+        'year': DataType.INTEGER,
+        'bit': DataType.INTEGER,
+        'int': DataType.LONG,
+        'integer': DataType.LONG,
+        'bigint': DataType.LONG,
+        'decimal': DataType.DECIMAL,
+        'numeric': DataType.DECIMAL,
+        'float': DataType.FLOAT,
+        'double': DataType.DOUBLE,
+        'real': DataType.DOUBLE,
+        'date': DataType.DATE,
+        'time': DataType.TIME,
+        'datetime': DataType.DATETIME,
+        'timestamp': DataType.TIMESTAMP,
+    }
+
+    @staticmethod
+    def _field_types():
+        from pymysql.constants import FIELD_TYPE
+        return {getattr(FIELD_TYPE, k): k for k in dir(FIELD_TYPE)
+                if not k.startswith('_')}
+
+    def get_pool(self):
+        return get_mysql_pool(self.parsed)
+
+    def _describe_column(self, description):
+        d = self._field_types()
+        (name, dtype, size, to_ignore, precision, scale,
+         nullable) = description
+        if d[dtype] == 'BLOB':
+            precision = None
+        return make_attribute(name, get_mysql_data_type(d, dtype), size,
+                              precision, scale, nullable)
+
+    def query_schema(self, cn, cmd):
+        try:
+            return super().query_schema(cn, cmd)
+        except pymysql.MySQLError:
+            # E.g. duplicated column names are not allowed in derived tables
+            with closing(cn.cursor()) as cursor:
+                cursor.execute('{} LIMIT 0'.format(cmd))
+                return [self._describe_column(d) for d in cursor.description]
+
+    def arrow_column(self, description):
+        name = self._field_types().get(description[1])
+        scale = description[5]
+        if name in _MYSQL_INTEGER_TYPES:
+            return pa.int64(), None
+        elif name in ('FLOAT', 'DOUBLE'):
+            return pa.float64(), None
+        elif name in ('DECIMAL', 'NEWDECIMAL') and (scale or 0) <= 38:
+            return pa.decimal128(38, scale or 0), None
+        elif name in ('DATE', 'NEWDATE'):
+            return pa.date32(), None
+        elif name in ('DATETIME', 'TIMESTAMP'):
+            return pa.timestamp('us'), None
+        elif name == 'TIME':
+            # May be negative or greater than 24h, so it is kept as text
+            return pa.string(), str
+        # Text or binary, depending on charset (not informed in description)
+        return None, None
+
+    def sample(self, cmd, limit):
+        with self.get_pool().connection() as cn:
+            with cn.cursor(pymysql.cursors.DictCursor) as cursor:
+                cursor.execute(self.limit(cmd, limit))
+                return cursor.fetchall()
+
+    def _open_cursor(self, cn):
+        # Unbuffered: rows are read from server as they are fetched.
+        # Closing it reads all pending rows, so it is closed only if the
+        # result is exhausted (otherwise the pool discards the connection).
+        return cn.cursor(pymysql.cursors.SSCursor)
+
+
+# PostgreSQL type OID -> (Limonero type, Arrow type used by COPY)
+_POSTGRESQL_OIDS = {
+    16: (DataType.INTEGER, pa.bool_()),
+    20: (DataType.LONG, pa.int64()),
+    21: (DataType.INTEGER, pa.int64()),
+    23: (DataType.INTEGER, pa.int64()),
+    700: (DataType.FLOAT, pa.float64()),
+    701: (DataType.DOUBLE, pa.float64()),
+    1700: (DataType.DECIMAL, None),
+    1082: (DataType.DATE, pa.date32()),
+    1083: (DataType.TIME, pa.string()),
+    1114: (DataType.DATETIME, pa.timestamp('us')),
+    # Kept as text, with time zone offset
+    1184: (DataType.TIMESTAMP, pa.string()),
+    17: (DataType.BINARY, pa.string()),
+}
+
+# Bytes read at once from COPY output (one record batch)
+COPY_BLOCK_SIZE = 1 << 20
+
+
+@register_dialect('postgresql', 'postgres')
+class PostgreSQLDialect(InformationSchemaDialect):
+    current_schema = 'current_schema()'
+    types = {
+        'boolean': DataType.INTEGER,
+        'smallint': DataType.INTEGER,
+        'integer': DataType.INTEGER,
+        'bigint': DataType.LONG,
+        'numeric': DataType.DECIMAL,
+        'decimal': DataType.DECIMAL,
+        'real': DataType.FLOAT,
+        'double precision': DataType.DOUBLE,
+        'date': DataType.DATE,
+        'time without time zone': DataType.TIME,
+        'time with time zone': DataType.TIME,
+        'timestamp without time zone': DataType.DATETIME,
+        'timestamp with time zone': DataType.TIMESTAMP,
+        'bytea': DataType.BINARY,
+    }
+
+    def data_type(self, type_name):
+        # Names have spaces (e.g. double precision)
+        return self.types.get((type_name or '').lower(), DataType.CHARACTER)
+
+    def get_pool(self):
+        if psycopg2 is None:
+            raise ValueError(gettext(
+                'Driver for %(what)s is not installed.', what='PostgreSQL'))
+        qs = _parse_query_string(self.parsed)
+        host = self.parsed.hostname
+        port = int(self.parsed.port or 5432)
+        user = self.parsed.username or qs.get('user')
+        password = self.parsed.password or qs.get('password')
+        database = self.parsed.path[1:]
+
+        def factory():
+            # Text output of dates and times as expected by Arrow
+            return psycopg2.connect(host=host, port=port, user=user,
+                                    password=password, dbname=database,
+                                    options='-c DateStyle=ISO,YMD')
+
+        def ping(cn):
+            with closing(cn.cursor()) as cursor:
+                cursor.execute('SELECT 1')
+
+        key = ('postgresql', host, port, user, password, database)
+        return get_pool(key, f'postgresql://{user}@{host}:{port}/{database}',
+                        factory, pre_ping=ping,
+                        reset=lambda cn: cn.rollback())
+
+    def _describe_column(self, description):
+        name, oid, _, size, precision, scale, nullable = description[:7]
+        data_type = _POSTGRESQL_OIDS.get(oid, (DataType.CHARACTER,))[0]
+        return make_attribute(name, data_type, size, precision, scale,
+                              nullable)
+
+    def arrow_column(self, description):
+        oid, precision, scale = description[1], description[4], description[5]
+        if oid == 1700:
+            if precision and precision <= 38:
+                return pa.decimal128(precision, scale or 0), None
+            # Unbounded precision, kept as text
+            return pa.string(), str
+        return _POSTGRESQL_OIDS.get(oid, (None, pa.string()))[1], None
+
+    def batches(self, cmd, batch_size=BATCH_SIZE):
+        """
+        Result is read with COPY ... TO STDOUT (CSV) and parsed by Arrow,
+        in blocks of COPY_BLOCK_SIZE bytes, without creating Python objects
+        for the values. Types come from the description of the command.
+        """
+        with self.get_pool().connection() as cn:
+            with closing(cn.cursor()) as cursor:
+                cursor.execute(
+                    'SELECT * FROM ({}) AS limonero_schema LIMIT 0'.format(
+                        cmd))
+                description = cursor.description
+            schema = pa.schema([(d[0], self.arrow_column(d)[0])
+                                for d in description])
+            yield schema
+
+            read_fd, write_fd = os.pipe()
+            errors = []
+
+            def copy():
+                try:
+                    with os.fdopen(write_fd, 'wb') as output, \
+                            closing(cn.cursor()) as copy_cursor:
+                        copy_cursor.copy_expert(
+                            'COPY ({}) TO STDOUT WITH (FORMAT csv)'.format(
+                                cmd), output)
+                except Exception as e:
+                    errors.append(e)
+
+            thread = threading.Thread(target=copy, daemon=True)
+            thread.start()
+            source = os.fdopen(read_fd, 'rb')
+            try:
+                yield from self._read_copy(source, schema)
+            except pa.ArrowInvalid as e:
+                # Output is incomplete if COPY failed
+                source.close()
+                thread.join()
+                if errors:
+                    raise errors[0] from e
+                raise
+            finally:
+                # Writer stops (broken pipe) if reading was interrupted
+                source.close()
+                thread.join()
+            if errors:
+                raise errors[0]
+
+    @staticmethod
+    def _read_copy(source, schema):
+        if not source.peek(1):
+            return
+        reader = pa_csv.open_csv(
+            source,
+            read_options=pa_csv.ReadOptions(column_names=schema.names,
+                                            block_size=COPY_BLOCK_SIZE),
+            parse_options=pa_csv.ParseOptions(newlines_in_values=True),
+            # NULL is written as an empty field, empty strings are quoted
+            convert_options=pa_csv.ConvertOptions(
+                column_types=schema, null_values=[''],
+                strings_can_be_null=True, quoted_strings_can_be_null=False,
+                true_values=['t'], false_values=['f']))
+        for batch in reader:
+            yield batch
+
+
+@register_dialect('sqlite')
+class SQLiteDialect(Dialect):
+    """
+    SQLite database files (sqlite:///path/to/file.db), opened read-only.
+    Declared types are only hints in SQLite, so the types of query results
+    are inferred from data. Files must be under the directory configured in
+    sqlite_root; without it, SQLite is disabled, otherwise any file readable
+    by the server could be opened.
+    """
+    types = {
+        'boolean': DataType.INTEGER,
+        'date': DataType.DATE,
+        'datetime': DataType.DATETIME,
+        'timestamp': DataType.TIMESTAMP,
+        'time': DataType.TIME,
+        'decimal': DataType.DECIMAL,
+        'numeric': DataType.DECIMAL,
+    }
+
+    def _allowed_path(self):
+        root = None
+        if has_app_context():
+            root = (current_app.config.get(CONFIG_KEY) or {}).get(
+                'sqlite_root')
+        if not root:
+            raise ValueError(gettext('Unsupported database: %(what)s',
+                                     what=self.parsed.scheme))
+        root = os.path.realpath(root)
+        path = os.path.realpath(self.parsed.path)
+        if os.path.commonpath([root, path]) != root:
+            raise ValueError(gettext('Database file is not allowed: %(path)s',
+                                     path=self.parsed.path))
+        return path
+
+    def get_pool(self):
+        path = self._allowed_path()
+
+        def factory():
+            return sqlite3.connect(f'file:{path}?mode=ro', uri=True,
+                                   check_same_thread=False)
+
+        return get_pool(('sqlite', path), f'sqlite://{path}', factory,
+                        reset=lambda cn: cn.rollback())
+
+    def data_type(self, type_name):
+        # Type affinity rules (https://sqlite.org/datatype3.html)
+        base = parse_type_name(type_name)[0].lower()
+        if base in self.types:
+            return self.types[base]
+        elif 'int' in base:
+            return DataType.LONG
+        elif any(t in base for t in ('char', 'clob', 'text')):
+            return DataType.CHARACTER
+        elif 'blob' in base:
+            return DataType.BINARY
+        elif any(t in base for t in ('real', 'floa', 'doub')):
+            return DataType.DOUBLE
+        return DataType.CHARACTER
+
+    @staticmethod
+    def _quote(identifier):
+        return '"{}"'.format(identifier.replace('"', '""'))
+
+    def _table_info(self, cursor, database, table):
+        prefix = self._quote(database) + '.' if database else ''
+        cursor.execute('PRAGMA {}table_info({})'.format(
+            prefix, self._quote(table)))
+        return cursor.fetchall()
+
+    def table_schema(self, cn, database, table):
+        with closing(cn.cursor()) as cursor:
+            result = []
+            for _, name, type_name, not_null, _, _ in self._table_info(
+                    cursor, database, table):
+                _, first, second = parse_type_name(type_name)
+                data_type = self.data_type(type_name)
+                if data_type == DataType.DECIMAL:
+                    result.append(make_attribute(name, data_type,
+                                                 precision=first,
+                                                 scale=second,
+                                                 nullable=not not_null))
+                else:
+                    result.append(make_attribute(name, data_type, size=first,
+                                                 nullable=not not_null))
+            return result
+
+    def query_schema(self, cn, cmd):
+        with closing(cn.cursor()) as cursor:
+            cursor.execute('SELECT * FROM ({}) LIMIT {}'.format(
+                cmd, INFER_ROWS))
+            names = [d[0] for d in cursor.description]
+            rows = cursor.fetchall()
+        result = []
+        for i, name in enumerate(names):
+            value = next((row[i] for row in rows if row[i] is not None),
+                         None)
+            if isinstance(value, int):
+                data_type = DataType.LONG
+            elif isinstance(value, float):
+                data_type = DataType.DOUBLE
+            elif isinstance(value, bytes):
+                data_type = DataType.BINARY
+            else:
+                data_type = DataType.CHARACTER
+            result.append(make_attribute(name, data_type, nullable=True))
+        return result
+
+    def crawl(self, cn, name=None):
+        cmd = ("SELECT name, type FROM sqlite_master WHERE type IN "
+               "('table', 'view') AND name NOT LIKE 'sqlite_%'")
+        params = ()
+        if name is not None:
+            cmd += ' AND name = ?'
+            params = (name,)
+        with closing(cn.cursor()) as cursor:
+            cursor.execute(cmd, params)
+            tables = cursor.fetchall()
+            return {
+                table: (CatalogTableType.VIEW if table_type == 'view'
+                        else CatalogTableType.TABLE,
+                        [{'name': column[1], 'type': column[2]}
+                         for column in self._table_info(cursor, None, table)])
+                for table, table_type in tables}
@@ -0,0 +1,335 @@
+# -*- coding: utf-8 -*-
+"""
+Execution of slow operations (samples, schema inference) in a bounded pool
+of threads, so a stuck database or HDFS namenode does not hold the web
+worker forever. Each execution has a deadline, according to the type of
+source (HIVE, JDBC, HDFS, LOCAL), and is cancelled if the deadline expires
+or the client disconnects. Cancellation is cooperative: long-running code
+calls is_cancelled() or check_cancelled() (Hive queries do it while
+polling).
+
+Executions may also be started in background, and their results polled
+later (see ExecutionManager.submit() and get()).
+
+Executions and their results live in the memory of the process that
+started them: polling works only if requests reach the same process, i.e.
+a single gunicorn worker process (scaled with threads, see bin/entrypoint)
+or sticky routing to the worker. The gunicorn timeout must be greater than
+the longest deadline of synchronous executions (HIVE, 300s by default).
+"""
+import logging
+import socket
+import threading
+import time
+import uuid
+from concurrent import futures
+
+from flask import (current_app, g as flask_g, has_app_context,
+                   has_request_context, request)
+from flask.globals import request_ctx
+from flask_babel import gettext
+
+log = logging.getLogger(__name__)
+
+CONFIG_KEY = 'LIMONERO_CONFIG'
+
+DEFAULT_EXECUTION_OPTIONS = {
+    'max_workers': 8,
+    # Executions waiting for a worker, before new ones are rejected
+    'max_pending': 32,
+    # Seconds the result of a background execution is kept after it ends
+    'result_ttl': 300,
+}
+
+# Deadlines (seconds) per type of source, overridden by config
+# (execution.timeouts)
+DEFAULT_TIMEOUTS = {
+    'HIVE': 300,
+    'JDBC': 120,
+    'HDFS': 60,
+    'LOCAL': 60,
+    # Conversions between formats and compactions, always in background
+    'CONVERSION': 3600,
+    'COMPACTION': 3600,
+    'MATERIALIZATION': 3600,
+    'default': 60,
+}
+
+# Interval (seconds) to check if client disconnected while waiting
+WATCH_INTERVAL = 0.5
+
+
+class ExecutionTimeout(Exception):
+    """ Execution did not finish before its deadline """
+
+
+class ExecutionCancelled(Exception):
+    """ Execution was cancelled (by client or because it disconnected) """
+
+
+class TooManyExecutions(Exception):
+    """ All workers are busy and the queue of executions is full """
+
+
+_current = threading.local()
+
+
+def client_disconnected():
+    """
+    Tests if the client of the current request closed the connection.
+    Only supported when running in gunicorn (socket is available).
+    """
+    if not has_request_context():
+        return False
+    sock = request.environ.get('gunicorn.socket')
+    if sock is None:
+        return False
+    try:
+        return sock.recv(1, socket.MSG_PEEK | socket.MSG_DONTWAIT) == b''
+    except BlockingIOError:
+        return False
+    except OSError:
+        return True
+
+
+def current_execution():
+    return getattr(_current, 'execution', None)
+
+
+def is_cancelled():
+    """
+    Tests if the current execution was cancelled or its deadline expired.
+    Outside an execution, tests if the client disconnected.
+    """
+    execution = current_execution()
+    if execution is not None:
+        return execution.is_cancelled()
+    return client_disconnected()
+
+
+def check_cancelled():
+    """ Cancellation point: raises ExecutionCancelled if is_cancelled() """
+    if is_cancelled():
+        raise ExecutionCancelled(gettext('Execution was cancelled.'))
+
+
+def get_remaining_time():
+    """ Seconds until the deadline of current execution (None if outside) """
+    execution = current_execution()
+    return execution.remaining() if execution is not None else None
+
+
+def set_progress(**values):
+    """ Updates the progress reported by the current execution, if any """
+    execution = current_execution()
+    if execution is not None:
+        execution.progress.update(values)
+
+
+def bind_current(fn):
+    """
+    Wraps fn to run in another thread (e.g. of a nested pool) as part of
+    the current execution, so is_cancelled() and set_progress() work there.
+    """
+    execution = current_execution()
+
+    def run(*args, **kwargs):
+        _current.execution = execution
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            _current.execution = None
+
+    return run
+
+
+def _get_config():
+    if has_app_context():
+        return (current_app.config.get(CONFIG_KEY) or {}).get(
+            'execution') or {}
+    return {}
+
+
+def get_timeout(kind):
+    timeouts = dict(DEFAULT_TIMEOUTS)
+    timeouts.update(_get_config().get('timeouts') or {})
+    return timeouts.get(kind, timeouts['default'])
+
+
+class Execution:
+    """ An operation submitted to the ExecutionManager """
+
+    def __init__(self, kind, timeout, owner=None, resource=None):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.timeout = timeout
+        self.owner = owner
+        self.resource = resource
+        self.deadline = time.monotonic() + timeout
+        self.finished = None
+        self.future = None
+        self.progress = {}
+        self._cancelled = threading.Event()
+
+    def remaining(self):
+        return max(0.0, self.deadline - time.monotonic())
+
+    def cancel(self):
+        self._cancelled.set()
+        if self.future is not None:
+            self.future.cancel()
+
+    def is_cancelled(self):
+        return self._cancelled.is_set() or time.monotonic() >= self.deadline
+
+    def done(self):
+        return self.future.done()
+
+    @property
+    def status(self):
+        if self.future.cancelled():
+            return 'CANCELLED'
+        elif not self.future.done():
+            if self.is_cancelled():
+                return 'CANCELLING'
+            return 'RUNNING' if self.future.running() else 'PENDING'
+        elif self.future.exception() is not None:
+            return 'ERROR'
+        return 'DONE'
+
+    def result(self):
+        """ Result of a finished execution (or the error it raised) """
+        try:
+            return self.future.result(timeout=0)
+        except futures.CancelledError:
+            raise ExecutionCancelled(gettext('Execution was cancelled.'))
+
+
+class ExecutionManager:
+    def __init__(self, max_workers, max_pending, result_ttl):
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.result_ttl = result_ttl
+        self._executor = futures.ThreadPoolExecutor(
+            max_workers, thread_name_prefix='limonero-execution')
+        self._executions = {}
+        self._lock = threading.Lock()
+
+    def _purge(self):
+        now = time.monotonic()
+        with self._lock:
+            expired = [k for k, e in self._executions.items()
+                       if e.finished is not None and
+                       now - e.finished > self.result_ttl]
+            for k in expired:
+                del self._executions[k]
+
+    @staticmethod
+    def _bind(fn, execution):
+        """
+        Runs fn in the worker with the same app context (g, e.g. user) and
+        request of the caller.
+        """
+        app = current_app._get_current_object()
+        g_values = dict(vars(flask_g._get_current_object()))
+        ctx = request_ctx.copy() if has_request_context() else None
+
+        def run():
+            with app.app_context():
+                vars(flask_g._get_current_object()).update(g_values)
+                if ctx is not None:
+                    ctx.push()
+                _current.execution = execution
+                try:
+                    check_cancelled()
+                    return fn()
+                finally:
+                    _current.execution = None
+                    if ctx is not None:
+                        ctx.pop()
+
+        return run
+
+    def _finished(self, execution):
+        execution.finished = time.monotonic()
+
+    def submit(self, fn, kind, timeout=None, owner=None, resource=None):
+        """
+        Starts fn in a worker. Must be called in an app context.
+        Raises TooManyExecutions if the queue is full.
+        """
+        self._purge()
+        with self._lock:
+            active = sum(1 for e in self._executions.values()
+                         if not e.done())
+            if active >= self.max_workers + self.max_pending:
+                raise TooManyExecutions(gettext(
+                    'Server is busy, try again later.'))
+            execution = Execution(
+                kind, timeout if timeout is not None else get_timeout(kind),
+                owner, resource)
+            execution.future = self._executor.submit(
+                self._bind(fn, execution))
+            self._executions[execution.id] = execution
+        execution.future.add_done_callback(
+            lambda f: self._finished(execution))
+        return execution
+
+    def get(self, execution_id):
+        self._purge()
+        return self._executions.get(execution_id)
+
+    def discard(self, execution):
+        with self._lock:
+            self._executions.pop(execution.id, None)
+
+    def wait(self, execution, watch_client=True):
+        """
+        Waits for the result until the deadline. The execution is cancelled
+        if the deadline expires (ExecutionTimeout) or the client disconnects
+        (ExecutionCancelled). Errors raised by the execution are re-raised.
+        """
+        while True:
+            try:
+                return execution.future.result(
+                    timeout=min(WATCH_INTERVAL, execution.remaining()))
+            except futures.CancelledError:
+                raise ExecutionCancelled(gettext('Execution was cancelled.'))
+            except futures.TimeoutError:
+                if execution.remaining() <= 0:
+                    execution.cancel()
+                    log.warning(gettext('Execution %s (%s) cancelled after '
+                                        '%s seconds.'), execution.id,
+                                execution.kind, execution.timeout)
+                    raise ExecutionTimeout(gettext(
+                        'Operation did not finish in %(timeout)s seconds.',
+                        timeout=execution.timeout))
+                if watch_client and client_disconnected():
+                    execution.cancel()
+                    raise ExecutionCancelled(gettext(
+                        'Execution was cancelled.'))
+
+    def run(self, fn, kind, timeout=None):
+        """ Runs fn in a worker and waits for it (see wait()) """
+        execution = self.submit(fn, kind, timeout)
+        try:
+            return self.wait(execution)
+        finally:
+            self.discard(execution)
+
+
+_manager = None
+_manager_lock = threading.Lock()
+
+
+def get_execution_manager():
+    """ Manager shared by all requests, created using config (execution) """
+    global _manager
+    if _manager is None:
+        with _manager_lock:
+            if _manager is None:
+                options = dict(DEFAULT_EXECUTION_OPTIONS)
+                options.update({k: v for k, v in _get_config().items()
+                                if k in DEFAULT_EXECUTION_OPTIONS})
+                _manager = ExecutionManager(**options)
+    return _manager
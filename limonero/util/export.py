@@ -0,0 +1,258 @@
+# -*- coding: utf-8 -*-
+"""
+Streaming of data sources backed by databases (JDBC and Hive) as Arrow
+record batches, and their export as CSV, Parquet or Arrow (IPC stream).
+Rows are read with server-side cursors, in batches, so memory usage does not
+depend on the size of the result.
+"""
+import io
+import logging
+import re
+from contextlib import closing
+from urllib.parse import urlparse
+
+import pyarrow as pa
+import pyarrow.csv as pa_csv
+import pyarrow.parquet as pq
+from flask_babel import gettext
+
+import limonero.util.hive as hive_util
+from limonero.models import DataSourceFormat
+from limonero.util.dialects import BATCH_SIZE, get_dialect
+from limonero.util.hive import get_hive_pool
+
+log = logging.getLogger(__name__)
+
+# Format: (mimetype, file extension)
+EXPORT_FORMATS = {
+    'csv': ('text/csv', 'csv'),
+    'parquet': ('application/vnd.apache.parquet', 'parquet'),
+    'arrow': ('application/vnd.apache.arrow.stream', 'arrow'),
+}
+
+_HIVE_ARROW_TYPES = {
+    'BOOLEAN': pa.bool_(),
+    'TINYINT': pa.int64(),
+    'SMALLINT': pa.int64(),
+    'INT': pa.int64(),
+    'BIGINT': pa.int64(),
+    'FLOAT': pa.float64(),
+    'DOUBLE': pa.float64(),
+    'STRING': pa.string(),
+    'VARCHAR': pa.string(),
+    'CHAR': pa.string(),
+    # Returned as strings by HiveServer2
+    'DATE': pa.string(),
+    'TIMESTAMP': pa.string(),
+    'DECIMAL': pa.string(),
+}
+
+
+def is_database_backed(data_source):
+    return (data_source.format in (DataSourceFormat.JDBC,
+                                   DataSourceFormat.HIVE))
+
+
+def _hive_column(description):
+    name = description[1].replace('_TYPE', '').upper()
+    # Complex types (array, map, struct) are returned as JSON strings
+    return _HIVE_ARROW_TYPES.get(name, pa.string()), None
+
+
+def _to_array(values, arrow_type):
+    """
+    Array of values with arrow_type. Unlike pa.array(values, type), values
+    are never truncated (e.g. 2.5 in an integer column): the conversion
+    fails instead.
+    """
+    array = pa.array(values)
+    if array.type == arrow_type:
+        return array
+    return array.cast(arrow_type)
+
+
+def _safe_array(values, arrow_type, name):
+    """ Invalid values (e.g. MySQL zero dates) are converted to null """
+    result = []
+    for value in values:
+        try:
+            _to_array([value], arrow_type)
+            result.append(value)
+        except (pa.ArrowInvalid, pa.ArrowTypeError,
+                pa.ArrowNotImplementedError, TypeError, ValueError):
+            result.append(None)
+    log.warning(gettext('Invalid values in column %s were exported as null'),
+                name)
+    return pa.array(result, type=arrow_type)
+
+
+class RecordBatchReader:
+    """
+    Converts rows read from a DB-API cursor (fetchmany) to record batches.
+    Column types come from cursor description (see column_info); columns
+    without a known type (e.g. SQLite) use the type inferred from the first
+    batch, string if its values have different types. If values in a later
+    batch do not fit that type, reading fails (ValueError), because the
+    schema was already used.
+    """
+
+    def __init__(self, cursor, column_info, names=None,
+                 batch_size=BATCH_SIZE):
+        self.cursor = cursor
+        self.batch_size = batch_size
+        columns = [column_info(d) for d in cursor.description]
+        self.names = names or [d[0] for d in cursor.description]
+        self.types = [c[0] for c in columns]
+        self.converters = [c[1] for c in columns]
+        self.inferred = [t is None for t in self.types]
+
+    @property
+    def schema(self):
+        return pa.schema([(name, t or pa.string())
+                          for name, t in zip(self.names, self.types)])
+
+    def _infer(self, i, values):
+        try:
+            array = pa.array(values)
+        except (pa.ArrowInvalid, pa.ArrowTypeError):
+            # Values of different types
+            self.types[i] = pa.string()
+            return
+        self.types[i] = (pa.string() if pa.types.is_null(array.type)
+                         else array.type)
+
+    def _array(self, i, values):
+        converter = self.converters[i]
+        if converter is not None:
+            values = [v if v is None else converter(v) for v in values]
+        if self.types[i] is None:
+            self._infer(i, values)
+        if self.inferred[i] and pa.types.is_string(self.types[i]):
+            return pa.array([v if v is None else str(v) for v in values],
+                            type=pa.string())
+        try:
+            return _to_array(values, self.types[i])
+        except (pa.ArrowInvalid, pa.ArrowTypeError,
+                pa.ArrowNotImplementedError):
+            if self.inferred[i]:
+                raise ValueError(gettext(
+                    'Column %(name)s has values of different types and '
+                    'cannot be exported.', name=self.names[i]))
+            return _safe_array(values, self.types[i], self.names[i])
+
+    def __iter__(self):
+        while True:
+            rows = self.cursor.fetchmany(self.batch_size)
+            if not rows:
+                break
+            columns = list(zip(*rows))
+            yield pa.RecordBatch.from_arrays(
+                [self._array(i, values) for i, values in enumerate(columns)],
+                names=self.names)
+
+
+def _get_command(data_source, limit=None):
+    if data_source.command is None or data_source.command.strip() == '':
+        raise ValueError(gettext(
+            'Data source does not have a command specified'))
+    if limit is None:
+        return data_source.command
+    fix_limit = re.compile(r'\sLIMIT\s+(\d+)')
+    return '{} LIMIT {}'.format(fix_limit.sub('', data_source.command),
+                                int(limit))
+
+
+def _hive_names(description):
+    """ Removes table prefix (table.column) if all columns are unique """
+    names = [d[0].split('.', 1)[-1] for d in description]
+    if len(set(names)) == len(names):
+        return names
+    return [d[0] for d in description]
+
+
+def database_batches(data_source, limit=None, batch_size=BATCH_SIZE):
+    """
+    Generator of (schema, record batches) for a database-backed data source.
+    The first item is the schema, informed even if result is empty.
+    A pooled connection is used until the generator is exhausted or closed.
+    """
+    if data_source.format == DataSourceFormat.JDBC:
+        dialect = get_dialect(urlparse(data_source.url))
+        cmd = _get_command(data_source)
+        if limit is not None:
+            cmd = dialect.limit(cmd, limit)
+        yield from dialect.batches(cmd, batch_size)
+    elif data_source.format == DataSourceFormat.HIVE:
+        parsed = urlparse(data_source.storage.client_url)
+        cmd = _get_command(data_source, limit)
+        pool = get_hive_pool(parsed, data_source.storage.extra_params)
+        with pool.connection() as cn, \
+                closing(cn.cursor(arraysize=batch_size)) as cursor:
+            hive_util.execute(cursor, cmd)
+            reader = RecordBatchReader(
+                cursor, _hive_column, _hive_names(cursor.description),
+                batch_size=batch_size)
+            yield reader.schema
+            yield from reader
+    else:
+        raise ValueError(gettext('Format %(format)s is not supported',
+                                 format=data_source.format))
+
+
+class _ChunkSink(io.RawIOBase):
+    """ Write-only file collecting data written by Arrow writers """
+
+    def __init__(self):
+        super().__init__()
+        self._chunks = []
+        self._position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def take(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def _get_writer(fmt, sink, schema):
+    if fmt == 'csv':
+        return pa_csv.CSVWriter(sink, schema)
+    elif fmt == 'parquet':
+        return pq.ParquetWriter(sink, schema)
+    elif fmt == 'arrow':
+        return pa.ipc.new_stream(sink, schema)
+    raise ValueError(gettext('Format %(format)s is not supported',
+                             format=fmt))
+
+
+def write_batches(batches, fmt):
+    """
+    Encodes the output of database_batches() in the format (see
+    EXPORT_FORMATS), yielding encoded data after each batch.
+    """
+    schema = next(batches)
+    sink = _ChunkSink()
+    with pa.PythonFile(sink, mode='w') as f:
+        writer = _get_writer(fmt, f, schema)
+        for batch in batches:
+            if batch.schema.equals(schema):
+                writer.write_batch(batch)
+            else:
+                writer.write_table(pa.Table.from_batches([batch]).cast(schema))
+            data = sink.take()
+            if data:
+                yield data
+        writer.close()
+    data = sink.take()
+    if data:
+        yield data
@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+"""
+Helpers for HTTP conditional requests (ETag/If-None-Match) and
+Cache-Control policies of read-only endpoints.
+"""
+import hashlib
+import json
+
+from flask import current_app, request
+from flask_babel import get_locale
+
+CONFIG_KEY = 'LIMONERO_CONFIG'
+
+# Clients must revalidate (cheap, thanks to ETags) before reusing a response
+DEFAULT_CACHE_CONTROL = 'private, no-cache'
+
+
+def make_etag(*parts, weak=False):
+    """
+    Builds an ETag value from the parts identifying a representation.
+    Parts are serialized in a stable way, so sets and dicts can be used.
+    """
+    normalized = [sorted(p) if isinstance(p, (set, frozenset)) else p
+                  for p in parts]
+    digest = hashlib.sha1(json.dumps(
+        normalized, sort_keys=True, default=str).encode('utf8')).hexdigest()
+    return f'W/"{digest}"' if weak else f'"{digest}"'
+
+
+def etag_for_payload(payload):
+    """ Weak ETag for a representation without a version column """
+    return make_etag(payload, weak=True)
+
+
+def current_locale():
+    return str(get_locale() or '')
+
+
+def get_cache_control(endpoint):
+    """
+    Cache-Control policy for an endpoint. It can be changed in config file:
+    cache_control:
+        DataSourceDetailApi: private, max-age=30
+    """
+    config = current_app.config.get(CONFIG_KEY) or {}
+    policies = config.get('cache_control') or {}
+    return policies.get(endpoint, policies.get('default',
+                                               DEFAULT_CACHE_CONTROL))
+
+
+def is_not_modified(etag):
+    """
+    Tests if client's copy (If-None-Match header) matches the ETag.
+    Comparison is weak, as defined by RFC 7232 for GET requests.
+    """
+    if_none_match = request.if_none_match
+    if not if_none_match:
+        return False
+    unquoted = etag[2:] if etag.startswith('W/') else etag
+    return if_none_match.contains_weak(unquoted.strip('"'))
+
+
+def cache_headers(etag, endpoint):
+    return {'ETag': etag, 'Cache-Control': get_cache_control(endpoint)}
+
+
+def not_modified(etag, endpoint):
+    """ Response for flask_restful resources when nothing has changed """
+    return '', 304, cache_headers(etag, endpoint)
@@ -1,5 +1,10 @@
 # -*- coding: utf-8 -*-
+import re
+
+import pymysql
+
 from limonero.models import DataType
+from limonero.util.pool import get_pool
 
 
 def get_mysql_data_type(d, dtype):
@@ -31,3 +36,57 @@ def get_hive_data_type(d):
     else:
         final_type = DataType.CHARACTER
     return final_type
+
+
+_TYPE_PARAMS = re.compile(r'^\s*(\w+)\s*(?:\(\s*(\d+)\s*(?:,\s*(\d+)\s*)?\))?')
+
+
+def parse_type_name(type_name):
+    """ Base type and parameters: decimal(10,2) -> ('DECIMAL', 10, 2) """
+    match = _TYPE_PARAMS.match(type_name or '')
+    if not match:
+        return (type_name or '').upper(), None, None
+    base, first, second = match.groups()
+    return (base.upper(), int(first) if first else None,
+            int(second) if second else None)
+
+
+def make_attribute(name, data_type, size=None, precision=None, scale=None,
+                   nullable=None):
+    """ Inferred attribute, as expected by Attribute(**attribute) """
+    return {'name': name, 'type': data_type, 'size': size,
+            'precision': precision, 'scale': scale, 'nullable': nullable}
+
+
+def _parse_query_string(parsed):
+    if parsed.query and parsed.query.strip():
+        return dict(x.split('=', 1) for x in parsed.query.split('&') if x)
+    return {}
+
+
+def _ping_mysql(cn):
+    cn.ping(reconnect=False)
+
+
+def get_mysql_pool(parsed):
+    """
+    Pool of connections to the MySQL database informed in the (parsed) URL.
+    User and password may be informed in URL or in its query string.
+    Connections are rolled back when returned to pool, so a new transaction
+    (and snapshot) is used by each request.
+    """
+    qs = _parse_query_string(parsed)
+    host = parsed.hostname
+    port = int(parsed.port or 3306)
+    user = parsed.username or qs.get('user')
+    password = parsed.password or qs.get('password')
+    database = parsed.path[1:]
+
+    def factory():
+        return pymysql.connect(host=host, port=port, user=user,
+                               passwd=password, db=database, charset='UTF8')
+
+    key = ('mysql', host, port, user, password, database)
+    return get_pool(key, f'mysql://{user}@{host}:{port}/{database}',
+                    factory, pre_ping=_ping_mysql,
+                    reset=lambda cn: cn.rollback())
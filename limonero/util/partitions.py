@@ -0,0 +1,237 @@
+# -*- coding: utf-8 -*-
+"""
+Partitions of directory data sources (Parquet, CSV), encoded in the paths
+of their files: Hive style (year=2024/month=01) or plain directories
+(2024/01), named after the attributes flagged as partition keys.
+
+Partitions are discovered following the first sub-directory of each level,
+so only a few directories are listed. Filters on partitions prune the data
+read: filters on the leading partitions (e.g. year and month) descend
+directly into the matching directory, so only it is listed and its files
+opened, and the other filters skip files by their partition values
+(pyarrow.dataset), without opening them.
+"""
+import collections
+from urllib.parse import unquote
+
+import pyarrow as pa
+import pyarrow.dataset as pa_dataset
+from flask_babel import gettext
+from pyarrow import fs
+
+HIVE = 'hive'
+DIRECTORY = 'directory'
+
+Partitioning = collections.namedtuple('Partitioning', ['flavor', 'names'])
+
+
+def _is_hidden(name):
+    # Same files ignored by pyarrow.dataset (e.g. _SUCCESS, .crc files)
+    return name.startswith(('_', '.'))
+
+
+def _sub_dirs(filesystem, path):
+    return sorted(
+        info.base_name for info in filesystem.get_file_info(
+            fs.FileSelector(path))
+        if info.type == fs.FileType.Directory and
+        not _is_hidden(info.base_name))
+
+
+def _split(flavor, name):
+    """ Key and value of a partition directory """
+    if flavor == HIVE:
+        key, value = name.split('=', 1)
+        return unquote(key), unquote(value)
+    return None, name
+
+
+def discover(filesystem, path, names=None):
+    """
+    Partitioning of the directory in path, or None if it is a file or has
+    no sub-directories. Plain directories are named after names (default:
+    partition_1, partition_2, ...).
+    """
+    path = path.rstrip('/')
+    if filesystem.get_file_info(path).type != fs.FileType.Directory:
+        return None
+    flavor = None
+    keys = []
+    current = path
+    while True:
+        dirs = _sub_dirs(filesystem, current)
+        if not dirs:
+            break
+        with_key = sum(1 for d in dirs if '=' in d)
+        level = HIVE if with_key == len(dirs) else DIRECTORY
+        if with_key not in (0, len(dirs)) or flavor not in (None, level):
+            # Mixed directories are not partitions
+            break
+        flavor = level
+        keys.append(_split(flavor, dirs[0])[0])
+        current = f'{current}/{dirs[0]}'
+
+    if not keys:
+        return None
+    if flavor == DIRECTORY:
+        names = list(names or [])
+        keys = [names[i] if i < len(names) else f'partition_{i + 1}'
+                for i in range(len(keys))]
+    return Partitioning(flavor, keys)
+
+
+def get_names(data_source):
+    """ Names of the attributes of data_source that are partition keys """
+    return [attr.name for attr in data_source.attributes
+            if attr.partition_key]
+
+
+def parse_filters(value):
+    """
+    Filters on partitions, as 'year=2024/month=01' (or separated by
+    commas). Returns an ordered dict, empty if value is empty.
+    """
+    filters = collections.OrderedDict()
+    for item in (value or '').replace(',', '/').split('/'):
+        if not item.strip():
+            continue
+        if '=' not in item:
+            raise ValueError(gettext(
+                'Invalid partition filter: %(filter)s.', filter=item))
+        name, item_value = item.split('=', 1)
+        filters[name.strip()] = item_value.strip()
+    return filters
+
+
+def _same_value(value, other):
+    if value == other:
+        return True
+    try:
+        # e.g. month=01 and month=1
+        return float(value) == float(other)
+    except ValueError:
+        return False
+
+
+def _prune(filesystem, path, partitioning, filters):
+    """
+    Directory of the leading partitions in filters, or None if there is no
+    such partition.
+    """
+    current = path
+    for name in partitioning.names:
+        if name not in filters:
+            break
+        for directory in _sub_dirs(filesystem, current):
+            if '=' not in directory and partitioning.flavor == HIVE:
+                continue
+            key, value = _split(partitioning.flavor, directory)
+            if key in (None, name) and _same_value(value, filters[name]):
+                current = f'{current}/{directory}'
+                break
+        else:
+            return None
+    return current
+
+
+def _arrow_partitioning(partitioning, schema=None):
+    flavor = 'hive' if partitioning.flavor == HIVE else None
+    if schema is not None and all(
+            name in schema.names for name in partitioning.names):
+        return pa_dataset.partitioning(
+            pa.schema([schema.field(name) for name in partitioning.names]),
+            flavor=flavor)
+    if partitioning.flavor == HIVE:
+        return pa_dataset.HivePartitioning.discover(infer_dictionary=False)
+    return pa_dataset.DirectoryPartitioning.discover(partitioning.names)
+
+
+def open_dataset(filesystem, path, file_format, schema=None, filters=None,
+                 names=None):
+    """
+    Dataset (pyarrow) of the files in path, including its partitions as
+    columns, and the expression selecting the partitions in filters (None
+    without filters), to be used when reading it.
+    """
+    path = path.rstrip('/')
+    filters = filters or {}
+    partitioning = discover(filesystem, path, names)
+    if partitioning is None:
+        if filters:
+            raise ValueError(gettext('Data source is not partitioned.'))
+        return pa_dataset.dataset(path, schema=schema, format=file_format,
+                                  filesystem=filesystem), None
+
+    unknown = [name for name in filters if name not in partitioning.names]
+    if unknown:
+        raise ValueError(gettext('Invalid partitions: %(names)s.',
+                                 names=', '.join(unknown)))
+    # If no partition matches, the expression selects no file
+    source = _prune(filesystem, path, partitioning, filters) or path
+    dataset = pa_dataset.dataset(
+        source, schema=schema, format=file_format, filesystem=filesystem,
+        partitioning=_arrow_partitioning(partitioning, schema),
+        partition_base_dir=path)
+
+    expression = None
+    for name, value in filters.items():
+        field_type = dataset.schema.field(name).type
+        condition = pa_dataset.field(name) == pa.scalar(value).cast(
+            field_type)
+        expression = (condition if expression is None
+                      else expression & condition)
+    return dataset, expression
+
+
+def read_head(filesystem, path, file_format, size, schema=None,
+              filters=None, names=None):
+    """ First size rows (table) of the partitions in filters """
+    dataset, expression = open_dataset(filesystem, path, file_format, schema,
+                                       filters, names)
+    return dataset.head(size, filter=expression)
+
+
+def read_sample(filesystem, path, file_format, size, schema=None,
+                filters=None, names=None):
+    """ First size rows (list of dicts) of the partitions in filters """
+    return read_head(filesystem, path, file_format, size, schema, filters,
+                     names).to_pylist()
+
+
+def list_partitions(filesystem, path, names=None):
+    """
+    Partitions of the directory in path, with their values, number of files
+    and size (bytes), or None if it is not partitioned.
+    """
+    path = path.rstrip('/')
+    partitioning = discover(filesystem, path, names)
+    if partitioning is None:
+        return None
+
+    depth = len(partitioning.names)
+    sizes = collections.defaultdict(lambda: [0, 0])
+    for info in filesystem.get_file_info(
+            fs.FileSelector(path, recursive=True)):
+        parts = info.path[len(path) + 1:].split('/')
+        if (info.type != fs.FileType.File or len(parts) <= depth or
+                any(_is_hidden(part) for part in parts)):
+            continue
+        totals = sizes[tuple(parts[:depth])]
+        totals[0] += 1
+        totals[1] += info.size
+
+    partitions = []
+    for directories, (files, size) in sorted(sizes.items()):
+        values = [_split(partitioning.flavor, d)[1] for d in directories]
+        partitions.append({
+            'values': dict(zip(partitioning.names, values)),
+            'files': files,
+            'size': size,
+        })
+    return {
+        'flavor': partitioning.flavor,
+        'names': partitioning.names,
+        'count': len(partitions),
+        'size': sum(p['size'] for p in partitions),
+        'partitions': partitions,
+    }
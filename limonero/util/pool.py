@@ -0,0 +1,228 @@
+# -*- coding: utf-8 -*-
+"""
+Bounded pools of connections to external databases (data sources), shared
+by all requests handled by a worker.
+"""
+import collections
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+from flask import current_app, has_app_context
+from flask_babel import gettext
+
+log = logging.getLogger(__name__)
+
+CONFIG_KEY = 'LIMONERO_CONFIG'
+
+DEFAULT_POOL_OPTIONS = {
+    'max_size': 5,
+    'max_lifetime': 1800,
+    'idle_timeout': 300,
+    'acquire_timeout': 30,
+}
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+class PoolTimeout(Exception):
+    """ No connection became available in the pool in time """
+
+
+class _PooledConnection:
+    __slots__ = ('connection', 'created', 'last_used')
+
+    def __init__(self, connection, now):
+        self.connection = connection
+        self.created = now
+        self.last_used = now
+
+
+class ConnectionPool:
+    """
+    Thread-safe pool with at most max_size open connections.
+    Connections are closed after max_lifetime seconds (since creation) or
+    idle_timeout seconds (since last use). If pre_ping is informed, it is
+    called before handing out a reused connection and must return False
+    (or fail) if the connection is no longer usable. Reset is called when a
+    connection is returned to the pool (e.g. to finish transactions).
+    """
+
+    def __init__(self, name, factory, max_size=5, max_lifetime=1800,
+                 idle_timeout=300, acquire_timeout=30, pre_ping=None,
+                 reset=None, close=None):
+        self.name = name
+        self.max_size = max_size
+        self.max_lifetime = max_lifetime
+        self.idle_timeout = idle_timeout
+        self.acquire_timeout = acquire_timeout
+        self._factory = factory
+        self._pre_ping = pre_ping
+        self._reset = reset
+        self._close_fn = close or (lambda conn: conn.close())
+        self._idle = collections.deque()
+        self._size = 0
+        self._cond = threading.Condition()
+        self._metrics = collections.Counter()
+
+    def _is_expired(self, pooled, now):
+        return (now - pooled.created > self.max_lifetime or
+                now - pooled.last_used > self.idle_timeout)
+
+    def _close(self, pooled):
+        with self._cond:
+            self._size -= 1
+            self._metrics['closed'] += 1
+            self._cond.notify()
+        try:
+            self._close_fn(pooled.connection)
+        except Exception:
+            log.warning(gettext('Error closing connection from pool %s'),
+                        self.name, exc_info=True)
+
+    def _take(self):
+        """ Takes an idle connection or reserves room for a new one """
+        deadline = time.monotonic() + self.acquire_timeout
+        expired = []
+        try:
+            with self._cond:
+                while True:
+                    now = time.monotonic()
+                    while self._idle:
+                        # Most recently used first, keeps others expiring
+                        pooled = self._idle.pop()
+                        if self._is_expired(pooled, now):
+                            expired.append(pooled)
+                        else:
+                            return pooled
+                    if self._size - len(expired) < self.max_size:
+                        self._size += 1
+                        return None
+                    remaining = deadline - now
+                    if remaining <= 0:
+                        self._metrics['timeouts'] += 1
+                        raise PoolTimeout(gettext(
+                            'Timeout waiting for a connection (%(name)s)',
+                            name=self.name))
+                    self._metrics['waits'] += 1
+                    self._cond.wait(remaining)
+        finally:
+            for pooled in expired:
+                self._close(pooled)
+
+    def acquire(self):
+        while True:
+            pooled = self._take()
+            if pooled is None:
+                try:
+                    connection = self._factory()
+                except Exception:
+                    with self._cond:
+                        self._size -= 1
+                        self._cond.notify()
+                    raise
+                with self._cond:
+                    self._metrics['created'] += 1
+                return _PooledConnection(connection, time.monotonic())
+            if self._ping(pooled.connection):
+                with self._cond:
+                    self._metrics['reused'] += 1
+                return pooled
+            with self._cond:
+                self._metrics['failed_pings'] += 1
+            self._close(pooled)
+
+    def _ping(self, connection):
+        if self._pre_ping is None:
+            return True
+        try:
+            return self._pre_ping(connection) is not False
+        except Exception:
+            return False
+
+    def release(self, pooled, discard=False):
+        now = time.monotonic()
+        if not discard and self._reset is not None:
+            try:
+                self._reset(pooled.connection)
+            except Exception:
+                discard = True
+        if discard or now - pooled.created > self.max_lifetime:
+            self._close(pooled)
+        else:
+            pooled.last_used = now
+            with self._cond:
+                self._idle.append(pooled)
+                self._cond.notify()
+
+    @contextmanager
+    def connection(self):
+        """
+        Context manager returning a connection to the pool after use.
+        If an error occurs, the connection state is unknown and it is closed.
+        """
+        pooled = self.acquire()
+        try:
+            yield pooled.connection
+        except BaseException:
+            self.release(pooled, discard=True)
+            raise
+        else:
+            self.release(pooled)
+
+    def close_all(self):
+        with self._cond:
+            idle = list(self._idle)
+            self._idle.clear()
+        for pooled in idle:
+            self._close(pooled)
+
+    def stats(self):
+        with self._cond:
+            result = dict(self._metrics)
+            result.update({'size': self._size, 'idle': len(self._idle),
+                           'in_use': self._size - len(self._idle),
+                           'max_size': self.max_size})
+        return result
+
+
+def _pool_options():
+    options = dict(DEFAULT_POOL_OPTIONS)
+    if has_app_context():
+        config = current_app.config.get(CONFIG_KEY) or {}
+        options.update(config.get('pools') or {})
+    return options
+
+
+def get_pool(key, name, factory, **kwargs):
+    """
+    Returns the pool identified by key (e.g. a DSN), creating it if needed.
+    Pool sizes and timeouts are read from config ('pools' section).
+    """
+    pool = _pools.get(key)
+    if pool is None:
+        with _pools_lock:
+            pool = _pools.get(key)
+            if pool is None:
+                options = _pool_options()
+                options.update(kwargs)
+                pool = ConnectionPool(name, factory, **options)
+                _pools[key] = pool
+    return pool
+
+
+def get_pools_stats():
+    """
+    Statistics of each pool, by name. Names do not have the password, so
+    pools of the same server with other credentials get a suffix (#2, #3).
+    """
+    stats = {}
+    for pool in list(_pools.values()):
+        name, count = pool.name, 1
+        while name in stats:
+            count += 1
+            name = f'{pool.name}#{count}'
+        stats[name] = pool.stats()
+    return stats
@@ -0,0 +1,162 @@
+# -*- coding: utf-8 -*-
+"""
+Resolution of the schema (attributes) of data sources backed by databases.
+Metadata is used whenever possible (metadata catalog, information_schema,
+DESCRIBE, see dialects), instead of executing the command with LIMIT 0,
+which in Hive is compiled and may launch jobs. Results are cached per
+normalized command.
+"""
+import hashlib
+import json
+import logging
+import re
+from contextlib import closing
+from urllib.parse import urlparse
+
+from flask import current_app
+from flask_babel import gettext
+
+import limonero.util.catalog as catalog
+import limonero.util.hive as hive_util
+from limonero.cache import cache
+from limonero.models import DataSourceFormat, StorageCatalogTable
+from limonero.util.dialects import get_dialect
+from limonero.util.hive import get_hive_pool
+from limonero.util.jdbc import (get_hive_data_type, make_attribute,
+                                parse_type_name)
+
+log = logging.getLogger(__name__)
+
+CONFIG_KEY = 'LIMONERO_CONFIG'
+DEFAULT_SCHEMA_CACHE_TIMEOUT = 600
+
+_TRAILING_LIMIT = re.compile(r'\s+LIMIT\s+\d+(\s*,\s*\d+)?\s*;?\s*$',
+                             re.IGNORECASE)
+_IDENTIFIER = r'(?:`[^`]+`|"[^"]+"|[\w$]+)'
+_SIMPLE_SELECT = re.compile(
+    r'^SELECT\s+\*\s+FROM\s+(?:({id})\.)?({id})$'.format(id=_IDENTIFIER),
+    re.IGNORECASE)
+
+
+def normalize_command(cmd):
+    """
+    Command without trailing LIMIT or semicolon and with whitespace
+    collapsed, so equivalent commands share the same cached schema.
+    """
+    cmd = ' '.join((cmd or '').split())
+    cmd = _TRAILING_LIMIT.sub('', cmd)
+    return cmd.rstrip('; ')
+
+
+def _unquote(identifier):
+    if identifier and identifier[0] in '`"':
+        return identifier[1:-1]
+    return identifier
+
+
+def _simple_table(cmd):
+    """ (database, table) if command is SELECT * FROM [database.]table """
+    match = _SIMPLE_SELECT.match(cmd)
+    if match:
+        return _unquote(match.group(1)), _unquote(match.group(2))
+    return None
+
+
+def _hive_attribute(name, type_name):
+    base, first, second = parse_type_name(type_name)
+    data_type = get_hive_data_type(base)
+    if base == 'DECIMAL':
+        return make_attribute(name, data_type, precision=first,
+                              scale=second)
+    return make_attribute(name, data_type, size=first)
+
+
+def _get_cache_timeout():
+    config = current_app.config.get(CONFIG_KEY) or {}
+    return int(config.get('schema_cache_timeout',
+                          DEFAULT_SCHEMA_CACHE_TIMEOUT))
+
+
+def _cache_key(data_source, cmd):
+    source = data_source.url if data_source.format == DataSourceFormat.JDBC \
+        else data_source.storage.client_url
+    digest = hashlib.sha1(json.dumps(
+        [data_source.format, data_source.storage_id, source, cmd]).encode(
+        'utf8')).hexdigest()
+    return f'schema:{digest}'
+
+
+def _resolve_jdbc(data_source, cmd):
+    dialect = get_dialect(urlparse(data_source.url))
+    table = _simple_table(cmd)
+    with dialect.get_pool().connection() as cn:
+        if table:
+            result = dialect.table_schema(cn, *table)
+            if result:
+                return result
+        return dialect.query_schema(cn, cmd)
+
+
+def _hive_table_schema(storage, name):
+    """ Columns from the metadata catalog or, if not crawled, DESCRIBE """
+    table = StorageCatalogTable.query.filter(
+        StorageCatalogTable.storage_id == storage.id,
+        StorageCatalogTable.name == name).first()
+    if table is not None:
+        table = catalog.ensure_columns(storage, table)
+        columns = json.loads(table.columns) if table else None
+    else:
+        columns = catalog._describe(storage, name)
+    return [_hive_attribute(c['name'], c['type']) for c in columns or []]
+
+
+def _hive_names(description):
+    # Hive prefixes columns with table name (table.column)
+    if len({d[0].split('.', 1)[0] for d in description}) == 1:
+        return [d[0].split('.', 1)[-1] for d in description]
+    return [d[0] for d in description]
+
+
+def _resolve_hive(data_source, cmd):
+    storage = data_source.storage
+    table = _simple_table(cmd)
+    if table and table[0] is None and \
+            storage.type in catalog.CATALOG_STORAGE_TYPES:
+        result = _hive_table_schema(storage, table[1])
+        if result:
+            return result
+
+    parsed = urlparse(storage.client_url)
+    pool = get_hive_pool(parsed, storage.extra_params)
+    with pool.connection() as cn, closing(cn.cursor()) as cursor:
+        hive_util.execute(cursor, '{} LIMIT 0'.format(cmd))
+        description = cursor.description
+    return [make_attribute(name, get_hive_data_type(d[1]))
+            for name, d in zip(_hive_names(description), description)]
+
+
+def resolve_schema(data_source, refresh=False):
+    """
+    Attributes (dicts with name, type, size, precision, scale and nullable)
+    of a JDBC or Hive data source. Cached per data source connection and
+    normalized command, unless refresh is True.
+    """
+    if data_source.command is None or data_source.command.strip() == '':
+        raise ValueError(gettext(
+            'Data source does not have a command specified'))
+    cmd = normalize_command(data_source.command)
+    key = _cache_key(data_source, cmd)
+    if not refresh:
+        result = cache.get(key)
+        if result is not None:
+            return result
+
+    if data_source.format == DataSourceFormat.JDBC:
+        result = _resolve_jdbc(data_source, cmd)
+    elif data_source.format == DataSourceFormat.HIVE:
+        result = _resolve_hive(data_source, cmd)
+    else:
+        raise ValueError(gettext('Format %(format)s is not supported',
+                                 format=data_source.format))
+    cache.set(key, result, timeout=_get_cache_timeout())
+    return result
@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+"""
+Fast JSON rendering of API responses. Uses orjson when available and falls
+back to the standard library, producing the same output as
+limonero.CustomJSONEncoder (ISO dates, decimals and bytes as strings).
+"""
+import datetime
+import decimal
+import json
+
+from flask import Response, make_response, request, stream_with_context
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+from limonero import CustomJSONEncoder
+
+NDJSON_MIMETYPE = 'application/x-ndjson'
+
+# Rows fetched from database (and sent to client) at once when streaming
+STREAM_BATCH_SIZE = 200
+
+if orjson is not None:
+    # Dates are serialized by _default(), as CustomJSONEncoder does
+    ORJSON_OPTIONS = (orjson.OPT_PASSTHROUGH_DATETIME |
+                      orjson.OPT_NON_STR_KEYS)
+
+
+def _default(o):
+    if isinstance(o, (datetime.date, datetime.datetime, datetime.time)):
+        return o.isoformat()
+    elif isinstance(o, (bytes, decimal.Decimal)):
+        return str(o)
+    raise TypeError(f'Object of type {type(o).__name__} '
+                    f'is not JSON serializable')
+
+
+def dumps(data) -> bytes:
+    """ Serializes data as UTF-8 encoded JSON """
+    if orjson is not None:
+        return orjson.dumps(data, default=_default, option=ORJSON_OPTIONS)
+    return json.dumps(data, cls=CustomJSONEncoder,
+                      separators=(',', ':')).encode('utf8')
+
+
+def output_json(data, code, headers=None):
+    """ Representation used by Flask-RESTful for application/json """
+    response = make_response(dumps(data), code)
+    response.headers.extend(headers or {})
+    return response
+
+
+def wants_ndjson():
+    """ Client asked for newline delimited JSON (Accept header) """
+    return request.accept_mimetypes.best_match(
+        ['application/json', NDJSON_MIMETYPE]) == NDJSON_MIMETYPE
+
+
+def stream_ndjson(query, schema, headers=None, batch_size=STREAM_BATCH_SIZE):
+    """
+    Streams query results as newline delimited JSON, one object per line.
+    Rows are fetched and serialized in batches, so memory usage does not
+    depend on the number of results and the first ones are sent right away.
+    Query must not eager load collections (see Query.yield_per).
+    """
+    def generate():
+        lines = []
+        for row in query.yield_per(batch_size):
+            lines.append(dumps(schema.dump(row)))
+            if len(lines) == batch_size:
+                lines.append(b'')
+                yield b'\n'.join(lines)
+                lines = []
+        if lines:
+            lines.append(b'')
+            yield b'\n'.join(lines)
+
+    return Response(stream_with_context(generate()),
+                    mimetype=NDJSON_MIMETYPE, headers=headers)
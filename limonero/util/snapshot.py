@@ -0,0 +1,175 @@
+# -*- coding: utf-8 -*-
+"""
+Snapshots of data sources backed by databases (JDBC, Hive): the command is
+executed once and its result is stored as a Parquet dataset in a file
+storage (HDFS or local). Samples, downloads and exports read the snapshot,
+instead of querying the database, while it is not expired (snapshot_ttl).
+"""
+import datetime
+import logging
+from urllib.parse import urlparse
+
+import pyarrow.dataset as pa_dataset
+import pyarrow.parquet as pq
+from flask_babel import gettext
+
+import limonero.hdfs_util as hu
+from limonero.models import StorageType, db
+from limonero.util.execution import check_cancelled, set_progress
+from limonero.util.export import database_batches, is_database_backed
+
+log = logging.getLogger(__name__)
+
+SNAPSHOT_DIR = 'limonero/snapshots'
+SNAPSHOT_STORAGE_TYPES = (StorageType.HDFS, StorageType.LOCAL)
+
+# Rows per Parquet file in a snapshot
+SNAPSHOT_FILE_ROWS = 1000000
+
+# Rows read at once from a snapshot
+READ_BATCH_SIZE = 10000
+
+
+def _get_filesystem(url, storage):
+    parsed = urlparse(url)
+    return hu.get_filesystem(parsed, storage.extra_params), parsed.path
+
+
+def is_snapshot_fresh(data_source):
+    if not data_source.snapshot_url or data_source.snapshot_updated is None:
+        return False
+    if data_source.snapshot_ttl is None:
+        return True
+    age = datetime.datetime.utcnow() - data_source.snapshot_updated
+    return age.total_seconds() < data_source.snapshot_ttl
+
+
+def has_fresh_snapshot(data_source):
+    return is_database_backed(data_source) and is_snapshot_fresh(data_source)
+
+
+def _write_snapshot(data_source, filesystem, path):
+    batches = database_batches(data_source)
+    schema = next(batches)
+    part = 0
+    rows = 0
+    writer = None
+    total = 0
+    try:
+        for batch in batches:
+            check_cancelled()
+            if writer is None or rows >= SNAPSHOT_FILE_ROWS:
+                if writer is not None:
+                    writer.close()
+                writer = pq.ParquetWriter(
+                    f'{path}/part-{part:05}.parquet', schema,
+                    filesystem=filesystem)
+                part += 1
+                rows = 0
+            writer.write_batch(batch)
+            rows += batch.num_rows
+            total += batch.num_rows
+            set_progress(rows=total, files=part)
+        if writer is None:
+            # Empty result, the schema is still required by readers
+            writer = pq.ParquetWriter(f'{path}/part-00000.parquet', schema,
+                                      filesystem=filesystem)
+    finally:
+        if writer is not None:
+            writer.close()
+
+
+def _delete_snapshot(url, storage):
+    try:
+        filesystem, path = _get_filesystem(url, storage)
+        filesystem.delete_dir(path)
+    except Exception:
+        log.warning(gettext('Could not remove snapshot %s'), url,
+                    exc_info=True)
+
+
+def validate(data_source, storage):
+    """ Raises ValueError if data source cannot be materialized in storage """
+    if not is_database_backed(data_source):
+        raise ValueError(gettext(
+            'Only data sources backed by databases can be materialized.'))
+    if storage.type not in SNAPSHOT_STORAGE_TYPES:
+        raise ValueError(gettext(
+            'Snapshots must be stored in HDFS or local storages.'))
+
+
+def materialize(data_source, storage, ttl=None):
+    """
+    Executes the data source command and stores the result as a new
+    snapshot in storage. The previous snapshot is replaced only after the
+    new one is complete. Progress (rows and files written) is reported to
+    the current execution, if any, and cancellation is checked per batch.
+    """
+    validate(data_source, storage)
+
+    now = datetime.datetime.utcnow()
+    url = '{}/{}/{}/{}'.format(storage.url.rstrip('/'), SNAPSHOT_DIR,
+                               data_source.id, now.strftime('%Y%m%d%H%M%S%f'))
+    filesystem, path = _get_filesystem(url, storage)
+    filesystem.create_dir(path)
+    try:
+        _write_snapshot(data_source, filesystem, path)
+    except BaseException:
+        _delete_snapshot(url, storage)
+        raise
+
+    previous = (data_source.snapshot_url, data_source.snapshot_storage)
+    data_source.snapshot_url = url
+    data_source.snapshot_storage = storage
+    data_source.snapshot_updated = now
+    if ttl is not None:
+        data_source.snapshot_ttl = ttl or None
+    db.session.commit()
+
+    if previous[0] and previous[0] != url:
+        _delete_snapshot(*previous)
+    return url
+
+
+def remove_snapshot(data_source):
+    if data_source.snapshot_url:
+        _delete_snapshot(data_source.snapshot_url,
+                         data_source.snapshot_storage)
+    data_source.snapshot_url = None
+    data_source.snapshot_updated = None
+    data_source.snapshot_storage = None
+    db.session.commit()
+
+
+def _open_snapshot(data_source):
+    filesystem, path = _get_filesystem(data_source.snapshot_url,
+                                       data_source.snapshot_storage)
+    return pa_dataset.dataset(path, filesystem=filesystem, format='parquet')
+
+
+def sample_snapshot(data_source, limit):
+    """ First rows of the snapshot, as dicts """
+    return _open_snapshot(data_source).head(limit).to_pylist()
+
+
+def snapshot_batches(data_source):
+    """ Same protocol as export.database_batches(): schema, then batches """
+    dataset = _open_snapshot(data_source)
+    yield dataset.schema
+    yield from dataset.to_batches(batch_size=READ_BATCH_SIZE)
+
+
+def refresh_expired_snapshots(data_sources):
+    """ Materializes again the snapshots older than their TTL """
+    refreshed = 0
+    for data_source in data_sources:
+        if (data_source.snapshot_url and data_source.snapshot_ttl and
+                not is_snapshot_fresh(data_source)):
+            try:
+                materialize(data_source, data_source.snapshot_storage)
+                refreshed += 1
+            except Exception:
+                db.session.rollback()
+                log.exception(gettext('Could not refresh snapshot of data '
+                                      'source %s'), data_source.id)
+    return refreshed
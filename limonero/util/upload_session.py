@@ -0,0 +1,296 @@
+# -*- coding: utf-8 -*-
+"""
+Sessions of chunked (resumable.js) uploads. Chunks may arrive in any order
+and in parallel: each chunk is stored in a temporary directory and recorded
+in the database, and the session is claimed for merging with a single
+conditional UPDATE, so exactly one request merges the file, only after all
+chunks are stored.
+
+Checksums (SHA-256) are computed while chunks are streamed, verified when
+they are merged, and the checksum of the whole file is kept in the data
+source. Optionally (config upload.deduplicate), a file with the same content
+as one already stored in the storage is not kept, and the new data source
+uses the existing file.
+
+Chunks already received are read from the database in a single query and
+cached, because resumable.js tests each chunk before sending it (a resumed
+upload with thousands of chunks would mean thousands of queries).
+"""
+import datetime
+import hashlib
+import logging
+import uuid
+from urllib.parse import urlparse
+
+from flask import current_app, has_app_context
+from pyarrow import fs
+from flask_babel import gettext
+from sqlalchemy.exc import IntegrityError
+
+import limonero.hdfs_util as hu
+from limonero.cache import cache
+from limonero.models import (DataSource, UploadChunk, UploadSession,
+                             UploadStatus, db)
+
+log = logging.getLogger(__name__)
+
+UPLOAD_DIR = 'tmp/upload'
+CHUNK_PREFIX = 'chunk'
+
+# Seconds the list of chunks received is cached. It is updated when a chunk
+# is recorded, but other processes may have an older list (the chunk is then
+# sent again, and ignored).
+RECEIVED_CACHE_TIMEOUT = 60
+
+# Maximum size (bytes) of a chunk, overridden by config (upload.max_chunk_size)
+DEFAULT_MAX_CHUNK_SIZE = 128 * 1024 ** 2
+
+CHECKSUM_ALGORITHM = 'sha256'
+
+
+class ChunkTooLarge(ValueError):
+    """ Chunk is larger than the maximum allowed """
+
+
+class ChecksumMismatch(ValueError):
+    """ Content of a chunk changed after it was received """
+
+
+def _get_config():
+    if has_app_context():
+        config = current_app.config.get('LIMONERO_CONFIG') or {}
+        return config.get('upload') or {}
+    return {}
+
+
+def get_max_chunk_size():
+    return _get_config().get('max_chunk_size', DEFAULT_MAX_CHUNK_SIZE)
+
+
+def use_deduplication():
+    return bool(_get_config().get('deduplicate', False))
+
+
+def get_filesystem(storage):
+    """ File system (HDFS or local) of the storage and its parsed URL """
+    parsed = urlparse(storage.url.rstrip('/'))
+    return hu.get_filesystem(parsed, storage.extra_params), parsed
+
+
+def get_session(storage, user_id, identifier):
+    return UploadSession.query.filter(
+        UploadSession.storage_id == storage.id,
+        UploadSession.user_id == user_id,
+        UploadSession.identifier == identifier).first()
+
+
+def open_session(storage, user_id, identifier, filename, total_chunks,
+                 total_size=None):
+    """ Returns the session of the upload, creating it if needed """
+    session = get_session(storage, user_id, identifier)
+    if session is not None:
+        if session.total_chunks != total_chunks:
+            raise ValueError(gettext(
+                'Upload %(id)s was started with a different number of '
+                'chunks.', id=identifier))
+        return session
+    try:
+        session = UploadSession(
+            storage_id=storage.id, user_id=user_id, identifier=identifier,
+            filename=filename, total_chunks=total_chunks,
+            total_size=total_size, received_chunks=0,
+            status=UploadStatus.OPEN)
+        db.session.add(session)
+        db.session.commit()
+        return session
+    except IntegrityError:
+        # Created by a parallel request (another chunk)
+        db.session.rollback()
+        return get_session(storage, user_id, identifier)
+
+
+def get_chunk_dir(parsed, session):
+    return '{}/{}/{}'.format(parsed.path.rstrip('/'), UPLOAD_DIR, session.id)
+
+
+def get_chunk_path(parsed, session, number):
+    return '{}/{}.part{:09d}'.format(get_chunk_dir(parsed, session),
+                                     CHUNK_PREFIX, number)
+
+
+def write_chunk(filesystem, parsed, session, number, source, max_size=None):
+    """
+    Streams source (file-like object, e.g. the body of the request) into the
+    file of the chunk, in blocks of hu.BUFFER_SIZE, computing its checksum.
+    The chunk is written to a temporary file and then renamed, so a chunk
+    sent again (or too large) does not corrupt the one already received.
+    Returns the size and checksum (hex) of the chunk.
+    """
+    chunk_dir = get_chunk_dir(parsed, session)
+    filesystem.create_dir(chunk_dir)
+    path = get_chunk_path(parsed, session, number)
+    tmp_path = '{}/.{}.{}'.format(chunk_dir, path.rsplit('/', 1)[1],
+                                  uuid.uuid4().hex)
+
+    digest = hashlib.new(CHECKSUM_ALGORITHM)
+    size = 0
+    try:
+        with filesystem.open_output_stream(tmp_path) as stream:
+            while True:
+                block = source.read(hu.BUFFER_SIZE)
+                if not block:
+                    break
+                size += len(block)
+                if max_size is not None and size > max_size:
+                    raise ChunkTooLarge(gettext(
+                        'Chunk is larger than %(max)s bytes.', max=max_size))
+                digest.update(block)
+                stream.write(block)
+        filesystem.move(tmp_path, path)
+    except Exception:
+        try:
+            filesystem.delete_file(tmp_path)
+        except (FileNotFoundError, OSError):
+            pass
+        raise
+    return size, digest.hexdigest()
+
+
+def _received_key(session):
+    return 'upload:{}:received'.format(session.id)
+
+
+def get_received_chunks(session):
+    """ Numbers of the chunks received (frozenset) """
+    key = _received_key(session)
+    received = cache.get(key)
+    if received is None:
+        received = frozenset(number for (number,) in db.session.query(
+            UploadChunk.number).filter(UploadChunk.session_id == session.id))
+        cache.set(key, received, timeout=RECEIVED_CACHE_TIMEOUT)
+    return received
+
+
+def get_bitmap(session):
+    """
+    Chunks received, as a string with one character per chunk ('1' if the
+    chunk was received, '0' otherwise), first chunk at position 0.
+    """
+    received = get_received_chunks(session)
+    return ''.join('1' if number in received else '0'
+                   for number in range(1, session.total_chunks + 1))
+
+
+def record_chunk(session, number, size, checksum=None):
+    """
+    Records that a chunk was stored. Returns False if it was already
+    received (chunk was sent again and its file, replaced).
+    """
+    try:
+        db.session.add(UploadChunk(session_id=session.id, number=number,
+                                   size=size, checksum=checksum))
+        db.session.flush()
+    except IntegrityError:
+        db.session.rollback()
+        return False
+    # Incremented in database, parallel requests may be recording chunks
+    UploadSession.query.filter(UploadSession.id == session.id).update(
+        {UploadSession.received_chunks: UploadSession.received_chunks + 1,
+         UploadSession.updated: datetime.datetime.utcnow()},
+        synchronize_session=False)
+    db.session.commit()
+    cache.delete(_received_key(session))
+    return True
+
+
+def claim_merge(session):
+    """
+    Returns True if all chunks were received and the caller is the one
+    responsible for merging them. The check and change of status are done
+    in a single statement, so only one request gets True.
+    """
+    claimed = UploadSession.query.filter(
+        UploadSession.id == session.id,
+        UploadSession.status == UploadStatus.OPEN,
+        UploadSession.received_chunks >= UploadSession.total_chunks).update(
+        {UploadSession.status: UploadStatus.MERGING},
+        synchronize_session=False)
+    db.session.commit()
+    return claimed == 1
+
+
+def merge(filesystem, parsed, session, target_path):
+    """
+    Merges the chunks, in order, into target_path, verifying them against
+    the checksums recorded when they were received (ChecksumMismatch).
+    Returns the checksum (hex) of the merged file.
+    """
+    filesystem.create_dir(target_path.rsplit('/', 1)[0])
+    checksums = dict(db.session.query(
+        UploadChunk.number, UploadChunk.checksum).filter(
+        UploadChunk.session_id == session.id))
+
+    file_digest = hashlib.new(CHECKSUM_ALGORITHM)
+    try:
+        with filesystem.open_output_stream(target_path,
+                                           compression=None) as stream:
+            for number in range(1, session.total_chunks + 1):
+                chunk_digest = hashlib.new(CHECKSUM_ALGORITHM)
+                with filesystem.open_input_stream(
+                        get_chunk_path(parsed, session, number)) as chunk:
+                    hu.copy_stream(chunk, stream,
+                                   digests=(chunk_digest, file_digest))
+                expected = checksums.get(number)
+                if expected and chunk_digest.hexdigest() != expected:
+                    raise ChecksumMismatch(gettext(
+                        'Chunk %(number)s of upload %(id)s is corrupted.',
+                        number=number, id=session.identifier))
+    except Exception:
+        try:
+            filesystem.delete_file(target_path)
+        except (FileNotFoundError, OSError):
+            pass
+        raise
+    return file_digest.hexdigest()
+
+
+def find_duplicate(filesystem, storage, checksum, path):
+    """
+    URL of a file in the storage with the same content (checksum and size)
+    of the one in path, or None.
+    """
+    size = filesystem.get_file_info(path).size
+    candidates = DataSource.query.filter(
+        DataSource.storage_id == storage.id,
+        DataSource.checksum == checksum).order_by(DataSource.id)
+    for data_source in candidates:
+        existing = urlparse(data_source.url).path
+        if existing == path:
+            continue
+        info = filesystem.get_file_info(existing)
+        if info.type == fs.FileType.File and info.size == size:
+            return data_source.url
+    return None
+
+
+def close_session(filesystem, parsed, session):
+    """ Removes the session and its temporary files """
+    try:
+        filesystem.delete_dir(get_chunk_dir(parsed, session))
+    except (FileNotFoundError, OSError):
+        log.warning(gettext('Could not remove chunks of upload %s'),
+                    session.id, exc_info=True)
+    cache.delete(_received_key(session))
+    db.session.delete(session)
+    db.session.commit()
+
+
+def purge_sessions(max_age):
+    """ Removes sessions not updated in max_age seconds (abandoned) """
+    limit = datetime.datetime.utcnow() - datetime.timedelta(seconds=max_age)
+    sessions = UploadSession.query.filter(
+        UploadSession.updated < limit).all()
+    for session in sessions:
+        filesystem, parsed = get_filesystem(session.storage)
+        close_session(filesystem, parsed, session)
+    return len(sessions)
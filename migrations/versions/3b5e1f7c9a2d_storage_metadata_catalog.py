@@ -0,0 +1,41 @@
+"""Storage metadata catalog
+
+Revision ID: 3b5e1f7c9a2d
+Revises: 88672039047e
+Create Date: 2026-10-19 10:12:31.402118
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3b5e1f7c9a2d'
+down_revision = '88672039047e'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('storage', sa.Column('catalog_updated', sa.DateTime(),
+                                       nullable=True))
+    op.create_table('storage_catalog_table',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('name', sa.String(length=250), nullable=False),
+    sa.Column('type', sa.Enum('TABLE', 'VIEW', name='CatalogTableTypeEnumType'), nullable=False),
+    sa.Column('columns', sa.Text(length=4294000000), nullable=True),
+    sa.Column('columns_updated', sa.DateTime(), nullable=True),
+    sa.Column('updated', sa.DateTime(), nullable=False),
+    sa.Column('storage_id', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['storage_id'], ['storage.id'], name='fk_storage_catalog_table_storage_id'),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('storage_id', 'name', name='uq_storage_catalog_table_name')
+    )
+    op.create_index(op.f('ix_storage_catalog_table_storage_id'), 'storage_catalog_table', ['storage_id'], unique=False)
+
+
+def downgrade():
+    op.drop_index(op.f('ix_storage_catalog_table_storage_id'), table_name='storage_catalog_table')
+    op.drop_table('storage_catalog_table')
+    with op.batch_alter_table('storage') as batch_op:
+        batch_op.drop_column('catalog_updated')
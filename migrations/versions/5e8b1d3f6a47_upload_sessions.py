@@ -0,0 +1,54 @@
+"""Upload sessions
+
+Revision ID: 5e8b1d3f6a47
+Revises: 7d2c4a9e0b15
+Create Date: 2026-10-19 14:05:47.552810
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5e8b1d3f6a47'
+down_revision = '7d2c4a9e0b15'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('upload_session',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('identifier', sa.String(length=250), nullable=False),
+    sa.Column('filename', sa.String(length=500), nullable=False),
+    sa.Column('total_chunks', sa.Integer(), nullable=False),
+    sa.Column('total_size', sa.BigInteger(), nullable=True),
+    sa.Column('received_chunks', sa.Integer(), nullable=False),
+    sa.Column('status', sa.Enum('OPEN', 'MERGING', name='UploadStatusEnumType'), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('created', sa.DateTime(), nullable=False),
+    sa.Column('updated', sa.DateTime(), nullable=False),
+    sa.Column('storage_id', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['storage_id'], ['storage.id'], name='fk_upload_session_storage_id'),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('storage_id', 'user_id', 'identifier', name='uq_upload_session_identifier')
+    )
+    op.create_index(op.f('ix_upload_session_storage_id'), 'upload_session', ['storage_id'], unique=False)
+    op.create_table('upload_chunk',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('number', sa.Integer(), nullable=False),
+    sa.Column('size', sa.BigInteger(), nullable=False),
+    sa.Column('created', sa.DateTime(), nullable=False),
+    sa.Column('session_id', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['session_id'], ['upload_session.id'], name='fk_upload_chunk_session_id'),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('session_id', 'number', name='uq_upload_chunk_number')
+    )
+    op.create_index(op.f('ix_upload_chunk_session_id'), 'upload_chunk', ['session_id'], unique=False)
+
+
+def downgrade():
+    op.drop_index(op.f('ix_upload_chunk_session_id'), table_name='upload_chunk')
+    op.drop_table('upload_chunk')
+    op.drop_index(op.f('ix_upload_session_storage_id'), table_name='upload_session')
+    op.drop_table('upload_session')
@@ -0,0 +1,34 @@
+"""Data source snapshots
+
+Revision ID: 7d2c4a9e0b15
+Revises: 3b5e1f7c9a2d
+Create Date: 2026-10-19 11:40:05.118273
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7d2c4a9e0b15'
+down_revision = '3b5e1f7c9a2d'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('data_source') as batch_op:
+        batch_op.add_column(sa.Column('snapshot_url', sa.String(length=1000), nullable=True))
+        batch_op.add_column(sa.Column('snapshot_updated', sa.DateTime(), nullable=True))
+        batch_op.add_column(sa.Column('snapshot_ttl', sa.Integer(), nullable=True))
+        batch_op.add_column(sa.Column('snapshot_storage_id', sa.Integer(), nullable=True))
+        batch_op.create_foreign_key('fk_data_source_snapshot_storage_id', 'storage', ['snapshot_storage_id'], ['id'])
+
+
+def downgrade():
+    with op.batch_alter_table('data_source') as batch_op:
+        batch_op.drop_constraint('fk_data_source_snapshot_storage_id', type_='foreignkey')
+        batch_op.drop_column('snapshot_storage_id')
+        batch_op.drop_column('snapshot_ttl')
+        batch_op.drop_column('snapshot_updated')
+        batch_op.drop_column('snapshot_url')
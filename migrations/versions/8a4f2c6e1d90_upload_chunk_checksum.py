@@ -0,0 +1,35 @@
+"""Checksum of upload chunks
+
+Revision ID: 8a4f2c6e1d90
+Revises: 5e8b1d3f6a47
+Create Date: 2026-10-19 16:21:09.104337
+
+"""
+import sqlalchemy as sa
+from alembic import op
+from limonero.migration_utils import is_sqlite
+
+# revision identifiers, used by Alembic.
+revision = '8a4f2c6e1d90'
+down_revision = '5e8b1d3f6a47'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    if is_sqlite():
+        with op.batch_alter_table('upload_chunk') as batch_op:
+            batch_op.add_column(
+                sa.Column('checksum', sa.String(length=100), nullable=True))
+    else:
+        op.add_column('upload_chunk',
+                      sa.Column('checksum', sa.String(length=100),
+                                nullable=True))
+
+
+def downgrade():
+    if is_sqlite():
+        with op.batch_alter_table('upload_chunk') as batch_op:
+            batch_op.drop_column('checksum')
+    else:
+        op.drop_column('upload_chunk', 'checksum')
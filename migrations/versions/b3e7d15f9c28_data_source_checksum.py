@@ -0,0 +1,28 @@
+"""Checksum of data source files
+
+Revision ID: b3e7d15f9c28
+Revises: 8a4f2c6e1d90
+Create Date: 2026-10-19 17:02:44.681920
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b3e7d15f9c28'
+down_revision = '8a4f2c6e1d90'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('data_source') as batch_op:
+        batch_op.add_column(sa.Column('checksum', sa.String(length=100), nullable=True))
+        batch_op.create_index('ix_data_source_checksum', ['checksum'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('data_source') as batch_op:
+        batch_op.drop_index('ix_data_source_checksum')
+        batch_op.drop_column('checksum')
@@ -0,0 +1,26 @@
+"""Original file of converted data sources
+
+Revision ID: c9d2a6b4e813
+Revises: b3e7d15f9c28
+Create Date: 2026-10-19 18:37:52.240615
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c9d2a6b4e813'
+down_revision = 'b3e7d15f9c28'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('data_source') as batch_op:
+        batch_op.add_column(sa.Column('original_url', sa.String(length=1000), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('data_source') as batch_op:
+        batch_op.drop_column('original_url')
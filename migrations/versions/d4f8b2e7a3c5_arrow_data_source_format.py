@@ -0,0 +1,56 @@
+"""Arrow data source format
+
+Revision ID: d4f8b2e7a3c5
+Revises: c9d2a6b4e813
+Create Date: 2026-10-19 19:48:13.502177
+
+"""
+from alembic import op
+from sqlalchemy.sql import text
+from limonero.migration_utils import (upgrade_actions, downgrade_actions,
+        get_psql_enum_alter_commands, is_mysql, is_psql)
+
+# revision identifiers, used by Alembic.
+revision = 'd4f8b2e7a3c5'
+down_revision = 'c9d2a6b4e813'
+branch_labels = None
+depends_on = None
+
+new_ds_values = ['ARROW', 'CSV', 'CUSTOM', 'GEO_JSON', 'HAR_IMAGE_FOLDER',
+        'HDF5', 'HIVE', 'DATA_FOLDER', 'IMAGE_FOLDER', 'JDBC', 'JSON',
+        'NETCDF4', 'NPY', 'PARQUET', 'PICKLE', 'SAV', 'SHAPEFILE',
+        'TAR_IMAGE_FOLDER', 'TEXT', 'VIDEO_FOLDER', 'UNKNOWN', 'XML_FILE']
+old_ds_values = ['CSV', 'CUSTOM', 'GEO_JSON', 'HAR_IMAGE_FOLDER', 'HDF5',
+        'DATA_FOLDER', 'IMAGE_FOLDER', 'JDBC', 'JSON', 'NETCDF4', 'NPY',
+        'PARQUET', 'PICKLE', 'SAV', 'SHAPEFILE', 'TAR_IMAGE_FOLDER', 'TEXT',
+        'VIDEO_FOLDER', 'UNKNOWN', 'XML_FILE']
+
+
+def _mysql_command(values):
+    formatted_values = ', '.join(f"'{v}'" for v in values)
+    return text(f"""
+        ALTER TABLE data_source
+        CHANGE COLUMN `format` `format` ENUM({formatted_values})
+            CHARACTER SET 'utf8' NOT NULL ;""")
+
+
+def upgrade():
+    if is_mysql():
+        op.get_bind().execute(_mysql_command(new_ds_values))
+    elif is_psql():
+        upgrade_actions([[
+            get_psql_enum_alter_commands(['data_source'], ['format'],
+                'DataSourceFormatEnumType', new_ds_values, 'CSV'),
+            None
+        ]])
+
+
+def downgrade():
+    if is_mysql():
+        op.get_bind().execute(_mysql_command(old_ds_values))
+    elif is_psql():
+        downgrade_actions([[
+            None,
+            get_psql_enum_alter_commands(['data_source'], ['format'],
+                'DataSourceFormatEnumType', old_ds_values, 'CSV'),
+        ]])
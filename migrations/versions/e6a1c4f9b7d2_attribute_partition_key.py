@@ -0,0 +1,35 @@
+"""Attributes that are partition keys of directory data sources
+
+Revision ID: e6a1c4f9b7d2
+Revises: d4f8b2e7a3c5
+Create Date: 2026-10-19 21:04:17.518203
+
+"""
+import sqlalchemy as sa
+from alembic import op
+from limonero.migration_utils import is_sqlite
+
+# revision identifiers, used by Alembic.
+revision = 'e6a1c4f9b7d2'
+down_revision = 'd4f8b2e7a3c5'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    if is_sqlite():
+        with op.batch_alter_table('attribute') as batch_op:
+            batch_op.add_column(sa.Column('partition_key', sa.Boolean(),
+                                          nullable=False, server_default='0'))
+    else:
+        op.add_column('attribute',
+                      sa.Column('partition_key', sa.Boolean(), nullable=False,
+                                server_default='0'))
+
+
+def downgrade():
+    if is_sqlite():
+        with op.batch_alter_table('attribute') as batch_op:
+            batch_op.drop_column('partition_key')
+    else:
+        op.drop_column('attribute', 'partition_key')
@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+"""
+Micro-benchmarks for the serialization of API responses.
+Compares the standard library (CustomJSONEncoder) and the fast encoder, as
+well as building schemas per request versus reusing cached instances.
+
+Run with:
+    python -m tests.benchmark_serialization [repetitions]
+"""
+import datetime
+import decimal
+import json
+import sys
+import timeit
+
+from cryptography.fernet import Fernet
+from flask import Flask
+
+from limonero import CustomJSONEncoder
+from limonero.models import (Attribute, DataSource, DataSourceFormat,
+                             DataType, Storage, StorageType)
+from limonero.schema import (DataSourceItemResponseSchema,
+                             DataSourceListResponseSchema, get_schema)
+from limonero.util.serialization import dumps
+
+TYPES = [DataType.INTEGER, DataType.CHARACTER, DataType.DECIMAL,
+         DataType.DATETIME, DataType.DOUBLE]
+
+
+def _storage():
+    return Storage(id=1, name='HDFS', type=StorageType.HDFS, enabled=True,
+                   url='hdfs://namenode:9000')
+
+
+def _data_source(i, attributes):
+    now = datetime.datetime.utcnow()
+    ds = DataSource(
+        id=i, name=f'Data source {i}', description='Benchmark',
+        enabled=True, statistics_process_counter=0, read_only=False,
+        privacy_aware=False, url=f'hdfs://namenode:9000/data/{i}.csv',
+        created=now, updated=now, format=DataSourceFormat.CSV,
+        estimated_rows=1000, estimated_size_in_mega_bytes=decimal.Decimal(
+            '12.34'),
+        user_id=1, user_login='admin', user_name='Admin', temporary=False,
+        attribute_delimiter=',', is_public=True, is_first_line_header=True,
+        is_multiline=False, is_lookup=False, use_in_workflow=False,
+        storage=_storage())
+    ds.attributes = [
+        Attribute(id=i * 10000 + j, name=f'attr{j}', type=TYPES[j % 5],
+                  size=50, precision=10, scale=2, nullable=True,
+                  enumeration=False, feature=False, label=False, key=False)
+        for j in range(attributes)]
+    return ds
+
+
+def _sample(rows):
+    now = datetime.datetime.utcnow()
+    return {'status': 'OK', 'data': [
+        {'id': i, 'name': f'Name {i}', 'salary': decimal.Decimal('1234.56'),
+         'ratio': i / 7.0, 'created': now, 'active': i % 2 == 0}
+        for i in range(rows)]}
+
+
+def _stdlib_dumps(data):
+    return json.dumps(data, cls=CustomJSONEncoder).encode('utf8')
+
+
+def _report(name, stmt, number):
+    elapsed = timeit.timeit(stmt, number=number)
+    print(f'{name:<52} {1000.0 * elapsed / number:10.3f} ms')
+
+
+def main(number):
+    app = Flask(__name__)
+    app.fernet = Fernet(Fernet.generate_key())
+
+    with app.app_context():
+        page = [_data_source(i, 20) for i in range(20)]
+        detail = _data_source(1, 2000)
+        sample = _sample(1000)
+
+        def list_per_request():
+            return DataSourceListResponseSchema(
+                many=True, exclude=('permissions',)).dump(page)
+
+        def list_cached():
+            return get_schema(DataSourceListResponseSchema, many=True,
+                              exclude=('permissions',)).dump(page)
+
+        def detail_per_request():
+            return DataSourceItemResponseSchema().dump(detail)
+
+        def detail_cached():
+            return get_schema(DataSourceItemResponseSchema).dump(detail)
+
+        list_payload = {'data': list_cached()}
+        detail_payload = detail_cached()
+
+        print(f'Repetitions: {number}')
+        _report('List page (20): schema per request', list_per_request,
+                number)
+        _report('List page (20): cached schema', list_cached, number)
+        _report('Detail (2k attributes): schema per request',
+                detail_per_request, number)
+        _report('Detail (2k attributes): cached schema', detail_cached,
+                number)
+        for name, payload in [('List page (20)', list_payload),
+                              ('Detail (2k attributes)', detail_payload),
+                              ('Sample (1000 rows)', sample)]:
+            assert json.loads(_stdlib_dumps(payload)) == json.loads(
+                dumps(payload)), name
+            _report(f'{name}: json + CustomJSONEncoder',
+                    lambda: _stdlib_dumps(payload), number)
+            _report(f'{name}: fast encoder', lambda: dumps(payload), number)
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 20)
@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+from types import SimpleNamespace
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pytest
+
+from limonero.models import DataSourceFormat
+from limonero.util.compaction import compact, needs_compaction
+
+
+@pytest.fixture
+def data_source(tmp_path):
+    path = tmp_path / 'events'
+    path.mkdir()
+    for part in range(20):
+        pq.write_table(pa.table({
+            'id': list(range(part, 2000, 20)),
+            'name': [f'Name {part}'] * 100}),
+            str(path / f'part-{part:05}.parquet'))
+    (path / '_SUCCESS').write_text('')
+    return SimpleNamespace(format=DataSourceFormat.PARQUET,
+                           url=f'file://{path}',
+                           storage=SimpleNamespace(extra_params=None))
+
+
+def test_compact_sorted(app, data_source, tmp_path):
+    assert needs_compaction(data_source, min_files=20)
+    assert not needs_compaction(data_source, min_files=21)
+
+    with app.app_context():
+        result = compact(data_source, sort_by='id', target_file_bytes=8000)
+
+    path = tmp_path / 'events'
+    files = sorted(f.name for f in path.iterdir())
+    assert result['files_before'] == 20
+    assert result['files_after'] == len(files) > 1
+    assert result['rows'] == data_source.estimated_rows == 2000
+    assert [f.name for f in tmp_path.iterdir()] == ['events']
+
+    first = pq.read_table(str(path / files[0])).column('id').to_pylist()
+    assert first == sorted(first)
+    table = pq.read_table(str(path))
+    assert sorted(table.column('id').to_pylist()) == list(range(2000))
+
+
+def test_compact_invalid_attribute_fail(app, data_source, tmp_path):
+    with app.test_request_context():
+        with pytest.raises(ValueError, match='not found'):
+            compact(data_source, sort_by='missing')
+    assert len(list((tmp_path / 'events').iterdir())) == 21
@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+import bz2
+import gzip
+import io
+import lzma
+import struct
+import zipfile
+import zlib
+
+import pyarrow as pa
+import pytest
+from pyarrow import fs
+
+from limonero.util import compression
+
+CONTENT = b''.join(b'%d,name %d\n' % (i, i) for i in range(5000))
+
+
+def _zip(data):
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w') as archive:
+        archive.writestr('__MACOSX/._data.csv', b'ignored')
+        archive.writestr('data.csv', data)
+    return buffer.getvalue()
+
+
+COMPRESSORS = {
+    compression.GZIP: gzip.compress,
+    compression.BZ2: bz2.compress,
+    compression.ZSTD: lambda data: pa.compress(data, codec='zstd',
+                                               asbytes=True),
+    compression.LZ4: lambda data: pa.compress(data, codec='lz4',
+                                              asbytes=True),
+    compression.XZ: lzma.compress,
+    compression.ZIP: _zip,
+}
+
+
+def _bgzf(data, block_size=4096):
+    """ BGZF (as bgzip): gzip members with the size of the block """
+    blocks = []
+    for start in range(0, len(data), block_size):
+        chunk = data[start:start + block_size]
+        compressor = zlib.compressobj(wbits=-15)
+        deflated = compressor.compress(chunk) + compressor.flush()
+        header = (b'\x1f\x8b\x08\x04\x00\x00\x00\x00\x00\xff'
+                  b'\x06\x00BC\x02\x00')
+        size = len(header) + 2 + len(deflated) + 8
+        blocks.append(header + struct.pack('<H', size - 1) + deflated +
+                      struct.pack('<II', zlib.crc32(chunk), len(chunk)))
+    # End of file marker: empty block
+    return b''.join(blocks) + bytes.fromhex(
+        '1f8b08040000000000ff0600424302001b0003000000000000000000')
+
+
+def _seekable_zstd(data, frame_size=4096):
+    """ Seekable zstd: independent frames and the seek table at the end """
+    frames = [pa.compress(data[start:start + frame_size], codec='zstd',
+                          asbytes=True)
+              for start in range(0, len(data), frame_size)]
+    entries = b''.join(
+        struct.pack('<II', len(frame), min(frame_size, len(data) - i *
+                                            frame_size))
+        for i, frame in enumerate(frames))
+    table = entries + struct.pack('<IBI', len(frames), 0, 0x8F92EAB1)
+    return b''.join(frames) + struct.pack('<II', 0x184D2A5E,
+                                          len(table)) + table
+
+
+@pytest.mark.parametrize('codec', sorted(COMPRESSORS))
+def test_open_input_detects_codec(tmp_path, codec):
+    # Extension does not tell the codec
+    path = tmp_path / 'data.csv'
+    path.write_bytes(COMPRESSORS[codec](CONTENT))
+
+    local = fs.LocalFileSystem()
+    assert compression.detect_file(local, str(path)) == codec
+    with compression.open_input(local, str(path)) as f:
+        assert f.readline() == b'0,name 0\n'
+        assert f.read() == CONTENT[len(b'0,name 0\n'):]
+
+
+@pytest.mark.parametrize('content', [b'', b'BZh,count\n1,2\n'])
+def test_detect_bz2(tmp_path, content):
+    path = tmp_path / 'data.csv'
+    path.write_bytes(bz2.compress(content))
+    local = fs.LocalFileSystem()
+    assert compression.detect_file(local, str(path)) == compression.BZ2
+
+    # Text starting as bz2 is not compressed
+    path.write_bytes(content)
+    assert compression.detect_file(local, str(path)) is None
+    with compression.open_input(local, str(path)) as f:
+        assert f.read() == content
+
+
+def test_open_input_not_compressed(tmp_path):
+    path = tmp_path / 'data.csv.gz'
+    path.write_bytes(CONTENT)
+
+    local = fs.LocalFileSystem()
+    assert compression.detect_file(local, str(path)) is None
+    with compression.open_input(local, str(path)) as f:
+        assert f.read() == CONTENT
+
+
+@pytest.mark.parametrize('max_workers', [1, 3])
+def test_open_input_bgzf(tmp_path, max_workers):
+    path = tmp_path / 'data.csv.gz'
+    path.write_bytes(_bgzf(CONTENT))
+    assert gzip.decompress(path.read_bytes()) == CONTENT
+
+    with compression.open_input(fs.LocalFileSystem(), str(path),
+                                max_workers) as f:
+        # Blocks decompressed in parallel
+        assert isinstance(f.raw, compression._ChunkReader) == (
+            max_workers > 1)
+        assert f.read() == CONTENT
+
+
+def test_open_input_seekable_zstd(tmp_path):
+    path = tmp_path / 'data.csv.zst'
+    path.write_bytes(_seekable_zstd(CONTENT))
+
+    local = fs.LocalFileSystem()
+    with local.open_input_file(str(path)) as f:
+        seek_table = compression._zstd_seek_table(f)
+    assert len(seek_table) == len(CONTENT) // 4096 + 1
+    assert sum(size for _, size in seek_table) == len(CONTENT)
+
+    with compression.open_input(local, str(path)) as f:
+        assert isinstance(f.raw, compression._ChunkReader)
+        assert f.read(10) == CONTENT[:10]
+        assert f.read() == CONTENT[10:]
+
+
+def test_names_with_extension():
+    assert compression.strip_extension('people.csv.GZ') == 'people.csv'
+    assert compression.strip_extension('people.csv') == 'people.csv'
+    assert compression.with_extension('people.csv',
+                                      compression.ZSTD) == 'people.csv.zst'
+    assert compression.with_extension('people.csv.bz2',
+                                      compression.BZ2) == 'people.csv.bz2'
+    assert compression.with_extension('people.csv', None) == 'people.csv'
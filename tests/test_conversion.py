@@ -0,0 +1,169 @@
+# -*- coding: utf-8 -*-
+import time
+import uuid
+from types import SimpleNamespace
+from urllib.parse import urlparse
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pytest
+from pyarrow import fs
+
+from limonero.models import (DataSource, DataSourceFormat, DataType, Storage,
+                             db)
+from limonero.util.conversion import PARQUET_PART, convert, csv_to_parquet
+
+
+def _attribute(name, data_type, precision=None, scale=None):
+    return SimpleNamespace(name=name, type=data_type, precision=precision,
+                           scale=scale)
+
+
+def _data_source(**kwargs):
+    params = dict(format=DataSourceFormat.CSV, attribute_delimiter=';',
+                  treat_as_missing='NA', is_first_line_header=True,
+                  encoding=None, text_delimiter=None, is_multiline=False,
+                  attributes=[_attribute('id', DataType.INTEGER),
+                              _attribute('name', DataType.CHARACTER),
+                              _attribute('salary', DataType.DECIMAL, 10, 2)])
+    params.update(kwargs)
+    return SimpleNamespace(**params)
+
+
+def test_csv_to_parquet_row_groups(tmp_path):
+    source = tmp_path / 'people.csv'
+    source.write_text('id;name;salary\n' + ''.join(
+        f'{i};Name {i};{"NA" if i % 10 == 0 else i * 1.5}\n'
+        for i in range(1000)))
+    target = str(tmp_path / 'people.parquet')
+
+    rows = csv_to_parquet(_data_source(), fs.LocalFileSystem(), str(source),
+                          target, row_group_bytes=1)
+    assert rows == 1000
+
+    parquet = pq.ParquetFile(f'{target}/{PARQUET_PART}')
+    assert parquet.metadata.num_rows == 1000
+    assert parquet.schema_arrow.field('salary').type == pa.decimal128(10, 2)
+    table = parquet.read()
+    assert table.column('salary')[10].as_py() is None
+    assert table.column('name')[999].as_py() == 'Name 999'
+
+
+def test_csv_to_parquet_invalid_value_fail(tmp_path):
+    source = tmp_path / 'people.csv'
+    source.write_text('id;name;salary\n1;Ana;10.5\nx;Pedro;1\n')
+    target = tmp_path / 'people.parquet'
+    with pytest.raises(pa.ArrowInvalid):
+        csv_to_parquet(_data_source(), fs.LocalFileSystem(), str(source),
+                       str(target))
+    assert not target.exists()
+
+
+def test_upload_converted_to_parquet(app, client):
+    with app.test_request_context():
+        storage_id = Storage.query.filter(
+            Storage.name == 'File Storage').one().id
+    data = b'id,name\n1,Maria\n2,Pedro\n'
+    rv = client.post('/datasources/upload', query_string={
+        'resumableIdentifier': uuid.uuid4().hex,
+        'resumableFilename': 'people.csv',
+        'resumableChunkNumber': 1, 'resumableTotalChunks': 1,
+        'storage_id': storage_id, 'to_parquet': 'true'},
+        data=data, headers={'X-Auth-Token': str(client.secret)})
+    assert 200 == rv.status_code, f'Incorrect status code: {rv.data}'
+    result = rv.json['data']
+    assert result['format'] == DataSourceFormat.PARQUET
+
+    table = pq.read_table(urlparse(result['url']).path)
+    assert table.to_pylist() == [{'id': 1, 'name': 'Maria'},
+                                 {'id': 2, 'name': 'Pedro'}]
+    original = urlparse(result['original_url']).path
+    with open(original, 'rb') as f:
+        assert f.read() == data
+
+    # Original file is downloaded
+    with app.test_request_context():
+        token = app.fernet.encrypt(
+            f'{{"id": {result["id"]}}}'.encode('utf8')).decode('utf8')
+    rv = client.get(f'/datasources/public/{result["id"]}/download',
+                    query_string={'token': token})
+    assert rv.data == data
+
+    with app.test_request_context():
+        db.session.delete(DataSource.query.get(result['id']))
+        db.session.commit()
+    fs.LocalFileSystem().delete_dir(urlparse(result['url']).path)
+    fs.LocalFileSystem().delete_file(original)
+
+
+def test_convert_json_lines_directory_to_arrow(tmp_path):
+    source = tmp_path / 'events'
+    source.mkdir()
+    for part in range(3):
+        (source / f'part-{part}.json').write_text(''.join(
+            f'{{"id": {part * 100 + i}, "name": "Name {i}", "x": 1}}\n'
+            for i in range(100)))
+    (source / '_SUCCESS').write_text('')
+    data_source = _data_source(
+        format=DataSourceFormat.JSON, url=f'file://{source}',
+        attributes=[_attribute('id', DataType.LONG),
+                    _attribute('name', DataType.CHARACTER)])
+    target = tmp_path / 'events.arrow'
+
+    rows = convert(data_source, fs.LocalFileSystem(), fs.LocalFileSystem(),
+                   str(target), 'arrow', max_workers=2)
+    assert rows == 300
+
+    parts = sorted(target.iterdir())
+    assert [p.name for p in parts] == [
+        'part-00000.arrow', 'part-00001.arrow', 'part-00002.arrow']
+    table = pa.ipc.open_file(str(parts[2])).read_all()
+    assert table.schema.names == ['id', 'name']
+    assert table.column('id')[0].as_py() == 200
+
+
+def test_convert_api(app, client):
+    headers = {'X-Auth-Token': str(client.secret)}
+    with app.test_request_context():
+        storage_id = Storage.query.filter(
+            Storage.name == 'File Storage').one().id
+    rv = client.post('/datasources/upload', query_string={
+        'resumableIdentifier': uuid.uuid4().hex,
+        'resumableFilename': 'people.csv',
+        'resumableChunkNumber': 1, 'resumableTotalChunks': 1,
+        'storage_id': storage_id},
+        data=b'id,name\n1,Maria\n2,Pedro\n', headers=headers)
+    source = rv.json['data']
+    assert source['format'] == DataSourceFormat.CSV
+
+    rv = client.post(f'/datasources/{source["id"]}/convert/parquet',
+                     json={'compression': 'zip'}, headers=headers)
+    assert 400 == rv.status_code
+
+    rv = client.post(f'/datasources/{source["id"]}/convert/parquet',
+                     json={'compression': 'zstd'}, headers=headers)
+    assert 202 == rv.status_code, f'Incorrect status code: {rv.data}'
+    location = rv.headers['Location']
+    for _ in range(200):
+        rv = client.get(location, headers=headers)
+        if rv.status_code != 202:
+            break
+        time.sleep(0.01)
+    assert 200 == rv.status_code, f'Incorrect status code: {rv.data}'
+    converted = rv.json['data']
+    assert converted['format'] == DataSourceFormat.PARQUET
+    assert converted['estimated_rows'] == 2
+    assert [a['name'] for a in converted['attributes']] == ['id', 'name']
+
+    path = urlparse(converted['url']).path
+    parquet = pq.ParquetFile(f'{path}/{PARQUET_PART}')
+    assert parquet.metadata.row_group(0).column(0).compression == 'ZSTD'
+    assert parquet.read().to_pylist() == [{'id': 1, 'name': 'Maria'},
+                                          {'id': 2, 'name': 'Pedro'}]
+
+    with app.test_request_context():
+        for data_source in (source, converted):
+            db.session.delete(DataSource.query.get(data_source['id']))
+        db.session.commit()
+    fs.LocalFileSystem().delete_dir(path)
+    fs.LocalFileSystem().delete_file(urlparse(source['url']).path)
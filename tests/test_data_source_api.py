@@ -1,13 +1,19 @@
 import datetime
+import io
 import json
 import os
+import time
+from unittest import mock
 from urllib.parse import urlparse
 
 from flask import url_for
 from flask_babel import gettext
+import pyarrow as pa
+import pyarrow.parquet as pq
 import pytest
 
-from limonero.models import DataSource, DataSourceFormat, db
+from limonero.cache import cache, get_data_source_payload
+from limonero.models import DataSource, DataSourceFormat, Storage, db
 from limonero.schema import generate_download_token
 
 
@@ -375,3 +381,259 @@ def test_data_source_download_success(client, app, datasources):
         #    d = f.read()
         #    assert d == rv.data
 
+
+
+def test_data_source_get_not_modified_success(client, app):
+    headers = {'X-Auth-Token': str(client.secret)}
+    rv = client.get('/datasources/1', headers=headers)
+    assert 200 == rv.status_code, 'Incorrect status code: {}'.format(rv.data)
+    etag = rv.headers.get('ETag')
+    assert etag is not None, 'Missing ETag'
+    assert rv.headers.get('Cache-Control') == 'private, no-cache'
+
+    rv = client.get('/datasources/1',
+                    headers=dict(headers, **{'If-None-Match': etag}))
+    assert 304 == rv.status_code, 'Incorrect status code: {}'.format(rv.data)
+    assert rv.data == b''
+
+    with app.test_request_context():
+        ds = DataSource.query.get(1)
+        ds.updated = datetime.datetime.utcnow() + datetime.timedelta(
+            seconds=1)
+        db.session.commit()
+
+    rv = client.get('/datasources/1',
+                    headers=dict(headers, **{'If-None-Match': etag}))
+    assert 200 == rv.status_code, 'Incorrect status code: {}'.format(rv.data)
+    assert rv.headers.get('ETag') != etag
+
+
+def test_data_source_get_modified_by_storage_success(client, app):
+    headers = {'X-Auth-Token': str(client.secret)}
+    rv = client.get('/datasources/1', headers=headers)
+    etag = rv.headers.get('ETag')
+    storage = rv.json['storage']
+    storage_id = storage['id']
+
+    rv = client.patch(f'/storages/{storage_id}',
+                      json={'name': 'Renamed storage'}, headers=headers)
+    assert 200 == rv.status_code, 'Incorrect status code: {}'.format(rv.data)
+
+    rv = client.get('/datasources/1',
+                    headers=dict(headers, **{'If-None-Match': etag}))
+    assert 200 == rv.status_code, 'Incorrect status code: {}'.format(rv.data)
+    assert rv.json['storage']['name'] == 'Renamed storage'
+    client.patch(f'/storages/{storage_id}', json={'name': storage['name']},
+                 headers=headers)
+
+
+def test_data_source_list_not_modified_success(client):
+    headers = {'X-Auth-Token': str(client.secret)}
+    rv = client.get('/datasources', query_string={'simple': 'true'},
+                    headers=headers)
+    assert 200 == rv.status_code, 'Incorrect status code: {}'.format(rv.data)
+    etag = rv.headers.get('ETag')
+    assert etag.startswith('W/')
+
+    rv = client.get('/datasources', query_string={'simple': 'true'},
+                    headers=dict(headers, **{'If-None-Match': etag}))
+    assert 304 == rv.status_code, 'Incorrect status code: {}'.format(rv.data)
+
+    rv = client.get('/datasources', query_string={'simple': 'false'},
+                    headers=dict(headers, **{'If-None-Match': etag}))
+    assert 200 == rv.status_code, 'Incorrect status code: {}'.format(rv.data)
+
+
+def test_data_source_get_many_by_ids_success(client, app):
+    rv = client.get('/datasources', query_string={'ids': '7004,1,999'},
+                    headers={'X-Auth-Token': str(client.secret)})
+    assert 200 == rv.status_code, 'Incorrect status code: {}'.format(rv.data)
+    resp = rv.json
+    assert [ds['id'] for ds in resp['data']] == [7004, 1]
+    assert 'storage' in resp['data'][0]
+
+
+def test_data_source_cache_invalidated_by_update_success(client, app):
+    headers = {'X-Auth-Token': str(client.secret)}
+    rv = client.get('/datasources/7004', headers=headers)
+    assert 200 == rv.status_code, 'Incorrect status code: {}'.format(rv.data)
+
+    with app.test_request_context():
+        ds = DataSource.query.get(7004)
+        assert get_data_source_payload(
+            ds.id, 'full', ds.updated)['name'] == ds.name
+
+    rv = client.patch('/datasources/7004', json={'name': 'Renamed'},
+                      headers=headers)
+    assert 200 == rv.status_code, 'Incorrect status code: {}'.format(rv.data)
+    with app.test_request_context():
+        ds = DataSource.query.get(7004)
+        assert get_data_source_payload(ds.id, 'full', ds.updated) is None
+        assert cache.get('data_source:7004:full') is None
+
+    rv = client.get('/datasources', query_string={'ids': '7004'},
+                    headers=headers)
+    assert rv.json['data'][0]['name'] == 'Renamed'
+
+
+def test_data_source_cache_invalidated_by_storage_success(client, app):
+    headers = {'X-Auth-Token': str(client.secret)}
+    rv = client.get('/datasources/7004', headers=headers)
+    assert 200 == rv.status_code, 'Incorrect status code: {}'.format(rv.data)
+    storage = rv.json['storage']
+    with app.test_request_context():
+        assert cache.get('data_source:7004:full') is not None
+
+    rv = client.patch(f'/storages/{storage["id"]}',
+                      json={'name': 'Renamed storage'}, headers=headers)
+    assert 200 == rv.status_code, 'Incorrect status code: {}'.format(rv.data)
+    with app.test_request_context():
+        assert cache.get('data_source:7004:full') is None
+
+    rv = client.get('/datasources/7004', headers=headers)
+    assert rv.json['storage']['name'] == 'Renamed storage'
+    client.patch(f'/storages/{storage["id"]}', json={'name': storage['name']},
+                 headers=headers)
+
+
+def test_data_source_get_many_too_many_ids_fail(client):
+    ids = ','.join(str(i) for i in range(1000))
+    rv = client.get('/datasources', query_string={'ids': ids},
+                    headers={'X-Auth-Token': str(client.secret)})
+    assert 400 == rv.status_code, 'Incorrect status code: {}'.format(rv.data)
+
+
+def test_update_data_source_attributes_in_bulk_success(client, app):
+    headers = {'X-Auth-Token': str(client.secret)}
+    payload = {
+        'name': 'Data source with attributes',
+        'format': 'CSV',
+        'storage_id': 1,
+        'url': 'hdfs://dev:9000/data/attrs.csv',
+        'attributes': [
+            {'name': 'id', 'type': 'INTEGER'},
+            {'name': 'name', 'type': 'CHARACTER'},
+            {'name': 'salary', 'type': 'DECIMAL'},
+        ]
+    }
+    rv = client.post('/datasources', json=payload, headers=headers)
+    assert 200 == rv.status_code, 'Incorrect status code: {}'.format(rv.data)
+    ds_id = rv.json['data']['id']
+    with app.test_request_context():
+        ds = DataSource.query.get(ds_id)
+        before = ds.updated
+        ids = {attr.name: attr.id for attr in ds.attributes}
+
+    update = {'attributes': [
+        {'id': ids['id'], 'name': 'id', 'type': 'LONG'},
+        {'id': ids['name'], 'name': 'full_name', 'type': 'CHARACTER'},
+        {'name': 'age', 'type': 'INTEGER',
+         'attribute_privacy': {
+             'attribute_name': 'age', 'privacy_type': 'SENSITIVE',
+             'anonymization_technique': 'GENERALIZATION'}},
+    ]}
+    rv = client.patch(f'/datasources/{ds_id}', json=update, headers=headers)
+    assert 200 == rv.status_code, 'Incorrect status code: {}'.format(rv.data)
+    assert [a['name'] for a in rv.json['data']['attributes']] == [
+        'id', 'full_name', 'age']
+
+    with app.test_request_context():
+        ds = DataSource.query.get(ds_id)
+        attrs = {attr.name: attr for attr in ds.attributes}
+        assert set(attrs.keys()) == {'id', 'full_name', 'age'}
+        assert attrs['id'].type == 'LONG'
+        assert attrs['full_name'].id == ids['name']
+        assert attrs['age'].attribute_privacy.privacy_type == 'SENSITIVE'
+        assert attrs['age'].feature is not None
+        assert ds.updated > before
+
+
+def test_data_source_list_ndjson_success(client, app):
+    rv = client.get('/datasources', query_string={'list': 'true'},
+                    headers={'X-Auth-Token': str(client.secret),
+                             'Accept': 'application/x-ndjson'})
+    assert 200 == rv.status_code, 'Incorrect status code: {}'.format(rv.data)
+    assert rv.mimetype == 'application/x-ndjson'
+    lines = rv.data.decode('utf8').splitlines()
+    rows = [json.loads(line) for line in lines]
+    with app.test_request_context():
+        assert len(rows) == DataSource.query.count()
+    assert all(set(row.keys()) <= {'id', 'name', 'tags'} for row in rows)
+
+
+def test_data_source_materialize_snapshot_success(client, app):
+    headers = {'X-Auth-Token': str(client.secret)}
+    with app.test_request_context():
+        storage = Storage.query.filter(
+            Storage.name == 'File Storage').first()
+        jdbc_storage = Storage.query.filter(
+            Storage.name == 'MySQL Storage').first()
+        ds = DataSource(
+            name='Employees', enabled=True, url='mysql://server:3306/db',
+            format=DataSourceFormat.JDBC, storage=jdbc_storage, user_id=1,
+            user_login='admin', user_name='Admin', is_public=True,
+            command='SELECT * FROM employee')
+        db.session.add(ds)
+        db.session.commit()
+        ds_id, storage_id = ds.id, storage.id
+        token = generate_download_token(ds_id)
+        download_url = url_for('DataSourceDownload', data_source_id=ds_id,
+                               token=token)
+
+    table = pa.table({'id': list(range(25)),
+                      'name': [f'Name {i}' for i in range(25)]})
+
+    def batches(data_source, limit=None):
+        yield table.schema
+        yield from table.to_batches(max_chunksize=10)
+
+    with mock.patch('limonero.util.snapshot.database_batches',
+                    side_effect=batches) as query:
+        rv = client.post(f'/datasources/{ds_id}/materialize',
+                         json={'storage_id': storage_id, 'ttl': 3600},
+                         headers=headers)
+        assert 202 == rv.status_code, f'Incorrect status code: {rv.data}'
+        location = rv.headers['Location']
+        for _ in range(200):
+            rv = client.get(location, headers=headers)
+            if rv.status_code != 202:
+                break
+            time.sleep(0.01)
+        assert 200 == rv.status_code, f'Incorrect status code: {rv.data}'
+        assert rv.json['data']['snapshot_ttl'] == 3600
+        assert query.call_count == 1
+    with app.test_request_context():
+        snapshot_dir = urlparse(DataSource.query.get(ds_id).snapshot_url).path
+        assert os.path.isdir(snapshot_dir)
+
+    # Reads snapshot, not the database
+    with mock.patch('limonero.util.export.database_batches') as live:
+        rv = client.get(f'/datasources/sample/{ds_id}?limit=5',
+                        headers=headers)
+        assert 200 == rv.status_code, f'Incorrect status code: {rv.data}'
+        assert rv.json['data'] == table.slice(0, 5).to_pylist()
+
+        rv = client.get(download_url)
+        assert 200 == rv.status_code, f'Incorrect status code: {rv.data}'
+        assert pq.read_table(io.BytesIO(rv.data)).equals(table)
+        live.assert_not_called()
+
+    rv = client.delete(f'/datasources/{ds_id}/materialize', headers=headers)
+    assert 200 == rv.status_code
+    assert not os.path.exists(snapshot_dir)
+
+
+def test_data_source_materialize_without_body_fail(client):
+    rv = client.post('/datasources/1/materialize',
+                     headers={'X-Auth-Token': str(client.secret)})
+    # Body is optional: storage comes from data source or config
+    assert 400 == rv.status_code, 'Incorrect status code: {}'.format(rv.data)
+    assert rv.json['status'] == 'ERROR'
+
+
+def test_data_source_materialize_not_database_fail(client):
+    # Validated before starting the execution
+    rv = client.post('/datasources/1/materialize', json={'storage_id': 2},
+                     headers={'X-Auth-Token': str(client.secret)})
+    assert 400 == rv.status_code, 'Incorrect status code: {}'.format(rv.data)
+    assert 'databases' in rv.json['message']
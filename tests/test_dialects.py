@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+import io
+import sqlite3
+from types import SimpleNamespace
+from urllib.parse import urlparse
+
+import pyarrow as pa
+import pyarrow.csv as pa_csv
+import pytest
+
+from limonero.models import CatalogTableType, DataSourceFormat, DataType
+from limonero.util.dialects import (PostgreSQLDialect, SQLiteDialect,
+                                    get_dialect)
+from limonero.util.export import database_batches, write_batches
+from limonero.util.schema_resolver import resolve_schema
+
+
+@pytest.fixture
+def sqlite_url(app, monkeypatch, tmp_path):
+    monkeypatch.setitem(app.config['LIMONERO_CONFIG'], 'sqlite_root',
+                        str(tmp_path))
+    path = tmp_path / 'company.db'
+    with sqlite3.connect(path) as cn:
+        cn.execute('CREATE TABLE employee (id INTEGER NOT NULL, '
+                   'name VARCHAR(100), salary DECIMAL(10, 2), photo BLOB)')
+        cn.executemany('INSERT INTO employee VALUES (?, ?, ?, NULL)',
+                       [(i, f'Name {i}', 1000.5 + i) for i in range(25)])
+        cn.execute('CREATE VIEW rich AS SELECT * FROM employee '
+                   'WHERE salary > 1010')
+    cn.close()
+    with app.app_context():
+        yield f'sqlite://{path}'
+
+
+def _data_source(url, command):
+    return SimpleNamespace(format=DataSourceFormat.JDBC, storage_id=4,
+                           url=url, command=command)
+
+
+def test_unsupported_database_fail():
+    with pytest.raises(ValueError, match='Unsupported database'):
+        get_dialect(urlparse('oracle://server/db'))
+
+
+def test_sqlite_file_outside_root_fail(sqlite_url, tmp_path):
+    url = urlparse(f'sqlite://{tmp_path}/../company.db')
+    with pytest.raises(ValueError, match='not allowed'):
+        get_dialect(url).get_pool()
+
+
+def test_sqlite_disabled_fail(app, monkeypatch, sqlite_url):
+    monkeypatch.delitem(app.config['LIMONERO_CONFIG'], 'sqlite_root')
+    with pytest.raises(ValueError, match='Unsupported database'):
+        get_dialect(urlparse(sqlite_url)).get_pool()
+
+
+def test_sqlite_crawl(sqlite_url):
+    dialect = get_dialect(urlparse(sqlite_url))
+    with dialect.get_pool().connection() as cn:
+        tables = dialect.crawl(cn)
+    assert tables['employee'][0] == CatalogTableType.TABLE
+    assert tables['rich'][0] == CatalogTableType.VIEW
+    assert tables['employee'][1][1] == {'name': 'name',
+                                        'type': 'VARCHAR(100)'}
+
+
+def test_sqlite_infer_schema(app, sqlite_url):
+    with app.app_context():
+        table = resolve_schema(
+            _data_source(sqlite_url, 'SELECT * FROM employee'))
+        query = resolve_schema(_data_source(
+            sqlite_url, 'SELECT id, salary * 2 AS double_salary '
+                        'FROM employee'))
+
+    assert [(a['name'], a['type'], a['nullable']) for a in table] == [
+        ('id', DataType.LONG, False),
+        ('name', DataType.CHARACTER, True),
+        ('salary', DataType.DECIMAL, True),
+        ('photo', DataType.BINARY, True)]
+    assert table[1]['size'] == 100
+    assert (table[2]['precision'], table[2]['scale']) == (10, 2)
+    assert [(a['name'], a['type']) for a in query] == [
+        ('id', DataType.LONG), ('double_salary', DataType.DOUBLE)]
+
+
+def test_sqlite_sample_and_export(sqlite_url):
+    dialect = get_dialect(urlparse(sqlite_url))
+    sample = dialect.sample('SELECT id, name FROM rich LIMIT 100', 2)
+    assert sample == [{'id': 10, 'name': 'Name 10'},
+                      {'id': 11, 'name': 'Name 11'}]
+
+    data_source = _data_source(sqlite_url, 'SELECT id, name FROM employee')
+    data = b''.join(write_batches(
+        database_batches(data_source, limit=20, batch_size=8), 'csv'))
+    table = pa_csv.read_csv(io.BytesIO(data))
+    assert table.num_rows == 20
+    assert table.column('name')[19].as_py() == 'Name 19'
+
+
+def test_postgresql_copy_output_is_parsed():
+    dialect = PostgreSQLDialect(urlparse('postgresql://server/db'))
+    # (name, type OID, display size, size, precision, scale, null ok)
+    description = [('id', 20, None, 8, None, None, None),
+                   ('active', 16, None, 1, None, None, None),
+                   ('name', 1043, None, -1, None, None, None),
+                   ('salary', 1700, None, -1, 10, 2, None),
+                   ('hired', 1114, None, 8, None, None, None)]
+    schema = pa.schema([(d[0], dialect.arrow_column(d)[0])
+                        for d in description])
+    output = io.BufferedReader(io.BytesIO(
+        b'1,t,"",10.50,2020-01-01 10:00:00\n'
+        b'2,f,,,\n'))
+    batches = list(dialect._read_copy(output, schema))
+    assert pa.Table.from_batches(batches).to_pylist()[1] == {
+        'id': 2, 'active': False, 'name': None, 'salary': None,
+        'hired': None}
+    assert batches[0].column(2)[0].as_py() == ''
+    assert list(dialect._read_copy(io.BufferedReader(io.BytesIO(b'')),
+                                   schema)) == []
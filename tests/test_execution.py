@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+import threading
+import time
+from unittest import mock
+
+import pytest
+from flask import g as flask_g
+
+from limonero.data_source_api import DataSourceSampleApi
+from limonero.util.execution import (ExecutionManager, ExecutionTimeout,
+                                     TooManyExecutions, get_execution_manager,
+                                     is_cancelled)
+
+
+@pytest.fixture
+def manager():
+    return ExecutionManager(max_workers=2, max_pending=0, result_ttl=60)
+
+
+def test_run_uses_caller_context(app, manager):
+    with app.test_request_context('/?limit=5'):
+        flask_g.user = 'lemonade'
+        assert manager.run(lambda: (flask_g.user, is_cancelled()),
+                           'LOCAL') == ('lemonade', False)
+
+
+def test_run_cancels_after_deadline(app, manager):
+    stopped = threading.Event()
+
+    def slow():
+        while not is_cancelled():
+            time.sleep(0.01)
+        stopped.set()
+
+    # Messages are translated to the locale of the request
+    with app.app_context(), app.test_request_context():
+        with pytest.raises(ExecutionTimeout):
+            manager.run(slow, 'HIVE', timeout=0.1)
+    assert stopped.wait(1)
+
+
+def test_submit_fails_when_busy(app, manager):
+    release = threading.Event()
+    try:
+        with app.app_context(), app.test_request_context():
+            executions = [manager.submit(release.wait, 'JDBC')
+                          for _ in range(2)]
+            with pytest.raises(TooManyExecutions):
+                manager.submit(release.wait, 'JDBC')
+    finally:
+        release.set()
+    assert all(e.future.result(1) for e in executions)
+
+
+def test_sample_async(client):
+    headers = {'X-Auth-Token': str(client.secret)}
+    release = threading.Event()
+
+    def sample(data_source_id):
+        release.wait(5)
+        return {'status': 'OK', 'data': [{'id': data_source_id}]}, 200
+
+    with mock.patch.object(DataSourceSampleApi, '_get_sample',
+                           side_effect=sample):
+        rv = client.get('/datasources/sample/1?async=true', headers=headers)
+        assert 202 == rv.status_code, f'Incorrect status code: {rv.data}'
+        location = rv.headers['Location']
+        assert location.endswith(rv.json['execution_id'])
+
+        rv = client.get(location, headers=headers)
+        assert 202 == rv.status_code
+        assert rv.json['status'] in ('PENDING', 'RUNNING')
+        rv = client.get(location.replace('/sample/1/', '/sample/7004/'),
+                        headers=headers)
+        assert 404 == rv.status_code
+
+        release.set()
+        for _ in range(100):
+            rv = client.get(location, headers=headers)
+            if rv.status_code != 202:
+                break
+            time.sleep(0.01)
+        assert 200 == rv.status_code, f'Incorrect status code: {rv.data}'
+        assert rv.json['data'] == [{'id': 1}]
+
+
+def test_execution_read_only_by_its_resource(app, client):
+    headers = {'X-Auth-Token': str(client.secret)}
+    with app.app_context():
+        execution = get_execution_manager().submit(
+            lambda: ({'status': 'OK'}, 200), 'CONVERSION', owner=0,
+            resource=1)
+    execution.future.result(1)
+
+    for kind in ('sample', 'compact'):
+        url = (f'/datasources/sample/1/executions/{execution.id}'
+               if kind == 'sample'
+               else f'/datasources/1/{kind}/executions/{execution.id}')
+        assert 404 == client.get(url, headers=headers).status_code
+        assert 404 == client.delete(url, headers=headers).status_code
+    rv = client.get(f'/datasources/1/convert/executions/{execution.id}',
+                    headers=headers)
+    assert 200 == rv.status_code, 'Incorrect status code: {}'.format(rv.data)
@@ -0,0 +1,182 @@
+# -*- coding: utf-8 -*-
+import datetime
+import decimal
+import io
+import json
+from contextlib import contextmanager
+from types import SimpleNamespace
+from unittest import mock
+from urllib.parse import urlparse
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pymysql
+import pytest
+from pymysql.constants import FIELD_TYPE
+
+from limonero.models import DataSource, DataSourceFormat, Storage, db
+from limonero.util.dialects import MySQLDialect
+from limonero.util.export import (RecordBatchReader, database_batches,
+                                  write_batches)
+
+DESCRIPTION = [
+    ('id', FIELD_TYPE.LONG, None, 11, 11, 0, False),
+    ('name', FIELD_TYPE.VAR_STRING, None, 100, 100, 0, True),
+    ('salary', FIELD_TYPE.NEWDECIMAL, None, 12, 12, 2, True),
+    ('hired', FIELD_TYPE.DATE, None, 10, 10, 0, True),
+]
+
+
+class FakeCursor:
+    description = DESCRIPTION
+
+    def __init__(self, rows):
+        self.rows = list(rows)
+        self.fetches = 0
+        self.close = mock.Mock()
+
+    def execute(self, cmd):
+        self.cmd = cmd
+
+    def fetchmany(self, size):
+        self.fetches += 1
+        result, self.rows = self.rows[:size], self.rows[size:]
+        return result
+
+
+def _rows(n):
+    return [(i, f'Name {i}', decimal.Decimal('10.50'),
+             datetime.date(2020, 1, 1) if i % 2 else '0000-00-00')
+            for i in range(n)]
+
+
+def _untyped_column(description):
+    # As SQLite: cursor description has no types
+    return None, None
+
+
+def test_record_batch_reader_infers_types_without_truncating():
+    cursor = FakeCursor([(1, 1, 'a'), (2.5, 'x', None), (3, None, 'b')])
+    cursor.description = [('value',), ('mixed',), ('text',)]
+    batches = list(RecordBatchReader(cursor, _untyped_column,
+                                     batch_size=3))
+    assert batches[0].schema == pa.schema([
+        ('value', pa.float64()), ('mixed', pa.string()),
+        ('text', pa.string())])
+    assert batches[0].to_pydict() == {
+        'value': [1.0, 2.5, 3.0], 'mixed': ['1', 'x', None],
+        'text': ['a', None, 'b']}
+
+
+def test_record_batch_reader_values_not_fitting_inferred_type_fail():
+    cursor = FakeCursor([(1,), (2,), (2.5,), ('x',)])
+    cursor.description = [('value',)]
+    batches = iter(RecordBatchReader(cursor, _untyped_column, batch_size=2))
+    assert next(batches).column(0).to_pylist() == [1, 2]
+    with pytest.raises(ValueError):
+        next(batches)
+
+
+def _mysql_data_source(cursor):
+    connection = mock.Mock()
+    connection.cursor.return_value = cursor
+
+    @contextmanager
+    def get_connection():
+        yield connection
+
+    pool = SimpleNamespace(connection=get_connection)
+    data_source = SimpleNamespace(format=DataSourceFormat.JDBC,
+                                  url='mysql://server:3306/db',
+                                  command='SELECT * FROM employee LIMIT 10')
+    return data_source, connection, pool
+
+
+def test_record_batch_reader_fetches_in_batches():
+    cursor = FakeCursor(_rows(25))
+    dialect = MySQLDialect(urlparse('mysql://server:3306/db'))
+    batches = list(RecordBatchReader(cursor, dialect.arrow_column,
+                                     batch_size=10))
+
+    assert [b.num_rows for b in batches] == [10, 10, 5]
+    assert cursor.fetches == 4
+    schema = batches[0].schema
+    assert schema.field('id').type == pa.int64()
+    assert schema.field('name').type == pa.string()
+    assert schema.field('salary').type == pa.decimal128(38, 2)
+    # Invalid (zero) dates are converted to null
+    assert schema.field('hired').type == pa.date32()
+    assert batches[0].column(3).null_count == 5
+
+
+def test_export_mysql_as_parquet_uses_unbuffered_cursor():
+    cursor = FakeCursor(_rows(25))
+    data_source, connection, pool = _mysql_data_source(cursor)
+    with mock.patch('limonero.util.dialects.get_mysql_pool',
+                    return_value=pool):
+        data = b''.join(write_batches(
+            database_batches(data_source, limit=20, batch_size=10),
+            'parquet'))
+
+    connection.cursor.assert_called_once_with(pymysql.cursors.SSCursor)
+    assert cursor.cmd == 'SELECT * FROM employee LIMIT 20'
+    cursor.close.assert_called_once()
+
+    table = pq.read_table(io.BytesIO(data))
+    assert table.num_rows == 25
+    assert table.column_names == ['id', 'name', 'salary', 'hired']
+
+
+def test_export_mysql_empty_result_as_csv():
+    data_source, _, pool = _mysql_data_source(FakeCursor([]))
+    with mock.patch('limonero.util.dialects.get_mysql_pool',
+                    return_value=pool):
+        data = b''.join(write_batches(database_batches(data_source), 'csv'))
+    assert data == b'"id","name","salary","hired"\n'
+
+
+def test_export_file_data_source_fail(client):
+    rv = client.get('/datasources/1/export?format=csv',
+                    headers={'X-Auth-Token': str(client.secret)})
+    assert 400 == rv.status_code, 'Incorrect status code: {}'.format(rv.data)
+    assert json.loads(rv.data)['status'] == 'ERROR'
+
+
+@pytest.fixture
+def jdbc_data_source_id(app):
+    with app.test_request_context():
+        storage = Storage.query.filter(Storage.name == 'MySQL Storage').one()
+        data_source = DataSource(
+            name='Employees', enabled=True, url='mysql://server:3306/db',
+            format=DataSourceFormat.JDBC, storage=storage, user_id=1,
+            user_login='admin', user_name='Admin', is_public=True,
+            command='SELECT * FROM employee')
+        db.session.add(data_source)
+        db.session.commit()
+        data_source_id = data_source.id
+    yield data_source_id
+    with app.test_request_context():
+        db.session.delete(DataSource.query.get(data_source_id))
+        db.session.commit()
+
+
+def test_export_invalid_limit_fail(client, jdbc_data_source_id):
+    rv = client.get(f'/datasources/{jdbc_data_source_id}/export',
+                    query_string={'format': 'csv', 'limit': 'abc'},
+                    headers={'X-Auth-Token': str(client.secret)})
+    assert 400 == rv.status_code, 'Incorrect status code: {}'.format(rv.data)
+    assert rv.json['status'] == 'ERROR'
+
+
+def test_export_database_error_fail(client, jdbc_data_source_id):
+    def batches(data_source, limit=None):
+        raise pymysql.err.ProgrammingError(1146, "Table doesn't exist")
+        yield
+
+    with mock.patch('limonero.data_source_api.database_batches',
+                    side_effect=batches):
+        rv = client.get(f'/datasources/{jdbc_data_source_id}/export',
+                        query_string={'format': 'csv', 'limit': '10'},
+                        headers={'X-Auth-Token': str(client.secret)})
+    assert 400 == rv.status_code, 'Incorrect status code: {}'.format(rv.data)
+    assert "Table doesn't exist" in rv.json['message']
@@ -0,0 +1,249 @@
+# -*- coding: utf-8 -*-
+import bz2
+import decimal
+import gzip
+import json
+import uuid
+from types import SimpleNamespace
+from urllib.parse import urlparse
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pytest
+from pyarrow import fs
+
+import limonero.hdfs_util as hu
+from limonero.models import DataSource, DataType, Storage, db
+
+PEOPLE = [
+    {'id': 1, 'name': 'Maria', 'address': {'city': 'Belo Horizonte',
+                                           'geo': {'lat': -19.9}},
+     'tags': ['admin'], 'salary': 10.5, 'manager': None},
+    {'id': 2 ** 40, 'name': 'Pedro', 'address': {'city': 'Recife',
+                                                 'geo': {'lat': -8.0}},
+     'tags': [], 'salary': 7.0, 'manager': None},
+]
+
+
+@pytest.fixture
+def cached_fs():
+    hu.clear_listing_cache()
+    yield hu.cached_filesystem(fs.LocalFileSystem(), 'test')
+    hu.clear_listing_cache()
+
+
+def test_listing_cache_not_found(cached_fs, tmp_path):
+    path = str(tmp_path / 'people.csv')
+    assert not hu.exists(cached_fs, path)
+
+    # Created by other process, still cached as not found
+    (tmp_path / 'people.csv').write_text('id,name\n')
+    assert not hu.exists(cached_fs, path)
+
+    hu.invalidate_listing(cached_fs, path)
+    assert hu.exists(cached_fs, path)
+
+
+def test_listing_cache_invalidated_by_writes(cached_fs, tmp_path):
+    directory = str(tmp_path / 'data')
+    assert not hu.is_directory(cached_fs, directory)
+    assert cached_fs.get_file_info(
+        fs.FileSelector(directory, allow_not_found=True)) == []
+
+    # Parent directory was cached as not found
+    cached_fs.create_dir(directory)
+    pq.write_table(pa.table({'id': [1, 2]}), f'{directory}/part-0.parquet',
+                   filesystem=cached_fs)
+    assert hu.is_directory(cached_fs, directory)
+    assert hu.infer_parquet(cached_fs, directory)
+
+    # Listed (and cached) when the dataset was discovered
+    cached_fs.move(f'{directory}/part-0.parquet',
+                   f'{directory}/part-1.parquet')
+    assert [i.base_name for i in cached_fs.get_file_info(
+        fs.FileSelector(directory))] == ['part-1.parquet']
+
+    cached_fs.delete_dir(directory)
+    assert not hu.exists(cached_fs, f'{directory}/part-1.parquet')
+    with pytest.raises(FileNotFoundError):
+        cached_fs.get_file_info(fs.FileSelector(directory))
+
+
+def test_json_blocks_whole_lines(tmp_path):
+    path = tmp_path / 'people.json.gz'
+    with gzip.open(path, 'wt') as f:
+        f.write(''.join(json.dumps(p) + '\n' for p in PEOPLE * 50))
+
+    local = fs.LocalFileSystem()
+    tables = list(hu.read_json_blocks(local, str(path), block_size=100))
+    assert len(tables) > 1
+    assert sum(t.num_rows for t in tables) == 100
+
+    rows = hu.sample_json(local, [str(path)], 3)
+    assert len(rows) == 3
+    assert rows[1]['address.geo.lat'] == -8.0
+    assert rows[0]['tags'] == ['admin']
+
+
+def test_json_blocks_promote_types(tmp_path):
+    path = tmp_path / 'events.json'
+    rows = ([{'id': i, 'b': None} for i in range(20)] +
+            [{'id': i + 0.5, 'b': f'text {i}', 'c': True} for i in range(20)])
+    path.write_text(''.join(json.dumps(row) + '\n' for row in rows))
+
+    local = fs.LocalFileSystem()
+    tables = list(hu.read_json_blocks(local, str(path), block_size=200))
+    assert len(tables) > 2
+    # Null and integer in the first block, string and double later
+    assert tables[-1].schema == pa.schema([
+        ('id', pa.float64()), ('b', pa.string()), ('c', pa.bool_())])
+    assert sum(t.num_rows for t in tables) == 40
+
+    sample = hu.sample_json(local, [str(path)], 30)
+    assert sample[25] == {'id': 5.5, 'b': 'text 5', 'c': True}
+
+
+def test_infer_json(tmp_path):
+    path = tmp_path / 'people.json'
+    path.write_text(''.join(json.dumps(p) + '\n' for p in PEOPLE))
+    assert dict(hu.infer_json(fs.LocalFileSystem(), [str(path)])) == {
+        'id': ('LONG', 0, 0),
+        'name': ('CHARACTER', 0, 0),
+        'address.city': ('CHARACTER', 0, 0),
+        'address.geo.lat': ('DOUBLE', 0, 0),
+        'tags': ('VECTOR', 0, 0),
+        'salary': ('DOUBLE', 0, 0),
+        'manager': ('CHARACTER', 0, 0),
+    }
+
+
+def test_json_data_source_api(app, client):
+    headers = {'X-Auth-Token': str(client.secret)}
+    with app.test_request_context():
+        storage_id = Storage.query.filter(
+            Storage.name == 'File Storage').one().id
+    rv = client.post('/datasources/upload', query_string={
+        'resumableIdentifier': uuid.uuid4().hex,
+        'resumableFilename': 'people.json',
+        'resumableChunkNumber': 1, 'resumableTotalChunks': 1,
+        'storage_id': storage_id},
+        data=''.join(json.dumps(p) + '\n' for p in PEOPLE).encode('utf8'),
+        headers=headers)
+    assert 200 == rv.status_code, f'Incorrect status code: {rv.data}'
+    data_source = rv.json['data']
+
+    rv = client.post(f'/datasources/infer-schema/{data_source["id"]}',
+                     json={}, headers=headers)
+    assert 200 == rv.status_code, f'Incorrect status code: {rv.data}'
+    rv = client.get(f'/datasources/{data_source["id"]}', headers=headers)
+    assert [(a['name'], a['type']) for a in rv.json['attributes']][:3] == [
+        ('id', 'LONG'), ('name', 'CHARACTER'), ('address.city', 'CHARACTER')]
+
+    rv = client.get(f'/datasources/sample/{data_source["id"]}',
+                    query_string={'limit': 1}, headers=headers)
+    assert 200 == rv.status_code, f'Incorrect status code: {rv.data}'
+    assert rv.json['data'] == [{
+        'id': 1, 'name': 'Maria', 'address.city': 'Belo Horizonte',
+        'address.geo.lat': -19.9, 'tags': ['admin'], 'salary': 10.5,
+        'manager': None}]
+
+    with app.test_request_context():
+        db.session.delete(DataSource.query.get(data_source['id']))
+        db.session.commit()
+    fs.LocalFileSystem().delete_file(urlparse(data_source['url']).path)
+
+
+def _csv_data_source(**kwargs):
+    params = dict(
+        attribute_delimiter='{tab}', text_delimiter="'", encoding='latin1',
+        is_multiline=True, treat_as_missing='NA', is_first_line_header=True,
+        attributes=[
+            SimpleNamespace(name=name, type=data_type, precision=10, scale=2,
+                            partition_key=False)
+            for name, data_type in (('id', DataType.INTEGER),
+                                    ('name', DataType.CHARACTER),
+                                    ('salary', DataType.DECIMAL))])
+    params.update(kwargs)
+    return SimpleNamespace(**params)
+
+
+def test_sample_csv_typed(tmp_path):
+    path = tmp_path / 'people.csv.gz'
+    with gzip.open(path, 'wb') as f:
+        f.write('id\tname\tsalary\n 1\t\'José\nda Silva\'\t10.5\n'
+                '2\tMaria\tNA\n3\tPedro\t\n'.encode('latin1'))
+
+    rows, warnings = hu.sample_csv(fs.LocalFileSystem(), str(path), 2,
+                                   _csv_data_source())
+    assert warnings == []
+    assert rows == [
+        {'id': 1, 'name': 'José\nda Silva', 'salary': decimal.Decimal(
+            '10.50')},
+        {'id': 2, 'name': 'Maria', 'salary': None}]
+
+
+def test_sample_csv_invalid_values(tmp_path):
+    path = tmp_path / 'people.csv'
+    path.write_text('1;Ana;x\n2;Pedro;1.5\n')
+
+    rows, warnings = hu.sample_csv(
+        fs.LocalFileSystem(), str(path), 10, _csv_data_source(
+            attribute_delimiter=';', is_first_line_header=False))
+    assert warnings == ['salary']
+    assert [row['salary'] for row in rows] == ['x', '1.5']
+    assert [row['id'] for row in rows] == [1, 2]
+
+
+def test_sample_csv_compressed_without_extension(tmp_path):
+    path = tmp_path / 'people.csv'
+    path.write_bytes(pa.compress(
+        'id;name;salary\n1;Ana;2.5\n'.encode('latin1'), codec='zstd',
+        asbytes=True))
+
+    rows, warnings = hu.sample_csv(
+        fs.LocalFileSystem(), str(path), 10,
+        _csv_data_source(attribute_delimiter=';'))
+    assert rows == [{'id': 1, 'name': 'Ana',
+                     'salary': decimal.Decimal('2.50')}]
+
+
+def test_compressed_csv_data_source_api(app, client):
+    headers = {'X-Auth-Token': str(client.secret)}
+    data = 'id,name\n1,Maria\n2,Pedro\n'.encode('utf8')
+    with app.test_request_context():
+        storage_id = Storage.query.filter(
+            Storage.name == 'File Storage').one().id
+    rv = client.post('/datasources/upload', query_string={
+        'resumableIdentifier': uuid.uuid4().hex,
+        'resumableFilename': 'people.csv.bz2',
+        'resumableChunkNumber': 1, 'resumableTotalChunks': 1,
+        'storage_id': storage_id},
+        data=bz2.compress(data), headers=headers)
+    assert 200 == rv.status_code, f'Incorrect status code: {rv.data}'
+    data_source = rv.json['data']
+    # Delimiter and schema inferred from the decompressed file
+    assert data_source['format'] == 'CSV'
+    rv = client.get(f'/datasources/{data_source["id"]}', headers=headers)
+    assert [(a['name'], a['type']) for a in rv.json['attributes']] == [
+        ('id', 'INTEGER'), ('name', 'CHARACTER')]
+
+    rv = client.get(f'/datasources/sample/{data_source["id"]}',
+                    query_string={'limit': 1}, headers=headers)
+    assert 200 == rv.status_code, f'Incorrect status code: {rv.data}'
+    assert rv.json['data'] == [{'id': 1, 'name': 'Maria'}]
+
+    with app.test_request_context():
+        token = app.fernet.encrypt(
+            f'{{"id": {data_source["id"]}}}'.encode('utf8')).decode('utf8')
+    rv = client.get(f'/datasources/public/{data_source["id"]}/download',
+                    query_string={'token': token})
+    assert bz2.decompress(rv.data) == data
+    assert rv.headers['Content-Disposition'].endswith('.csv.bz2')
+    rv = client.get(f'/datasources/public/{data_source["id"]}/download',
+                    query_string={'token': token, 'decompress': 'true'})
+    assert rv.data == data
+
+    with app.test_request_context():
+        db.session.delete(DataSource.query.get(data_source['id']))
+        db.session.commit()
+    fs.LocalFileSystem().delete_file(urlparse(data_source['url']).path)
@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+from types import SimpleNamespace
+from unittest import mock
+
+import pytest
+from TCLIService.ttypes import TOperationState
+
+from limonero.util.hive import (QueryCancelled, QueryError, QueryTimeout,
+                                execute, wait_for_query)
+
+
+def _cursor(*states, error_message=None):
+    cursor = mock.Mock()
+    cursor.poll.side_effect = [
+        SimpleNamespace(operationState=state, errorMessage=error_message)
+        for state in states]
+    return cursor
+
+
+@mock.patch('limonero.util.hive.time.sleep')
+def test_wait_for_query_backs_off(sleep):
+    cursor = _cursor(TOperationState.INITIALIZED_STATE,
+                     *[TOperationState.RUNNING_STATE] * 6,
+                     TOperationState.FINISHED_STATE)
+    execute(cursor, 'SHOW TABLES', timeout=60, is_cancelled=None,
+            initial_delay=0.1, max_delay=1.0)
+
+    cursor.execute.assert_called_once_with('SHOW TABLES', async_=True)
+    assert cursor.poll.call_count == 8
+    delays = [c.args[0] for c in sleep.call_args_list]
+    assert delays == [0.1, 0.2, 0.4, 0.8, 1.0, 1.0, 1.0]
+    cursor.cancel.assert_not_called()
+
+
+@mock.patch('limonero.util.hive.time.sleep')
+def test_wait_for_query_cancels_on_timeout(sleep):
+    cursor = _cursor(*[TOperationState.RUNNING_STATE] * 3)
+    with mock.patch('limonero.util.hive.time.monotonic',
+                    side_effect=[0, 1, 11]):
+        with pytest.raises(QueryTimeout):
+            wait_for_query(cursor, timeout=10, is_cancelled=None)
+    cursor.cancel.assert_called_once()
+
+
+@mock.patch('limonero.util.hive.time.sleep')
+def test_wait_for_query_cancels_when_requested(sleep):
+    cursor = _cursor(*[TOperationState.RUNNING_STATE] * 3)
+    is_cancelled = mock.Mock(side_effect=[False, True])
+    with pytest.raises(QueryCancelled):
+        wait_for_query(cursor, timeout=60, is_cancelled=is_cancelled)
+    cursor.cancel.assert_called_once()
+    assert cursor.poll.call_count == 2
+
+
+def test_wait_for_query_reports_errors():
+    cursor = _cursor(TOperationState.ERROR_STATE,
+                     error_message='Table not found')
+    with pytest.raises(QueryError, match='Table not found'):
+        wait_for_query(cursor, timeout=60, is_cancelled=None)
@@ -0,0 +1,23 @@
+# -*- coding: utf-8 -*-
+import json
+
+from limonero.models import Model
+
+
+def test_model_list_ndjson_success(client, app):
+    rv = client.get('/models', headers={'X-Auth-Token': str(client.secret),
+                                        'Accept': 'application/x-ndjson'})
+    assert 200 == rv.status_code, 'Incorrect status code: {}'.format(rv.data)
+    assert rv.mimetype == 'application/x-ndjson'
+    rows = [json.loads(line) for line in rv.data.decode('utf8').splitlines()]
+    with app.test_request_context():
+        assert [row['name'] for row in rows] == [
+            m.name for m in Model.query.filter(Model.enabled).order_by(
+                Model.name)]
+
+
+def test_model_list_paginated_success(client):
+    rv = client.get('/models', headers={'X-Auth-Token': str(client.secret)})
+    assert 200 == rv.status_code, 'Incorrect status code: {}'.format(rv.data)
+    assert rv.mimetype == 'application/json'
+    assert rv.json['pagination']['page'] == 1
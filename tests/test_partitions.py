@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+import datetime
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pytest
+from pyarrow import fs
+
+from limonero.models import DataSource, DataSourceFormat, Storage, db
+from limonero.util import partitions
+
+
+@pytest.fixture
+def sales(tmp_path):
+    """ Hive style partitions: year=2023/month=01 ... year=2024/month=12 """
+    path = tmp_path / 'sales'
+    for year in (2023, 2024):
+        for month in range(1, 13):
+            directory = path / f'year={year}' / f'month={month:02}'
+            directory.mkdir(parents=True)
+            pq.write_table(pa.table({'id': [year * 100 + month],
+                                     'total': [month * 1.5]}),
+                           str(directory / 'part-00000.parquet'))
+    (path / '_SUCCESS').write_text('')
+    return str(path)
+
+
+def test_discover_hive(sales):
+    local = fs.LocalFileSystem()
+    assert partitions.discover(local, sales) == (
+        partitions.HIVE, ['year', 'month'])
+    assert partitions.discover(
+        local, f'{sales}/year=2024/month=01/part-00000.parquet') is None
+
+
+def test_discover_directories(tmp_path):
+    local = fs.LocalFileSystem()
+    (tmp_path / '2024' / '01').mkdir(parents=True)
+    assert partitions.discover(local, str(tmp_path), ['year']) == (
+        partitions.DIRECTORY, ['year', 'partition_2'])
+
+
+def test_open_dataset_pruned(sales):
+    local = fs.LocalFileSystem()
+    filters = partitions.parse_filters('year=2024/month=1')
+    dataset, expression = partitions.open_dataset(local, sales, 'parquet',
+                                                  filters=filters)
+    # Only the directory of the month is listed
+    assert dataset.files == [f'{sales}/year=2024/month=01/part-00000.parquet']
+    assert dataset.to_table(filter=expression).to_pylist() == [
+        {'id': 202401, 'total': 1.5, 'year': 2024, 'month': 1}]
+
+    assert partitions.read_sample(local, sales, 'parquet', 10, filters={
+        'month': '12'}) == [
+        {'id': 202312, 'total': 18.0, 'year': 2023, 'month': 12},
+        {'id': 202412, 'total': 18.0, 'year': 2024, 'month': 12}]
+    assert partitions.read_sample(local, sales, 'parquet', 10, filters={
+        'year': '2025'}) == []
+    with pytest.raises(ValueError):
+        partitions.open_dataset(local, sales, 'parquet', filters={'day': 1})
+
+
+def test_list_partitions(sales):
+    result = partitions.list_partitions(fs.LocalFileSystem(), sales)
+    assert result['count'] == 24
+    assert result['partitions'][0]['values'] == {'year': '2023',
+                                                 'month': '01'}
+    assert result['partitions'][0]['files'] == 1
+    assert result['size'] == sum(p['size'] for p in result['partitions'])
+
+
+def test_partitioned_data_source_api(app, client, sales):
+    headers = {'X-Auth-Token': str(client.secret)}
+    with app.test_request_context():
+        now = datetime.datetime.utcnow()
+        data_source = DataSource(
+            name='sales', enabled=True, statistics_process_counter=0,
+            read_only=False, privacy_aware=False, url=f'file://{sales}',
+            created=now, updated=now, format=DataSourceFormat.PARQUET,
+            user_id=1, user_login='lemonade', user_name='Lemonade project',
+            temporary=False, is_public=True, is_first_line_header=False,
+            is_multiline=False, storage=Storage.query.filter(
+                Storage.name == 'File Storage').one())
+        db.session.add(data_source)
+        db.session.commit()
+        data_source_id = data_source.id
+
+    rv = client.post(f'/datasources/infer-schema/{data_source_id}', json={},
+                     headers=headers)
+    assert 200 == rv.status_code, f'Incorrect status code: {rv.data}'
+    rv = client.get(f'/datasources/{data_source_id}', headers=headers)
+    assert {a['name']: a['partition_key'] for a in rv.json[
+        'attributes']} == {'id': False, 'total': False, 'year': True,
+                           'month': True}
+
+    rv = client.get(f'/datasources/sample/{data_source_id}',
+                    query_string={'partitions': 'year=2023/month=02'},
+                    headers=headers)
+    assert 200 == rv.status_code, f'Incorrect status code: {rv.data}'
+    assert [row['id'] for row in rv.json['data']] == [202302]
+
+    rv = client.get(f'/datasources/sample/{data_source_id}',
+                    query_string={'partitions': 'day=1'}, headers=headers)
+    assert 400 == rv.status_code
+
+    rv = client.get(f'/datasources/{data_source_id}/partitions',
+                    headers=headers)
+    assert 200 == rv.status_code, f'Incorrect status code: {rv.data}'
+    assert rv.json['data']['count'] == 24
+
+    with app.test_request_context():
+        db.session.delete(DataSource.query.get(data_source_id))
+        db.session.commit()
@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+import threading
+from unittest import mock
+
+import pytest
+
+from limonero.util.pool import (ConnectionPool, PoolTimeout, get_pool,
+                                 get_pools_stats)
+
+
+class FakeConnection:
+    def __init__(self):
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+def _pool(**kwargs):
+    return ConnectionPool('test', FakeConnection, **kwargs)
+
+
+def test_pool_reuses_connections():
+    pool = _pool()
+    with pool.connection() as first:
+        pass
+    with pool.connection() as second:
+        pass
+    assert first is second
+    stats = pool.stats()
+    assert stats['created'] == 1
+    assert stats['reused'] == 1
+    assert stats['idle'] == 1
+    assert stats['in_use'] == 0
+
+
+def test_pool_is_bounded():
+    pool = _pool(max_size=1, acquire_timeout=0.05)
+    with pool.connection():
+        with pytest.raises(PoolTimeout):
+            with pool.connection():
+                pass
+    assert pool.stats()['timeouts'] == 1
+
+
+def test_pool_waits_for_released_connection():
+    pool = _pool(max_size=1, acquire_timeout=5)
+    pooled = pool.acquire()
+    threading.Timer(0.05, pool.release, args=(pooled,)).start()
+    with pool.connection() as cn:
+        assert cn is pooled.connection
+    assert pool.stats()['waits'] >= 1
+
+
+def test_pool_discards_connection_on_error():
+    pool = _pool()
+    with pytest.raises(ValueError):
+        with pool.connection() as cn:
+            raise ValueError('Query failed')
+    assert cn.closed
+    assert pool.stats()['size'] == 0
+
+
+def test_pool_discards_dead_and_expired_connections():
+    pre_ping = mock.Mock(return_value=False)
+    pool = _pool(pre_ping=pre_ping)
+    with pool.connection() as first:
+        pass
+    with pool.connection() as second:
+        pass
+    assert first.closed and first is not second
+    assert pool.stats()['failed_pings'] == 1
+
+    pool = _pool(idle_timeout=0)
+    with pool.connection() as first:
+        pass
+    with pool.connection() as second:
+        pass
+    assert first.closed and first is not second
+
+
+def test_pool_resets_connection_on_release():
+    reset = mock.Mock(side_effect=[None, RuntimeError('Lost connection')])
+    pool = _pool(reset=reset)
+    with pool.connection() as cn:
+        pass
+    assert not cn.closed
+    with pool.connection() as cn:
+        pass
+    assert cn.closed
+    assert reset.call_count == 2
+
+
+def test_pools_stats_of_same_name():
+    with mock.patch('limonero.util.pool._pools', {}):
+        get_pool(('mysql', 'server', 'user', 'first'), 'mysql://server',
+                 FakeConnection)
+        get_pool(('mysql', 'server', 'user', 'second'), 'mysql://server',
+                 FakeConnection)
+        assert sorted(get_pools_stats()) == ['mysql://server',
+                                             'mysql://server#2']
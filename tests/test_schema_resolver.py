@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+from contextlib import contextmanager
+from types import SimpleNamespace
+from unittest import mock
+
+import pymysql
+from pymysql.constants import FIELD_TYPE
+
+from limonero.models import DataSourceFormat, DataType
+from limonero.util.schema_resolver import normalize_command, resolve_schema
+
+COLUMNS = [
+    ('id', 'int', None, 10, 0, 'NO'),
+    ('name', 'varchar', 100, None, None, 'YES'),
+    ('salary', 'decimal', None, 12, 2, 'YES'),
+]
+
+
+def _mysql(command, cursor):
+    connection = mock.MagicMock()
+    connection.cursor.return_value = cursor
+
+    @contextmanager
+    def get_connection():
+        yield connection
+
+    pool = SimpleNamespace(connection=get_connection)
+    data_source = SimpleNamespace(format=DataSourceFormat.JDBC, storage_id=4,
+                                  url='mysql://server:3306/db',
+                                  command=command)
+    return data_source, pool
+
+
+def test_normalize_command():
+    assert normalize_command('SELECT *\n  FROM  t LIMIT 10;') == \
+           'SELECT * FROM t'
+    assert normalize_command('SELECT * FROM (SELECT * FROM t LIMIT 5) x') == \
+           'SELECT * FROM (SELECT * FROM t LIMIT 5) x'
+
+
+def test_resolve_table_from_information_schema_and_cache(app):
+    cursor = mock.Mock()
+    cursor.fetchall.return_value = COLUMNS
+    data_source, pool = _mysql('SELECT * FROM `employee` LIMIT 100', cursor)
+    with app.app_context(), mock.patch(
+            'limonero.util.dialects.get_mysql_pool',
+            return_value=pool):
+        result = resolve_schema(data_source)
+        data_source.command = 'SELECT *\n FROM `employee`;'
+        assert resolve_schema(data_source) == result
+
+    # Second inference was a cache hit
+    cursor.execute.assert_called_once()
+    assert 'information_schema.columns' in cursor.execute.call_args[0][0]
+    assert cursor.execute.call_args[0][1] == (None, 'employee')
+    assert [(a['name'], a['type'], a['nullable']) for a in result] == [
+        ('id', DataType.LONG, False),
+        ('name', DataType.CHARACTER, True),
+        ('salary', DataType.DECIMAL, True)]
+    assert (result[2]['precision'], result[2]['scale']) == (12, 2)
+
+
+def test_resolve_query_falls_back_to_limit_0(app):
+    cursor = mock.Mock()
+    cursor.description = [('total', FIELD_TYPE.LONGLONG, None, 21, 21, 0,
+                           False)]
+    cursor.execute.side_effect = [pymysql.err.OperationalError(1060), None,
+                                  None]
+    data_source, pool = _mysql('SELECT count(*) total FROM t', cursor)
+    with app.app_context(), mock.patch(
+            'limonero.util.dialects.get_mysql_pool',
+            return_value=pool):
+        result = resolve_schema(data_source)
+        resolve_schema(data_source)
+        # Refresh ignores cached schema
+        resolve_schema(data_source, refresh=True)
+
+    assert [c[0][0] for c in cursor.execute.call_args_list] == [
+        'SELECT * FROM (SELECT count(*) total FROM t) AS limonero_schema '
+        'LIMIT 0',
+        'SELECT count(*) total FROM t LIMIT 0',
+        'SELECT * FROM (SELECT count(*) total FROM t) AS limonero_schema '
+        'LIMIT 0']
+    assert result[0]['name'] == 'total'
+    assert result[0]['type'] == DataType.LONG
@@ -1,7 +1,11 @@
 # -*- coding: utf-8 -*-
+import datetime
+from unittest import mock
+
 from flask import current_app
 
-from limonero.models import Storage, db
+from limonero.models import (CatalogTableType, DataSource, DataSourceFormat,
+                             Storage, db)
 
 
 def test_storage_fail_not_authorized(client):
@@ -169,3 +173,98 @@ def test_storage_patch_not_found_error(client, app):
     rv = client.patch(f'/storages/{storage_id + 1000}', json=update, headers=headers)
 
     assert rv.status_code == 404
+
+
+def test_storage_get_not_modified_success(client):
+    headers = {'X-Auth-Token': str(client.secret)}
+    rv = client.get('/storages/1', headers=headers)
+    assert 200 == rv.status_code, 'Incorrect status code'
+    etag = rv.headers.get('ETag')
+    assert etag is not None, 'Missing ETag'
+
+    rv = client.get('/storages/1',
+                    headers=dict(headers, **{'If-None-Match': etag}))
+    assert 304 == rv.status_code, f'Incorrect status code: {rv.status_code}'
+
+
+def test_storage_metadata_catalog_success(client, app):
+    headers = {'X-Auth-Token': str(client.secret)}
+    with app.test_request_context():
+        storage_id = Storage.query.filter(
+            Storage.name == 'MySQL Storage').first().id
+
+    columns = [{'name': 'id', 'type': 'int(11)'}]
+    crawled = {f'table_{i:02}': (CatalogTableType.TABLE, columns)
+               for i in range(30)}
+    crawled['summary'] = (CatalogTableType.VIEW, columns)
+    with mock.patch('limonero.util.catalog._crawl',
+                    return_value=crawled) as crawl:
+        rv = client.post(f'/storages/metadata/{storage_id}/refresh',
+                         headers=headers)
+        assert 200 == rv.status_code, 'Incorrect status code'
+
+        # Served from catalog, without crawling again
+        rv = client.get(f'/storages/metadata/{storage_id}', headers=headers)
+        assert 200 == rv.status_code, 'Incorrect status code'
+        assert len(rv.json['data']) == 31
+        assert crawl.call_count == 1
+
+    rv = client.get(f'/storages/metadata/{storage_id}?query=table_1&page=1'
+                    f'&size=5', headers=headers)
+    assert [t['name'] for t in rv.json['data']] == [
+        f'table_{i}' for i in range(10, 15)]
+    assert rv.json['pagination']['total'] == 10
+
+    rv = client.get(f'/storages/metadata/{storage_id}/tables/summary',
+                    headers=headers)
+    assert 200 == rv.status_code, 'Incorrect status code'
+    assert rv.json['type'] == CatalogTableType.VIEW
+    assert rv.json['columns'] == columns
+
+    # Incremental refresh: removed and changed tables
+    crawled = {'table_00': (CatalogTableType.TABLE,
+                            columns + [{'name': 'name', 'type': 'text'}])}
+    with mock.patch('limonero.util.catalog._crawl', return_value=crawled):
+        rv = client.post(f'/storages/metadata/{storage_id}/refresh',
+                         headers=headers)
+    rv = client.get(f'/storages/metadata/{storage_id}', headers=headers)
+    assert rv.json['data'] == ['table_00']
+    rv = client.get(f'/storages/metadata/{storage_id}/tables/table_00',
+                    headers=headers)
+    assert len(rv.json['columns']) == 2
+
+
+def test_storage_metadata_refresh_not_administrator_fail(client):
+    headers = {'X-User-Id': '12', 'X-Permissions': 'VIEW_DATA_SOURCE',
+               'X-User-Data': 'user;user@lemonade.org.br;User;en'}
+    with mock.patch('limonero.util.catalog._crawl') as crawl:
+        rv = client.post('/storages/metadata/4/refresh', headers=headers)
+    assert 401 == rv.status_code, 'Incorrect status code'
+    assert crawl.call_count == 0
+
+
+def test_storage_metadata_refresh_keeps_data_sources(client, app):
+    updated = datetime.datetime(2020, 1, 1)
+    with app.test_request_context():
+        storage = Storage.query.filter(Storage.name == 'MySQL Storage').one()
+        data_source = DataSource(
+            name='Employees', enabled=True, url='mysql://server:3306/db',
+            format=DataSourceFormat.JDBC, storage=storage, user_id=1,
+            user_login='admin', user_name='Admin', updated=updated,
+            command='SELECT * FROM employee')
+        db.session.add(data_source)
+        db.session.commit()
+        storage_id, data_source_id = storage.id, data_source.id
+
+    try:
+        with mock.patch('limonero.util.catalog._crawl', return_value={}):
+            rv = client.post(f'/storages/metadata/{storage_id}/refresh',
+                             headers={'X-Auth-Token': str(client.secret)})
+        assert 200 == rv.status_code, 'Incorrect status code'
+        with app.test_request_context():
+            # Catalog is not part of the data sources of the storage
+            assert DataSource.query.get(data_source_id).updated == updated
+    finally:
+        with app.test_request_context():
+            db.session.delete(DataSource.query.get(data_source_id))
+            db.session.commit()
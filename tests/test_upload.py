@@ -0,0 +1,161 @@
+# -*- coding: utf-8 -*-
+import hashlib
+import os
+import uuid
+from unittest import mock
+from urllib.parse import urlparse
+
+import limonero.util.upload_session as upload_session
+from limonero.models import DataSource, Storage, UploadSession, db
+
+
+def _upload(client, identifier, number, data, total=3, storage_id=None):
+    params = {
+        'resumableIdentifier': identifier,
+        'resumableFilename': 'people.csv',
+        'resumableChunkNumber': number,
+        'resumableTotalChunks': total,
+        'resumableTotalSize': 28,
+        'storage_id': storage_id,
+    }
+    return client.post('/datasources/upload', query_string=params,
+                       data=data,
+                       headers={'X-Auth-Token': str(client.secret)})
+
+
+def _file_storage_id(app):
+    with app.test_request_context():
+        return Storage.query.filter(Storage.name == 'File Storage').one().id
+
+
+def test_upload_chunks_out_of_order(app, client):
+    storage_id = _file_storage_id(app)
+    identifier = uuid.uuid4().hex
+    chunks = {1: b'id;name\n', 2: b'1;Maria\n2;', 3: b'Pedro\n3;Ana\n'}
+
+    for number in (3, 1):
+        rv = _upload(client, identifier, number, chunks[number],
+                     storage_id=storage_id)
+        assert 200 == rv.status_code, f'Incorrect status code: {rv.data}'
+        assert rv.json == 'OK'
+    # Chunk sent again, it is not counted twice
+    rv = _upload(client, identifier, 1, chunks[1], storage_id=storage_id)
+    assert rv.json == 'OK'
+
+    rv = client.get('/datasources/upload', query_string={
+        'resumableIdentifier': identifier, 'resumableFilename': 'people.csv',
+        'resumableChunkNumber': 2, 'storage_id': storage_id},
+        headers={'X-Auth-Token': str(client.secret)})
+    assert 404 == rv.status_code
+
+    rv = client.get('/datasources/upload/status', query_string={
+        'resumableIdentifier': identifier, 'storage_id': storage_id},
+        headers={'X-Auth-Token': str(client.secret)})
+    assert 200 == rv.status_code, f'Incorrect status code: {rv.data}'
+    assert rv.json['data']['bitmap'] == '101'
+    assert rv.json['data']['received_chunks'] == 2
+
+    rv = _upload(client, identifier, 2, chunks[2], storage_id=storage_id)
+    assert 200 == rv.status_code, f'Incorrect status code: {rv.data}'
+    data = rv.json['data']
+    assert data['format'] == 'CSV'
+    assert data['attribute_delimiter'] == ';'
+
+    path = urlparse(data['url']).path
+    with open(path, 'rb') as f:
+        assert f.read() == b''.join(chunks[i] for i in (1, 2, 3))
+
+    with app.test_request_context():
+        # Session and chunks are removed after merge
+        assert UploadSession.query.filter(
+            UploadSession.identifier == identifier).count() == 0
+        db.session.delete(DataSource.query.get(data['id']))
+        db.session.commit()
+    os.remove(path)
+
+
+def test_upload_invalid_chunk_number_fail(app, client):
+    rv = _upload(client, uuid.uuid4().hex, 4, b'data',
+                 storage_id=_file_storage_id(app))
+    assert 400 == rv.status_code
+
+
+def test_upload_status_not_found(app, client):
+    rv = client.get('/datasources/upload/status', query_string={
+        'resumableIdentifier': uuid.uuid4().hex,
+        'storage_id': _file_storage_id(app)},
+        headers={'X-Auth-Token': str(client.secret)})
+    assert 404 == rv.status_code
+    assert rv.json['status'] == 'ERROR'
+
+
+def test_upload_chunk_too_large_fail(app, client):
+    storage_id = _file_storage_id(app)
+    identifier = uuid.uuid4().hex
+    config = app.config['LIMONERO_CONFIG']
+    with mock.patch.dict(config, {'upload': {'max_chunk_size': 8}}):
+        rv = _upload(client, identifier, 1, b'0123456789',
+                     storage_id=storage_id)
+        assert 413 == rv.status_code, f'Incorrect status code: {rv.data}'
+        rv = _upload(client, identifier, 1, b'01234567',
+                     storage_id=storage_id)
+        assert 200 == rv.status_code, f'Incorrect status code: {rv.data}'
+
+    with app.test_request_context():
+        session = UploadSession.query.filter(
+            UploadSession.identifier == identifier).one()
+        chunk = session.chunks.one()
+        assert (chunk.size, chunk.checksum) == (
+            8, hashlib.sha256(b'01234567').hexdigest())
+        filesystem, parsed = upload_session.get_filesystem(session.storage)
+        upload_session.close_session(filesystem, parsed, session)
+
+
+def _upload_file(client, storage_id, chunks):
+    identifier = uuid.uuid4().hex
+    for number, data in enumerate(chunks, 1):
+        rv = _upload(client, identifier, number, data, total=len(chunks),
+                     storage_id=storage_id)
+        assert 200 == rv.status_code, f'Incorrect status code: {rv.data}'
+    return rv.json['data']
+
+
+def test_upload_deduplicated(app, client):
+    storage_id = _file_storage_id(app)
+    chunks = [b'id,name\n', b'1,Maria\n']
+    config = app.config['LIMONERO_CONFIG']
+    with mock.patch.dict(config, {'upload': {'deduplicate': True}}):
+        first = _upload_file(client, storage_id, chunks)
+        second = _upload_file(client, storage_id, chunks)
+
+    assert first['checksum'] == hashlib.sha256(b''.join(chunks)).hexdigest()
+    assert second['checksum'] == first['checksum']
+    assert second['id'] != first['id']
+    assert second['url'] == first['url']
+
+    with app.test_request_context():
+        for data in (first, second):
+            db.session.delete(DataSource.query.get(data['id']))
+        db.session.commit()
+    os.remove(urlparse(first['url']).path)
+
+
+def test_upload_corrupted_chunk_fail(app, client):
+    storage_id = _file_storage_id(app)
+    identifier = uuid.uuid4().hex
+    rv = _upload(client, identifier, 1, b'id,name\n', total=2,
+                 storage_id=storage_id)
+    assert 200 == rv.status_code, f'Incorrect status code: {rv.data}'
+
+    with app.test_request_context():
+        session = UploadSession.query.filter(
+            UploadSession.identifier == identifier).one()
+        filesystem, parsed = upload_session.get_filesystem(session.storage)
+        with open(upload_session.get_chunk_path(parsed, session, 1),
+                  'wb') as f:
+            f.write(b'changed\n')
+
+    rv = _upload(client, identifier, 2, b'1,Maria\n', total=2,
+                 storage_id=storage_id)
+    assert 400 == rv.status_code
+    assert 'corrupted' in rv.json['message']